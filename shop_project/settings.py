@@ -37,16 +37,21 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'store',
 ]
 
 MIDDLEWARE = [
+    'store.middleware.MetricsMiddleware',
+    'store.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'store.middleware.CartMiddleware',
+    'store.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -54,7 +59,8 @@ ROOT_URLCONF = 'shop_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендеринга для Server-Timing (store/metrics.py)
+        'BACKEND': 'store.metrics.TimedTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,7 +83,42 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # блокировка записи в начале транзакции: конкурирующие checkout-ы ждут busy_timeout
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # подключение живёт между запросами и проверяется перед повторным использованием
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # реплика для чтения каталога (store/db_routing.py): копия файла default,
+    # которую обновляет `manage.py sync_replica`, или standby Postgres
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-replica.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['store.db_routing.ReplicaRouter']
+# alias реплики для @replica_reads; None — все чтения с default. Включать после
+# `manage.py sync_replica` (или настройки репликации Postgres): REPLICA_DATABASE = 'replica'
+REPLICA_DATABASE = None
+# сколько секунд после записи посетитель читает каталог с default
+REPLICA_STICKY_SECONDS = 10
+
+# журнал хранится в самом файле БД, поэтому включается один раз командой
+# `manage.py enable_wal`, а не при каждом подключении
+SQLITE_JOURNAL_MODE = 'WAL'
+# PRAGMA на каждое подключение SQLite (store/database.py); ожидание занятой БД
+# задаёт только busy_timeout, OPTIONS['timeout'] драйвера не используется
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,       # мс
+    'cache_size': -20000,       # КиБ
+    'mmap_size': 134217728,     # 128 МБ
+    'temp_store': 'MEMORY',
 }
 
 
@@ -132,8 +173,65 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
 'DEFAULT_AUTHENTICATION_CLASSES': (
 'rest_framework_simplejwt.authentication.JWTAuthentication',
+# запросы со страниц сайта (AJAX) авторизуются сессией
+'rest_framework.authentication.SessionAuthentication',
 ),
 'DEFAULT_PERMISSION_CLASSES': (
 'rest_framework.permissions.IsAuthenticatedOrReadOnly',
-)
-}
\ No newline at end of file
+),
+# версия API берётся из namespace в shop_project/urls.py: api/v1/ -> 'v1'
+'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.NamespaceVersioning',
+'ALLOWED_VERSIONS': ('v1',),
+}
+# размер страницы списков API (?limit= до 200)
+API_PAGE_SIZE = 50
+# списки товаров и заказов API собираются через values() (store/fast_serializers.py)
+API_FAST_SERIALIZATION = True
+
+# счётчики SQL-запросов и времени ответа, заголовок Server-Timing (store/metrics.py);
+# сводка по страницам — /metrics/ (для staff; при DEBUG — и с адресов из INTERNAL_IPS)
+REQUEST_METRICS = True
+INTERNAL_IPS = ['127.0.0.1']
+
+# товарный фид (store/feeds.py): строк, читаемых из БД за раз
+FEED_CHUNK_SIZE = 2000
+
+# Оформление заказов: 'sync' — заказ создаётся прямо в запросе,
+# 'queue' — запрос только принимает заявку, заказы создают воркеры пачками
+ORDER_INTAKE_MODE = 'sync'
+# воркеры очереди внутри веб-процесса (0 — только `manage.py process_orders`)
+ORDER_QUEUE_WORKERS = 1
+
+# Гостевые корзины: 'cookie' — подписанная cookie, 'cache' — кеш Django
+# (в cookie только идентификатор), 'db' — строки CartItem по ключу сессии.
+# При переходе с 'db' уже сохранённые гостевые корзины (строки CartItem) не
+# видны другим бэкендам и будут собраны cleanup_carts, поэтому по умолчанию — 'db'
+GUEST_CART_BACKEND = 'db'
+
+# Сборщик брошенных гостевых корзин и просроченных сессий:
+# период в секундах для планировщика внутри веб-процесса (0 — только `manage.py cleanup_carts`)
+CART_CLEANUP_INTERVAL = 0
+# возраст гостевой корзины, после которого она удаляется даже при живой сессии
+GUEST_CART_TTL = 60 * 60 * 24 * 14
+
+# Производные загруженных изображений: 'queue' — строит фоновый воркер (таблица ImageJob),
+# 'sync' — сразу после сохранения в том же процессе
+IMAGE_PROCESSING_MODE = 'queue'
+# воркеры обработки изображений внутри веб-процесса (0 — только `manage.py process_images`)
+IMAGE_QUEUE_WORKERS = 1
+
+# Кеш: версии групп данных, фасеты, гостевые корзины (CacheCart) и фрагменты шаблонов.
+# LocMem — отдельный кеш в каждом процессе; при нескольких процессах сервера нужен
+# общий бэкенд, например 'django.core.cache.backends.filebased.FileBasedCache'
+# с LOCATION = BASE_DIR / 'cache' (или Redis/Memcached)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'store',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+# время жизни фрагментов {% cachefragment %}, с (инвалидация — по версиям групп)
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# время жизни страниц в кеше PageCacheMiddleware, с (инвалидация — по версиям групп)
+PAGE_CACHE_TIMEOUT = 60 * 10
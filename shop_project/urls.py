@@ -21,6 +21,7 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/v1/', include('store.api', namespace='v1')),
      path('', include('store.urls', namespace='store'))
 ]
 if settings.DEBUG:
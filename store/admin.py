@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from .models import (
     Category, Product, CartItem, Order, OrderItem,
-    ContactMessage, HeroBanner, Sale
+    ContactMessage, HeroBanner, Sale, OrderCommand, ImageJob
 )
 
 @admin.register(Category)
@@ -17,6 +17,8 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('category', 'updated')
     search_fields = ('title', 'description')
     prepopulated_fields = {'slug': ('title',)}
+    # агрегаты отзывов ведёт store/ratings.py
+    readonly_fields = Product.RATING_FIELDS
 
     def image_preview(self, obj):
         if obj.image:
@@ -41,6 +43,19 @@ class OrderAdmin(admin.ModelAdmin):
     readonly_fields = ('created',)
     inlines = [OrderItemInline]
 
+@admin.register(OrderCommand)
+class OrderCommandAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'order', 'created', 'updated')
+    list_filter = ('status', 'created')
+    search_fields = ('user__username', 'idempotency_key')
+    readonly_fields = ('idempotency_key', 'payload', 'claimed_by', 'order', 'error', 'created', 'updated')
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'model', 'object_id', 'field', 'status', 'attempts', 'run_after', 'updated')
+    list_filter = ('status', 'model')
+    readonly_fields = ('claimed_by', 'error', 'created', 'updated')
+
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ('user', 'product', 'quantity', 'added')
@@ -0,0 +1,169 @@
+"""
+Read-only JSON API каталога, корзины и заказов: /api/v1/.
+
+Списки постраничные по курсору (`?after=<pk>`, как на сайте, см. pagination.py),
+размер страницы — `?limit=` (не больше MAX_PAGE_SIZE). Дополнительно:
+  ?fields=id,title,price — вернуть только эти поля верхнего уровня;
+  ?ids=1,5,7             — пачка объектов по id одним запросом (до MAX_BATCH_IDS).
+
+Каждый список собирается фиксированным числом запросов независимо от размера
+страницы: связи подтягиваются select_related / prefetch_related в get_queryset,
+вложенные сериализаторы к БД не обращаются. Списки товаров и заказов
+сериализуются без создания моделей (fast_serializers.py).
+"""
+from django.conf import settings
+from django.db.models import Prefetch
+from rest_framework import permissions, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.routers import DefaultRouter
+from rest_framework.utils.urls import replace_query_param
+
+from . import fast_serializers
+from .fast_serializers import FastOrderSerializer, FastProductSerializer
+from .models import CartItem, Category, Order, OrderItem, Product, Sale
+from .pagination import keyset_paginate, parse_cursor
+from .serializers import (
+    CartItemSerializer, CategorySerializer, OrderSerializer, ProductSerializer, SaleSerializer,
+)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_IDS = 100
+
+
+def _parse_list(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+class KeysetPagination(BasePagination):
+    """Страница по курсору: {"next": <url или null>, "results": [...]}."""
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'API_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+        try:
+            size = int(request.query_params.get('limit', default))
+        except ValueError:
+            size = default
+        return min(max(size, 1), MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page = keyset_paginate(
+            queryset,
+            parse_cursor(request.query_params.get('after')),
+            self.get_page_size(request),
+            descending=getattr(view, 'descending', False),
+        )
+        return self.page.object_list
+
+    def get_next_link(self):
+        if not self.page.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), 'after', self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class StoreViewSet(viewsets.ReadOnlyModelViewSet):
+    pagination_class = KeysetPagination
+    fast_serializer_class = None
+    descending = False
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # ?fields= проверяем до запросов к БД
+        self.sparse_fields = None
+        fields = request.query_params.get('fields')
+        if fields:
+            self.sparse_fields = _parse_list(fields)
+            unknown = set(self.sparse_fields) - set(self.get_serializer_class().Meta.fields)
+            if unknown:
+                raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+
+    def get_serializer(self, *args, **kwargs):
+        if self.sparse_fields:
+            kwargs['fields'] = self.sparse_fields
+        return super().get_serializer(*args, **kwargs)
+
+    def get_fast_serializer(self):
+        """Сериализатор списков на values() (fast_serializers.py), если он есть и включён."""
+        if self.fast_serializer_class is None or not fast_serializers.enabled():
+            return None
+        return self.fast_serializer_class(self.request, self.sparse_fields)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        ids = request.query_params.get('ids')
+        if ids is not None:
+            try:
+                ids = [int(pk) for pk in _parse_list(ids)]
+            except ValueError as e:
+                raise ValidationError({'ids': "Expected comma-separated integers."}) from e
+            if len(ids) > MAX_BATCH_IDS:
+                raise ValidationError({'ids': f"At most {MAX_BATCH_IDS} ids per request."})
+            queryset = queryset.filter(pk__in=ids).order_by('pk')
+
+        fast = self.get_fast_serializer()
+        if fast is not None:
+            queryset = fast.rows(queryset)
+        rows = queryset if ids is not None else self.paginate_queryset(queryset)
+        data = fast.serialize(rows) if fast is not None else self.get_serializer(rows, many=True).data
+        if ids is not None:
+            return Response({'next': None, 'results': data})
+        return self.get_paginated_response(data)
+
+
+class ProductViewSet(StoreViewSet):
+    serializer_class = ProductSerializer
+    fast_serializer_class = FastProductSerializer
+
+    def get_queryset(self):
+        return Product.objects.with_prices().select_related('category')
+
+
+class CategoryViewSet(StoreViewSet):
+    serializer_class = CategorySerializer
+    queryset = Category.objects.all()
+
+
+class SaleViewSet(StoreViewSet):
+    serializer_class = SaleSerializer
+
+    def get_queryset(self):
+        return Sale.objects.prefetch_related(Prefetch('products', Product.objects.only('pk').order_by('pk')))
+
+
+class CartViewSet(StoreViewSet):
+    """Корзина авторизованного пользователя (гостевые корзины живут в cookie / сессии сайта)."""
+    serializer_class = CartItemSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return CartItem.objects.filter(user=self.request.user).select_related(
+            'product__pricing', 'product__category'
+        )
+
+
+class OrderViewSet(StoreViewSet):
+    serializer_class = OrderSerializer
+    fast_serializer_class = FastOrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    descending = True
+
+    def get_queryset(self):
+        items = OrderItem.objects.select_related('product__pricing', 'product__category').order_by('pk')
+        return Order.objects.filter(user=self.request.user).prefetch_related(Prefetch('items', items))
+
+
+router = DefaultRouter()
+router.register('products', ProductViewSet, basename='product')
+router.register('categories', CategoryViewSet, basename='category')
+router.register('sales', SaleViewSet, basename='sale')
+router.register('cart', CartViewSet, basename='cart')
+router.register('orders', OrderViewSet, basename='order')
+
+app_name = 'api'
+urlpatterns = router.urls
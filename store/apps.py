@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        # подключаем обработчики сигналов: цены, итоги корзин, рейтинги, поисковый индекс,
+        # версии кеша, производные изображений, настройка подключений SQLite
+        from . import caching, cart, database, image_queue, pricing, ratings, search  # noqa: F401
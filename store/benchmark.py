@@ -0,0 +1,527 @@
+"""
+Бенчмарк и нагрузочный тест страниц магазина (`manage.py bench_store`).
+
+build_catalog() наполняет БД синтетическим каталогом заданного размера:
+товары и категории (через CatalogImporter, как настоящий импорт), акции,
+баннеры, отзывы, покупатели с корзинами и историей заказов.
+
+run_routes() по очереди запрашивает каждый URL из store/urls.py тестовым
+клиентом внутри процесса: время ответа и число SQL-запросов (metrics.collect).
+run_load() поднимает локальный WSGI-сервер и гоняет по нему смесь страниц
+из нескольких потоков по HTTP: пропускная способность и хвосты задержек
+под конкурентной нагрузкой.
+
+Результаты складываются в JSON-базу (p50/p95/p99, запросов в секунду,
+SQL-запросов на ответ); compare() сравнивает две базы, например до и после
+коммита.
+"""
+import random
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Optional
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from . import metrics, urls as store_urls
+from .importer import CatalogImporter
+from .models import (
+    CartItem, HeroBanner, ImageJob, Order, OrderCommand, OrderItem, Product, Review, Sale, UserProfile,
+)
+from .pricing import refresh_prices
+from .ratings import rebuild_ratings
+
+User = get_user_model()
+
+SLUG_PREFIX = 'bench-'
+PASSWORD = 'bench-password'
+
+CATEGORIES = 40
+SALES = 8
+SALE_SHARE = 10          # в акции каждый SALE_SHARE-й товар
+REVIEWED_PRODUCTS = 200
+REVIEWS_PER_PRODUCT = 15
+BUYERS = 30
+CART_LINES = 5
+ORDERS_PER_BUYER = 12
+ORDER_LINES = 4
+# покупатели с конца списка, чьи корзины и сессии меняют маршруты; в нагрузке не участвуют
+CHECKOUT_BUYER = -1
+SESSION_BUYER = -2
+STAFF_BUYER = 0          # сводка /metrics/ доступна только staff
+
+ADJECTIVES = ('Умный', 'Беспроводной', 'Компактный', 'Игровой', 'Портативный', 'Профессиональный', 'Лёгкий')
+NOUNS = ('смартфон', 'ноутбук', 'планшет', 'монитор', 'наушники', 'колонка', 'роутер', 'фотоаппарат')
+SEARCH_QUERY = 'ноутбук'
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+# --------------------------
+# Синтетический каталог
+# --------------------------
+@dataclass
+class Catalog:
+    size: int
+    product_ids: list
+    sale_ids: list
+    buyers: list
+    cart_items: dict          # user_id -> id одной строки корзины
+    order_id: int
+    command_id: int
+    image_job_id: int
+
+    @property
+    def product_id(self):
+        return self.product_ids[len(self.product_ids) // 2]
+
+
+def _product_rows(size, rng):
+    for i in range(size):
+        category = i % CATEGORIES
+        yield i + 1, {
+            'slug': f'{SLUG_PREFIX}{i}',
+            'title': f'{ADJECTIVES[i % len(ADJECTIVES)]} {NOUNS[i % len(NOUNS)]} {i}',
+            'description': f'Синтетический товар #{i} для бенчмарка.',
+            'price': f'{rng.randint(1000, 500000)}.00',
+            'stock': 10 ** 6,
+            'category': f'Категория {category}',
+            'category_slug': f'{SLUG_PREFIX}category-{category}',
+        }
+
+
+def build_catalog(size, seed=0):
+    """Наполняет текущую БД каталогом из size товаров и возвращает load_catalog()."""
+    rng = random.Random(seed)
+    CatalogImporter(images=False).run(_product_rows(size, rng))
+    product_ids = list(Product.objects.filter(slug__startswith=SLUG_PREFIX).order_by('pk').values_list('pk', flat=True))
+
+    sales = Sale.objects.bulk_create([
+        Sale(title=f'Акция {n}', discount_percent=5 * (n + 1)) for n in range(SALES)
+    ])
+    Sale.products.through.objects.bulk_create([
+        Sale.products.through(sale_id=sales[n % SALES].pk, product_id=pk)
+        for n, pk in enumerate(product_ids[::SALE_SHARE])
+    ])
+    refresh_prices()
+    HeroBanner.objects.bulk_create([
+        HeroBanner(image=f'banners/bench-{n}.jpg', order=n, sale=sale) for n, sale in enumerate(sales[:3])
+    ])
+
+    # один хеш пароля на всех: PBKDF2 на каждого покупателя — это минуты
+    password = make_password(PASSWORD)
+    buyers = User.objects.bulk_create([
+        User(username=f'{SLUG_PREFIX}buyer-{n}', password=password, is_staff=n == STAFF_BUYER)
+        for n in range(BUYERS)
+    ])
+    UserProfile.objects.bulk_create([UserProfile(user=buyer) for buyer in buyers])  # post_save не сработал
+    CartItem.objects.bulk_create([
+        CartItem(user=buyer, product_id=rng.choice(product_ids), quantity=rng.randint(1, 3))
+        for buyer in buyers for _ in range(CART_LINES)
+    ])
+
+    reviewed = product_ids[:REVIEWED_PRODUCTS]
+    reviews = Review.objects.bulk_create([
+        Review(product_id=pk, user=buyers[n % BUYERS], rating=rng.randint(1, 5), text='Нормально')
+        for pk in reviewed for n in range(REVIEWS_PER_PRODUCT)
+    ])
+    rebuild_ratings(reviewed)
+
+    orders = Order.objects.bulk_create([
+        Order(user=buyer, full_name=buyer.username, address='-', phone='-', status='processing',
+              total=Decimal('1000.00'))
+        for buyer in buyers for _ in range(ORDERS_PER_BUYER)
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=rng.choice(product_ids), price=Decimal('250.00'))
+        for order in orders for _ in range(ORDER_LINES)
+    ])
+    OrderCommand.objects.create(user=buyers[0], idempotency_key='bench', status='done', order=orders[0])
+    ImageJob.objects.create(model='store.review', object_id=reviews[0].pk, field='image',
+                            user=buyers[0], status='done')
+    return load_catalog()
+
+
+def load_catalog():
+    """Catalog по данным, уже лежащим в БД (build_catalog() выполнялся раньше); None, если их нет."""
+    product_ids = list(Product.objects.filter(slug__startswith=SLUG_PREFIX).order_by('pk').values_list('pk', flat=True))
+    if not product_ids:
+        return None
+    buyers = list(User.objects.filter(username__startswith=f'{SLUG_PREFIX}buyer-').order_by('pk'))
+    command = OrderCommand.objects.get(user=buyers[0], idempotency_key='bench')
+    return Catalog(
+        size=len(product_ids),
+        product_ids=product_ids,
+        sale_ids=list(Sale.objects.order_by('pk').values_list('pk', flat=True)),
+        buyers=buyers,
+        cart_items=dict(CartItem.objects.filter(user__in=buyers).values_list('user_id', 'pk')),
+        order_id=command.order_id,
+        command_id=command.pk,
+        image_job_id=ImageJob.objects.filter(user=buyers[0]).values_list('pk', flat=True).first(),
+    )
+
+
+@contextmanager
+def use_database(path):
+    """Переключает alias default на файл SQLite path (с миграциями) на время блока."""
+    connection.close()
+    saved = connection.settings_dict['NAME']
+    # settings_dict общий для подключений всех потоков, их откроют уже на новый файл
+    connection.settings_dict['NAME'] = str(path)
+    try:
+        call_command('migrate', verbosity=0, interactive=False)
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = saved
+
+
+@contextmanager
+def catalog_database(size, directory, rebuild=False):
+    """
+    Файл SQLite с каталогом из size товаров в directory (use_database()): строится
+    при первом запуске и переиспользуется следующими. Отдаёт (Catalog, построен ли сейчас).
+    """
+    path = Path(directory) / f'store-bench-{size}.sqlite3'
+    if rebuild and path.exists():
+        path.unlink()
+    with use_database(path):
+        cache.clear()  # кеш мог остаться от другой БД
+        catalog = load_catalog()
+        built = catalog is None
+        yield (build_catalog(size) if built else catalog), built
+
+
+# --------------------------
+# Маршруты
+# --------------------------
+def _refill_cart(catalog, client, i):
+    user = catalog.buyers[CHECKOUT_BUYER]
+    CartItem.objects.filter(user=user).delete()
+    CartItem.objects.bulk_create([
+        CartItem(user=user, product_id=pk, quantity=1) for pk in catalog.product_ids[i:i + CART_LINES]
+    ])
+
+
+def _remember_order(catalog, client, i):
+    session = client.session
+    session['last_order_id'] = catalog.order_id
+    session.save()
+
+
+def _relogin(catalog, client, i):
+    client.force_login(catalog.buyers[SESSION_BUYER])
+
+
+@dataclass
+class Route:
+    name: str
+    method: str = 'get'
+    args: Callable = lambda catalog: []
+    data: Callable = lambda catalog, i: {}
+    user: Optional[int] = 0           # индекс покупателя в Catalog.buyers; None — аноним
+    prepare: Optional[Callable] = None  # (catalog, client, i) перед запросом, вне замера
+    limit: Optional[int] = None       # не больше стольких замеров (долгие маршруты)
+
+
+ROUTES = [
+    Route('index'),
+    Route('catalog_page'),
+    Route('product_detail', args=lambda c: [c.product_ids[0]]),
+    Route('add_review', 'post', args=lambda c: [c.product_id], data=lambda c, i: {'rating': 1 + i % 5, 'text': 'ok'}),
+    Route('add_to_cart', 'post', args=lambda c: [c.product_id], data=lambda c, i: {'quantity': 1}),
+    Route('cart'),
+    Route('update_cart', 'post', args=lambda c: [c.cart_items[c.buyers[0].pk]],
+          data=lambda c, i: {'quantity': 1 + i % 3}),
+    Route('update_cart_quantity', 'post',
+          data=lambda c, i: {'item_id': c.cart_items[c.buyers[0].pk], 'quantity': 1 + i % 3}),
+    Route('checkout', 'post', user=CHECKOUT_BUYER, prepare=_refill_cart,
+          data=lambda c, i: {'full_name': 'Bench', 'address': '-', 'phone': '-', 'idempotency_key': uuid.uuid4().hex}),
+    Route('payment_success', prepare=_remember_order),
+    Route('order_status', args=lambda c: [c.command_id]),
+    Route('orders'),
+    Route('about'),
+    Route('contact'),
+    Route('login', 'post', user=None, limit=5,
+          data=lambda c, i: {'username': c.buyers[SESSION_BUYER].username, 'password': PASSWORD}),
+    Route('register', 'post', user=None, limit=5,
+          data=lambda c, i: {'username': f'{SLUG_PREFIX}new-{uuid.uuid4().hex[:12]}', 'email': 'bench@example.com',
+                             'password1': 'Bench-Pass-42', 'password2': 'Bench-Pass-42'}),
+    Route('logout', user=SESSION_BUYER, prepare=_relogin),
+    Route('sale_list'),
+    Route('sale_detail', args=lambda c: [c.sale_ids[0]]),
+    Route('search_products', data=lambda c, i: {'q': SEARCH_QUERY}),
+    Route('catalog_feed', args=lambda c: ['csv'], limit=3),
+    Route('profile'),
+    Route('image_job_status', args=lambda c: [c.image_job_id]),
+    Route('metrics', user=STAFF_BUYER),
+]
+
+
+def percentile(values, pct):
+    """Значение по рангу (как p95 в metrics.ViewStats); values отсортированы."""
+    return values[max(int(round(len(values) * pct / 100)) - 1, 0)]
+
+
+def summarize(latencies, seconds, queries=None):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'rps': round(len(latencies) / seconds, 1) if seconds else 0.0,
+    }
+    if queries is not None:
+        summary['queries'] = queries
+    return summary
+
+
+def run_routes(catalog, requests=30, warmup=2, names=None):
+    """
+    Каждый маршрут ROUTES — requests замеров после warmup прогревочных запросов.
+    Возвращает {url name: summarize(...)}; queries — максимум SQL-запросов на ответ.
+    """
+    known = {pattern.name for pattern in store_urls.urlpatterns}
+    missing = known - {route.name for route in ROUTES}
+    if missing:
+        raise BenchmarkError(f"No benchmark route for: {', '.join(sorted(missing))}")
+
+    results = {}
+    for route in ROUTES:
+        if names and route.name not in names:
+            continue
+        client = Client()
+        if route.user is not None:
+            client.force_login(catalog.buyers[route.user])
+        url = reverse(f'store:{route.name}', args=route.args(catalog))
+        count = min(requests, route.limit or requests)
+        latencies, max_queries = [], 0
+        for i in range(warmup + count):
+            if route.prepare:
+                route.prepare(catalog, client, i)
+            with metrics.collect(route.name) as measured:
+                started = time.perf_counter()
+                response = getattr(client, route.method)(url, route.data(catalog, i))
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 400:
+                raise BenchmarkError(f'{route.name}: HTTP {response.status_code}')
+            if i >= warmup:
+                latencies.append(elapsed)
+                max_queries = max(max_queries, measured.queries)
+        results[f'store:{route.name}'] = summarize(latencies, sum(latencies) / 1000, max_queries)
+    return results
+
+
+# --------------------------
+# Нагрузка по HTTP
+# --------------------------
+# url name -> вес в смеси запросов одного посетителя
+LOAD_MIX = {
+    'index': 20,
+    'catalog_page': 10,
+    'product_detail': 25,
+    'search_products': 10,
+    'sale_detail': 5,
+    'cart': 10,
+    'update_cart_quantity': 15,
+    'orders': 5,
+}
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def local_server():
+    """Многопоточный WSGI-сервер Django на свободном порту 127.0.0.1; отдаёт базовый URL."""
+    server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler, allow_reuse_address=True)
+    server.set_app(WSGIHandler())
+    thread = threading.Thread(target=server.serve_forever, name='bench-server', daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def _visitor_requests(catalog, buyer):
+    """(url name, метод, путь, данные) для смеси LOAD_MIX от лица покупателя."""
+    rng = random.Random(buyer.pk)
+    return {
+        'index': ('get', reverse('store:index'), None),
+        'catalog_page': ('get', reverse('store:catalog_page'), None),
+        'product_detail': ('get', reverse('store:product_detail', args=[rng.choice(catalog.product_ids)]), None),
+        'search_products': ('get', f"{reverse('store:search_products')}?q={SEARCH_QUERY}", None),
+        'sale_detail': ('get', reverse('store:sale_detail', args=[rng.choice(catalog.sale_ids)]), None),
+        'cart': ('get', reverse('store:cart'), None),
+        'update_cart_quantity': ('post', reverse('store:update_cart_quantity'),
+                                 {'item_id': catalog.cart_items[buyer.pk], 'quantity': rng.randint(1, 3)}),
+        'orders': ('get', reverse('store:orders'), None),
+    }
+
+
+def _visitor_session(base_url, buyer):
+    """requests.Session с сессией Django вошедшего покупателя и CSRF-токеном."""
+    client = Client()
+    client.force_login(buyer)
+    token = get_random_string(32)
+    session = requests.Session()
+    session.cookies.set(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+    session.cookies.set(settings.CSRF_COOKIE_NAME, token)
+    session.headers['X-CSRFToken'] = token
+    return session
+
+
+def run_load(catalog, concurrency=8, duration=5.0, mix=None):
+    """
+    concurrency посетителей (по покупателю на поток) в течение duration секунд
+    запрашивают страницы из mix (по умолчанию LOAD_MIX) у local_server().
+    Число SQL-запросов берётся из сводки MetricsMiddleware сервера.
+    """
+    mix = mix or LOAD_MIX
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = []            # (url name, мс) успешных ответов
+    errors = []
+    lock = threading.Lock()
+
+    metrics.reset()
+    with local_server() as base_url:
+        visitors = [
+            (_visitor_session(base_url, buyer), _visitor_requests(catalog, buyer))
+            for buyer in (catalog.buyers[n % (len(catalog.buyers) - 2)] for n in range(concurrency))
+        ]
+        barrier = threading.Barrier(concurrency + 1)
+
+        def visitor(n, session, plan):
+            rng = random.Random(n)
+            local, failed = [], []
+            barrier.wait()
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                method, path, data = plan[name]
+                started = time.perf_counter()
+                try:
+                    response = session.request(method, base_url + path, data=data, allow_redirects=False)
+                except requests.RequestException as e:
+                    failed.append((name, str(e)))
+                    continue
+                elapsed = (time.perf_counter() - started) * 1000
+                if response.status_code >= 400:
+                    failed.append((name, f'HTTP {response.status_code}'))
+                else:
+                    local.append((name, elapsed))
+            with lock:
+                samples.extend(local)
+                errors.extend(failed)
+
+        threads = [
+            threading.Thread(target=visitor, args=(n, session, plan), name=f'bench-visitor-{n}')
+            for n, (session, plan) in enumerate(visitors)
+        ]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+    server_stats = metrics.snapshot()
+
+    if not samples:
+        raise BenchmarkError(f'No successful requests under load, errors: {errors[:5]}')
+    result = summarize([ms for _, ms in samples], seconds)
+    result.update({'concurrency': concurrency, 'seconds': round(seconds, 2), 'errors': len(errors), 'routes': {}})
+    for name in names:
+        latencies = [ms for route, ms in samples if route == name]
+        if latencies:
+            stats = server_stats.get(f'store:{name}')
+            result['routes'][f'store:{name}'] = summarize(latencies, seconds, stats and stats['avg_queries'])
+    return result
+
+
+# --------------------------
+# База результатов и сравнение
+# --------------------------
+@dataclass
+class Change:
+    catalog: str
+    section: str        # 'routes' или 'load'
+    route: str
+    metric: str
+    old: float
+    new: float
+    regression: bool = False
+
+    @property
+    def ratio(self):
+        return self.new / self.old if self.old else float('inf')
+
+
+# метрика -> True, если рост значения — это ухудшение
+COMPARED_METRICS = {'p95_ms': True, 'queries': True, 'rps': False}
+
+
+def compare(old, new, threshold=0.1):
+    """
+    Изменения между двумя базами по общим каталогам и маршрутам.
+    Регрессия: время или rps хуже больше чем на threshold, любое увеличение числа запросов.
+    """
+    changes = []
+    for size, current in new['catalogs'].items():
+        previous = old['catalogs'].get(size)
+        if not previous:
+            continue
+        pairs = [('routes', name, previous['routes'].get(name), stats) for name, stats in current['routes'].items()]
+        if 'load' in current and 'load' in previous:
+            pairs.append(('load', 'total', previous['load'], current['load']))
+            pairs += [
+                ('load', name, previous['load']['routes'].get(name), stats)
+                for name, stats in current['load']['routes'].items()
+            ]
+        for section, name, before, after in pairs:
+            if not before:
+                continue
+            for metric, higher_is_worse in COMPARED_METRICS.items():
+                if before.get(metric) is None or after.get(metric) is None:
+                    continue
+                # в процессе rps — просто 1 / среднее время; под нагрузкой доли маршрутов
+                # и попадания в кеш случайны, поэтому rps и запросы сравниваются только в целом
+                if metric == 'rps' and name != 'total' or section == 'load' and metric == 'queries':
+                    continue
+                change = Change(size, section, name, metric, before[metric], after[metric])
+                if metric == 'queries':
+                    change.regression = after[metric] > before[metric]
+                elif higher_is_worse:
+                    change.regression = change.ratio > 1 + threshold
+                else:
+                    change.regression = change.ratio < 1 - threshold
+                changes.append(change)
+    return changes
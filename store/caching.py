@@ -0,0 +1,134 @@
+"""
+Версионированные ключи кеша.
+
+Каждая группа данных (каталог, акции, баннеры...) имеет номер версии в кеше.
+Ключи кешированных значений включают версию, поэтому при изменении моделей
+достаточно увеличить версию — старые записи просто перестают читаться
+и вытесняются бэкендом кеша сами.
+
+Те же версии используются для кеша фрагментов шаблонов
+({% cachefragment %} в templatetags/store_cache.py).
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import db_routing
+from .models import Category, HeroBanner, Product, Review, Sale
+
+CATALOG = 'catalog'
+CATEGORIES = 'categories'
+SALES = 'sales'
+BANNERS = 'banners'
+
+KEY_PREFIX = 'store'
+VERSION_TIMEOUT = None  # версии не должны истекать сами по себе
+DEFAULT_TIMEOUT = 60 * 10
+
+
+def _version_key(namespace):
+    return f'{KEY_PREFIX}:version:{namespace}'
+
+
+def get_version(namespace):
+    """Текущая версия группы; при первом обращении инициализируется временем в мс."""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        initial = int(time.time() * 1000)
+        cache.add(key, initial, VERSION_TIMEOUT)
+        version = cache.get(key, initial)
+    return version
+
+
+def _bump(namespaces):
+    now = int(time.time() * 1000)
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        # версия — монотонная метка времени, она же служит моментом последнего изменения
+        cache.set(key, max(now, (cache.get(key) or 0) + 1), VERSION_TIMEOUT)
+
+
+def bump_version(*namespaces):
+    """Инвалидирует все ключи указанных групп."""
+    _bump(namespaces)
+    # запрос, прочитавший старые данные до COMMIT, мог закешировать их под новой версией;
+    # повторная отметка после коммита вытесняет такие записи
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(namespaces))
+
+
+def versioned_key(namespace, *parts):
+    suffix = ':'.join(str(part) for part in parts)
+    return f'{KEY_PREFIX}:{namespace}:{get_version(namespace)}:{suffix}'
+
+
+def fragment_key(name, namespaces, vary_on=()):
+    """Ключ фрагмента шаблона: версии всех групп, от которых он зависит, + параметры."""
+    versions = '.'.join(str(get_version(namespace)) for namespace in namespaces)
+    vary = hashlib.md5(':'.join(str(v) for v in vary_on).encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:fragment:{name}:{versions}:{vary}'
+
+
+def get_or_set(namespace, parts, default, timeout=DEFAULT_TIMEOUT):
+    """
+    cache.get_or_set по версионированному ключу; default — callable.
+    Значение, прочитанное с отстающей реплики, не сохраняется (db_routing.cacheable).
+    """
+    key = versioned_key(namespace, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = default()
+        if db_routing.cacheable([get_version(namespace)]):
+            cache.set(key, value, timeout)
+    return value
+
+
+def get_categories():
+    """Список категорий для фильтров; раньше перечитывался на каждый запрос."""
+    return get_or_set(CATEGORIES, ['all'], lambda: list(Category.objects.order_by('name')))
+
+
+# --------------------------
+# Инвалидация
+# --------------------------
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_versions(sender, **kwargs):
+    # карточки товаров есть и в каталоге, и на страницах акций
+    bump_version(CATALOG, SALES)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_catalog_version(sender, **kwargs):
+    bump_version(CATALOG)
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def bump_sale_versions(sender, **kwargs):
+    # баннеры ссылаются на акцию
+    bump_version(CATALOG, SALES, BANNERS)
+
+
+@receiver(m2m_changed, sender=Sale.products.through)
+def bump_sale_products_version(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version(CATALOG, SALES)
+
+
+@receiver(post_save, sender=HeroBanner)
+@receiver(post_delete, sender=HeroBanner)
+def bump_banner_version(sender, **kwargs):
+    bump_version(BANNERS)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_version(sender, **kwargs):
+    bump_version(CATEGORIES, CATALOG)
@@ -0,0 +1,500 @@
+"""
+Корзина.
+
+Все изменения корзины проходят через объект корзины (get_cart(request)).
+Вместе со строками корзина поддерживает агрегат: количество позиций, общее
+количество, сумму без скидок и со скидками. Агрегат меняется на дельту
+изменённой строки, поэтому AJAX-обновление количества не перечитывает корзину
+целиком; если агрегат сброшен (изменились цены), он пересчитывается одним запросом.
+
+Бэкенды:
+  DatabaseCart — строки CartItem и агрегат CartSummary; всегда для вошедших
+                 пользователей и для гостей при GUEST_CART_BACKEND = 'db'.
+  CookieCart   — гостевая корзина в подписанной cookie (GUEST_CART_BACKEND = 'cookie');
+                 корзина, не влезающая в cookie, переезжает в кеш, как у CacheCart.
+  CacheCart    — гостевая корзина в кеше Django (LocMem/Redis/Memcached),
+                 в cookie хранится только подписанный идентификатор ('cache').
+Гостевые бэкенды не пишут в БД вообще; их содержимое переносится в CartItem
+при входе пользователя (сигнал user_logged_in), а оформить заказ можно только
+после входа. Строки CartItem гостевой сессии (бэкенд 'db') переносятся при входе
+множественными UPDATE/DELETE (merge_session_cart); ключ сессии запоминается
+в самой сессии, потому что login() его меняет.
+"""
+import json
+import secrets
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from . import caching, metrics
+from .models import CartItem, CartSummary, Product
+from .pricing import prices_changed
+
+ZERO = Decimal('0.00')
+
+COOKIE_NAME = 'cart'
+# ключ сессии, под которым лежала гостевая корзина; переживает смену ключа при login()
+SESSION_CART_KEY = 'cart_session_key'
+CACHE_COOKIE_NAME = 'cart_id'
+COOKIE_SALT = 'store.cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# браузеры молча отбрасывают cookie длиннее ~4096 байт (имя, значение и атрибуты)
+COOKIE_MAX_BYTES = 4000
+
+
+class LineNotFound(Exception):
+    pass
+
+
+def format_tenge(value):
+    """₸12 345 — целые тенге с пробелом в качестве разделителя разрядов."""
+    return f"₸{Decimal(value):,.0f}".replace(",", " ")
+
+
+def _session_key(request):
+    """Возвращает session_key, создаёт если нет."""
+    if not request.session.session_key:
+        request.session.create()
+    return request.session.session_key
+
+
+class DatabaseCart:
+    """Корзина в таблице CartItem: по пользователю или по ключу сессии."""
+
+    def __init__(self, request):
+        self.request = request
+        if request.user.is_authenticated:
+            self.owner = {'user': request.user}
+        elif request.session.session_key:
+            self.owner = self._session_owner()
+        else:
+            # у гостя ещё нет сессии — корзина пуста; сессия создаётся при первом добавлении
+            self.owner = None
+        self.summary_missing = False  # UPDATE агрегата ничего не затронул — читать его незачем
+
+    def _session_owner(self):
+        session_key = _session_key(self.request)
+        if self.request.session.get(SESSION_CART_KEY) != session_key:
+            self.request.session[SESSION_CART_KEY] = session_key
+        return {'session_key': session_key}
+
+    def items(self):
+        if self.owner is None:
+            return CartItem.objects.none()
+        return CartItem.objects.filter(**self.owner).select_related('product__pricing', 'product__category')
+
+    def get_item(self, item_id):
+        """Строка корзины текущего владельца (чужие строки недоступны)."""
+        if self.owner is None:
+            raise LineNotFound(item_id)
+        try:
+            return CartItem.objects.select_related('product__pricing').get(pk=item_id, **self.owner)
+        except CartItem.DoesNotExist as e:
+            raise LineNotFound(item_id) from e
+
+    # --- изменения ---
+    def add(self, product, quantity=1):
+        if self.owner is None:
+            self.owner = self._session_owner()
+        item, created = CartItem.objects.get_or_create(defaults={'quantity': quantity}, product=product, **self.owner)
+        if not created:
+            item.quantity += quantity
+            item.save(update_fields=['quantity'])
+        self._apply_delta(product, quantity, lines=1 if created else 0)
+        return item
+
+    def set_quantity(self, item, quantity):
+        delta = quantity - item.quantity
+        if delta:
+            item.quantity = quantity
+            item.save(update_fields=['quantity'])
+            self._apply_delta(item.product, delta)
+        return item
+
+    def remove(self, item):
+        item.delete()
+        self._apply_delta(item.product, -item.quantity, lines=-1)
+
+    def clear(self):
+        if self.owner is None:
+            return
+        CartItem.objects.filter(**self.owner).delete()
+        CartSummary.objects.filter(**self.owner).delete()
+
+    def persist(self, response):
+        pass
+
+    # --- агрегат ---
+    def _apply_delta(self, product, quantity, lines=0):
+        # если агрегата ещё нет, UPDATE ничего не затронет — он построится при первом чтении
+        updated = CartSummary.objects.filter(**self.owner).update(
+            item_count=F('item_count') + lines,
+            total_quantity=F('total_quantity') + quantity,
+            original_total=F('original_total') + product.price * quantity,
+            total=F('total') + product.discounted_price * quantity,
+        )
+        self.summary_missing = not updated
+
+    def summary(self):
+        if self.owner is None:
+            return CartSummary(item_count=0, total_quantity=0, original_total=ZERO, total=ZERO)
+        summary = None if self.summary_missing else CartSummary.objects.filter(**self.owner).first()
+        if summary is None:
+            summary = self.rebuild_summary()
+        return summary
+
+    def rebuild_summary(self):
+        totals = CartItem.objects.filter(**self.owner).aggregate(
+            item_count=Count('pk'),
+            total_quantity=Coalesce(Sum('quantity'), 0),
+            original_total=Coalesce(Sum(F('quantity') * F('product__price')), ZERO),
+            total=Coalesce(
+                Sum(F('quantity') * Coalesce(F('product__pricing__price'), F('product__price'))), ZERO
+            ),
+        )
+        # один INSERT ... ON CONFLICT DO UPDATE вместо SELECT + INSERT в savepoint-ах
+        summary = CartSummary(**self.owner, **totals)
+        CartSummary.objects.bulk_create(
+            [summary], update_conflicts=True, unique_fields=list(self.owner), update_fields=[*totals, 'updated'],
+        )
+        self.summary_missing = False
+        return summary
+
+
+# --------------------------
+# Гостевые корзины без записи в БД
+# --------------------------
+class GuestCartLine:
+    """Строка гостевой корзины; pk совпадает с id товара."""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def pk(self):
+        return self.product.pk
+
+    def subtotal(self):
+        return self.product.discounted_price * self.quantity
+
+
+class GuestCart(ABC):
+    """
+    Общая логика гостевых корзин. Состояние — словарь
+    {'lines': {product_id: quantity}, 'totals': {...}, 'version': версия каталога};
+    наследники только загружают и сохраняют его.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        data = self.load() or {}
+        self.lines = {int(pid): int(qty) for pid, qty in data.get('lines', {}).items()}
+        self.totals = data.get('totals')
+        self.version = data.get('version')
+        self.dirty = False
+        self.cleared = False
+
+    # --- хранилище ---
+    @abstractmethod
+    def load(self):
+        """Сохранённое состояние или None."""
+
+    @abstractmethod
+    def save(self, response, data):
+        """Сохраняет состояние; cookie выставляются в response."""
+
+    @abstractmethod
+    def delete(self, response):
+        """Удаляет сохранённое состояние."""
+
+    def persist(self, response):
+        if self.cleared and not self.lines:
+            self.delete(response)
+        elif self.dirty:
+            self.save(response, {
+                'lines': {str(pid): qty for pid, qty in self.lines.items()},
+                'totals': self.totals,
+                'version': self.version,
+            })
+
+    # --- строки ---
+    def items(self):
+        products = Product.objects.with_prices().select_related('category').in_bulk(list(self.lines))
+        return [GuestCartLine(products[pid], qty) for pid, qty in self.lines.items() if pid in products]
+
+    def get_item(self, item_id):
+        if item_id not in self.lines:
+            raise LineNotFound(item_id)
+        product = Product.objects.with_prices().filter(pk=item_id).first()
+        if product is None:
+            raise LineNotFound(item_id)
+        return GuestCartLine(product, self.lines[item_id])
+
+    def add(self, product, quantity=1):
+        created = product.pk not in self.lines
+        self.lines[product.pk] = self.lines.get(product.pk, 0) + quantity
+        self._apply_delta(product, quantity, lines=1 if created else 0)
+        return GuestCartLine(product, self.lines[product.pk])
+
+    def set_quantity(self, item, quantity):
+        delta = quantity - item.quantity
+        if delta:
+            item.quantity = quantity
+            self.lines[item.pk] = quantity
+            self._apply_delta(item.product, delta)
+        return item
+
+    def remove(self, item):
+        self.lines.pop(item.pk, None)
+        self._apply_delta(item.product, -item.quantity, lines=-1)
+
+    def clear(self):
+        self.lines = {}
+        self.totals = None
+        self.cleared = True
+        self.dirty = True
+
+    # --- агрегат ---
+    def _apply_delta(self, product, quantity, lines=0):
+        self.dirty = True
+        if self.totals is None or self.version != caching.get_version(caching.CATALOG):
+            self.totals = None  # пересчитается при чтении
+            return
+        self.totals['item_count'] += lines
+        self.totals['total_quantity'] += quantity
+        self.totals['original_total'] = str(Decimal(self.totals['original_total']) + product.price * quantity)
+        self.totals['total'] = str(Decimal(self.totals['total']) + product.discounted_price * quantity)
+
+    def summary(self):
+        version = caching.get_version(caching.CATALOG)
+        if self.totals is None or self.version != version:
+            # цены могли измениться — пересчитываем по товарам корзины одним запросом
+            items = self.items()
+            self.totals = {
+                'item_count': len(items),
+                'total_quantity': sum(it.quantity for it in items),
+                'original_total': str(sum((it.product.price * it.quantity for it in items), ZERO)),
+                'total': str(sum((it.subtotal() for it in items), ZERO)),
+            }
+            self.version = version
+            self.dirty = True
+        return CartSummary(
+            item_count=self.totals['item_count'],
+            total_quantity=self.totals['total_quantity'],
+            original_total=Decimal(self.totals['original_total']),
+            total=Decimal(self.totals['total']),
+        )
+
+
+class CacheCart(GuestCart):
+    def __init__(self, request):
+        self.cart_id = request.get_signed_cookie(CACHE_COOKIE_NAME, default=None, salt=COOKIE_SALT)
+        self.new_id = self.cart_id is None
+        super().__init__(request)
+
+    def _cache_key(self):
+        return f'{caching.KEY_PREFIX}:cart:{self.cart_id}'
+
+    def load(self):
+        return cache.get(self._cache_key()) if self.cart_id else None
+
+    def save(self, response, data):
+        if self.cart_id is None:
+            self.cart_id = secrets.token_urlsafe(16)
+        cache.set(self._cache_key(), data, COOKIE_MAX_AGE)
+        if self.new_id:
+            response.set_signed_cookie(
+                CACHE_COOKIE_NAME, self.cart_id, salt=COOKIE_SALT,
+                max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+            )
+
+    def delete(self, response):
+        if self.cart_id:
+            cache.delete(self._cache_key())
+        response.delete_cookie(CACHE_COOKIE_NAME, samesite='Lax')
+
+
+class CookieCart(CacheCart):
+    """
+    Корзина в подписанной cookie. Если состояние не помещается в COOKIE_MAX_BYTES,
+    оно сохраняется в кеш, а в cookie остаётся только идентификатор (как у CacheCart).
+    """
+
+    def load(self):
+        if self.cart_id:
+            return super().load()
+        value = self.request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT)
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+
+    def save(self, response, data):
+        if self.cart_id is None:
+            response.set_signed_cookie(
+                COOKIE_NAME, json.dumps(data, separators=(',', ':')), salt=COOKIE_SALT,
+                max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+            )
+            if len(response.cookies[COOKIE_NAME].OutputString()) <= COOKIE_MAX_BYTES:
+                return
+            del response.cookies[COOKIE_NAME]
+        # корзина не влезает в cookie (или уже в кеше) — хранится в кеше
+        super().save(response, data)
+        if COOKIE_NAME in self.request.COOKIES:
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+
+    def delete(self, response):
+        if self.cart_id:
+            super().delete(response)
+        response.delete_cookie(COOKIE_NAME, samesite='Lax')
+
+
+GUEST_BACKENDS = {
+    'db': DatabaseCart,
+    'cookie': CookieCart,
+    'cache': CacheCart,
+}
+
+
+def guest_cart_class():
+    return GUEST_BACKENDS[getattr(settings, 'GUEST_CART_BACKEND', 'db')]
+
+
+def _register(request, cart):
+    carts = getattr(request, '_carts', None)
+    if carts is None:
+        carts = request._carts = []
+    carts.append(cart)
+    return cart
+
+
+def get_cart(request):
+    """Корзина текущего посетителя; один объект на запрос."""
+    cart = getattr(request, '_cart', None)
+    if cart is None or (request.user.is_authenticated and not isinstance(cart, DatabaseCart)):
+        cls = DatabaseCart if request.user.is_authenticated else guest_cart_class()
+        cart = request._cart = _register(request, cls(request))
+    return cart
+
+
+def persist_carts(request, response):
+    """Сохраняет изменённые гостевые корзины в ответ (вызывается из CartMiddleware)."""
+    for cart in getattr(request, '_carts', ()):
+        cart.persist(response)
+    return response
+
+
+# --------------------------
+# Перенос гостевой корзины при входе
+# --------------------------
+def merge_lines_into_user(user, lines):
+    """
+    Добавляет {product_id: quantity} в корзину пользователя за постоянное число
+    запросов: существующие строки увеличиваются одним bulk_update, новые
+    создаются одним bulk_create.
+    """
+    if not lines:
+        return
+    existing = {it.product_id: it for it in CartItem.objects.filter(user=user, product_id__in=list(lines))}
+    valid_ids = set(Product.objects.filter(pk__in=list(lines)).values_list('pk', flat=True))
+
+    to_update, to_create = [], []
+    for product_id, quantity in lines.items():
+        if product_id in existing:
+            existing[product_id].quantity += quantity
+            to_update.append(existing[product_id])
+        elif product_id in valid_ids:
+            to_create.append(CartItem(user=user, product_id=product_id, quantity=quantity))
+
+    CartItem.objects.bulk_update(to_update, ['quantity'])
+    CartItem.objects.bulk_create(to_create)
+    CartSummary.objects.filter(user=user).delete()
+
+
+def merge_session_cart(session_key, user):
+    """
+    Переносит строки CartItem гостевой сессии в корзину пользователя
+    шестью запросами независимо от размера корзины:
+      1. UPDATE строк пользователя: quantity += сумма по тем же товарам из сессии;
+      2. DELETE строк сессии, уже учтённых в шаге 1;
+      3. UPDATE первой строки сессии по каждому товару: quantity = сумма по товару;
+      4. DELETE остальных строк сессии по тем же товарам;
+      5. UPDATE оставшихся строк сессии: владелец — пользователь;
+      6. DELETE устаревших агрегатов обеих корзин.
+    Товары, которые уже есть у пользователя или встречаются в сессии несколько
+    раз (unique_together не действует при NULL в user), складываются в одну
+    строку, а не дублируются. Возвращает число перенесённых строк.
+    """
+    session_rows = CartItem.objects.filter(session_key=session_key)
+    user_rows = CartItem.objects.filter(user=user, session_key__isnull=True)
+    session_totals = (
+        session_rows.filter(product_id=OuterRef('product_id'))
+        .values('product_id').annotate(total=Sum('quantity')).values('total')[:1]
+    )
+    first_rows = session_rows.values('product_id').annotate(first=Min('pk')).values('first')
+    with transaction.atomic():
+        user_rows.filter(product_id__in=session_rows.values('product_id')).update(
+            quantity=F('quantity') + Subquery(session_totals)
+        )
+        session_rows.filter(product_id__in=user_rows.values('product_id')).delete()
+        session_rows.filter(pk__in=first_rows).update(quantity=Subquery(session_totals))
+        session_rows.exclude(pk__in=first_rows).delete()
+        moved = session_rows.update(user=user, session_key=None)
+        CartSummary.objects.filter(Q(user=user) | Q(session_key=session_key)).delete()
+    return moved
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    if request is None:
+        return
+
+    session_key = request.session.pop(SESSION_CART_KEY, None)
+    if session_key:
+        metrics.mark_scenario(metrics.CART_MERGE)
+        merge_session_cart(session_key, user)
+
+    cls = guest_cart_class()
+    if cls is not DatabaseCart:
+        guest = _register(request, cls(request))
+        if guest.lines:
+            metrics.mark_scenario(metrics.CART_MERGE)
+            merge_lines_into_user(user, guest.lines)
+        guest.clear()
+    request._cart = None
+
+
+# --------------------------
+# Сброс агрегатов при изменении цен
+# --------------------------
+def invalidate_summaries(product_ids=None):
+    """Сбрасывает агрегаты корзин, где есть товары с изменившейся ценой."""
+    if product_ids is None:
+        return CartSummary.objects.all().delete()
+    lines = CartItem.objects.filter(product_id__in=list(product_ids))
+    return CartSummary.objects.filter(
+        Q(user__in=lines.filter(user__isnull=False).values('user'))
+        | Q(session_key__in=lines.filter(session_key__isnull=False).values('session_key'))
+    ).delete()
+
+
+@receiver(prices_changed)
+def reset_summaries_on_price_change(sender, product_ids, **kwargs):
+    invalidate_summaries(product_ids)
+
+
+@receiver(pre_delete, sender=Product)
+def reset_summaries_on_product_delete(sender, instance, **kwargs):
+    # до каскадного удаления строк корзины, пока ещё видно, в чьих корзинах товар
+    invalidate_summaries([instance.pk])
@@ -0,0 +1,138 @@
+"""
+Оформление заказа одной транзакцией.
+
+1. Корзина читается одним запросом вместе с материализованными ценами.
+2. Остаток каждой позиции резервируется условным UPDATE
+   ... SET stock = stock - n WHERE id = %s AND stock >= n, поэтому два
+   покупателя не могут одновременно купить последнюю единицу: второй UPDATE
+   просто не найдёт строку с достаточным остатком. Число изменённых строк
+   каждого UPDATE показывает, какой позиции не хватило.
+3. Заказ создаётся сразу с итоговой суммой, позиции — одним bulk_create.
+
+Любая ошибка откатывает всю транзакцию, включая уже списанные остатки.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CartItem, CartSummary, Order, OrderItem, Product
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCartError(CheckoutError):
+    def __init__(self):
+        super().__init__("Ваша корзина пуста.")
+
+
+class OutOfStockError(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        titles = ', '.join(p.title for p in products)
+        super().__init__(f"Недостаточно товара на складе: {titles}.")
+
+
+def _group_lines(items):
+    """Складывает количества по товару (в корзине товар может встречаться несколько раз)."""
+    lines = OrderedDict()
+    for it in items:
+        if it.product_id in lines:
+            lines[it.product_id]['quantity'] += it.quantity
+        else:
+            lines[it.product_id] = {'product': it.product, 'quantity': it.quantity}
+    return lines
+
+
+def snapshot_cart(user):
+    """Снимок корзины для отложенного оформления: [[product_id, quantity], ...] и id строк."""
+    items = list(CartItem.objects.filter(user=user).values_list('pk', 'product_id', 'quantity'))
+    quantities = OrderedDict()
+    for _, product_id, quantity in items:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return [[pid, qty] for pid, qty in quantities.items()], [pk for pk, _, _ in items]
+
+
+def reserve_stock(lines):
+    """
+    Списывает остатки позиций условным UPDATE на каждую строку.
+    Возвращает товары, которых не хватило; вызывающий код обязан откатить транзакцию.
+    """
+    # updated отмечаем явно: по нему товарный фид (feeds.py) видит изменение остатков
+    now = timezone.now()
+    short = []
+    for product_id, line in sorted(lines.items()):
+        reserved = Product.objects.filter(pk=product_id, stock__gte=line['quantity']).update(
+            stock=F('stock') - line['quantity'], updated=now,
+        )
+        if not reserved:
+            short.append(line['product'])
+    return short
+
+
+def create_order(user, full_name, address, phone, lines, cart_item_ids, status='processing'):
+    """
+    Резервирует остатки и создаёт заказ по уже сгруппированным позициям
+    ({product_id: {'product': Product, 'quantity': n}}), затем удаляет строки корзины.
+    Вызывается внутри transaction.atomic().
+    """
+    short = reserve_stock(lines)
+    if short:
+        raise OutOfStockError(short)
+
+    order_items = []
+    total = Decimal('0.00')
+    for line in lines.values():
+        product = line['product']
+        price = product.discounted_price
+        order_items.append(OrderItem(
+            product=product,
+            price=price,
+            quantity=line['quantity'],
+            original_price=product.price,
+            discount_percent=product.discount_percent if price < product.price else 0,
+        ))
+        total += price * line['quantity']
+
+    order = Order.objects.create(
+        user=user,
+        full_name=full_name,
+        address=address,
+        phone=phone,
+        status=status,
+        total=total,
+    )
+    for order_item in order_items:
+        order_item.order = order
+    OrderItem.objects.bulk_create(order_items)
+
+    CartItem.objects.filter(pk__in=cart_item_ids).delete()
+    CartSummary.objects.filter(user=user).delete()
+    return order
+
+
+def place_order(user, full_name, address, phone, status='processing'):
+    """Создаёт заказ из корзины пользователя. Бросает EmptyCartError / OutOfStockError."""
+    with transaction.atomic():
+        items = list(CartItem.objects.filter(user=user).select_related('product__pricing'))
+        if not items:
+            raise EmptyCartError()
+        return create_order(user, full_name, address, phone, _group_lines(items),
+                            [it.pk for it in items], status=status)
+
+
+def place_order_from_snapshot(user, full_name, address, phone, snapshot, cart_item_ids, status='processing'):
+    """Оформление по снимку корзины (очередь заказов): товары и цены читаются одним запросом."""
+    with transaction.atomic():
+        products = Product.objects.with_prices().in_bulk([pid for pid, _ in snapshot])
+        lines = OrderedDict(
+            (pid, {'product': products[pid], 'quantity': qty})
+            for pid, qty in snapshot if pid in products
+        )
+        if not lines:
+            raise EmptyCartError()
+        return create_order(user, full_name, address, phone, lines, cart_item_ids, status=status)
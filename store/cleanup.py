@@ -0,0 +1,149 @@
+"""
+Сборщик мусора: брошенные гостевые корзины и просроченные сессии.
+
+Строки CartItem по ключу сессии, их агрегаты CartSummary и таблица django_session
+сами не очищаются. Удаление идёт пачками по batch_size строк, каждая пачка —
+отдельная короткая транзакция, поэтому SQLite не блокируется надолго, а между
+пачками можно сделать паузу, чтобы пропустить запросы сайта.
+
+Гостевая корзина считается брошенной, если её сессия истекла или удалена,
+либо строка старше GUEST_CART_TTL секунд (по умолчанию SESSION_COOKIE_AGE).
+
+Запуск: `manage.py cleanup_carts` (cron) или планировщик внутри веб-процесса
+при CART_CLEANUP_INTERVAL > 0 (секунды между проходами).
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import CartItem, CartSummary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+@dataclass
+class CleanupReport:
+    cart_items: int = 0
+    cart_summaries: int = 0
+    sessions: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def total(self):
+        return self.cart_items + self.cart_summaries + self.sessions
+
+
+def guest_cart_ttl():
+    return timedelta(seconds=getattr(settings, 'GUEST_CART_TTL', settings.SESSION_COOKIE_AGE))
+
+
+def sessions_in_db():
+    return settings.SESSION_ENGINE in DB_SESSION_ENGINES
+
+
+def _abandoned(queryset, date_field, now):
+    """Гостевые строки queryset, чья сессия истекла/удалена или которые старше TTL."""
+    condition = Q(**{f'{date_field}__lt': now - guest_cart_ttl()})
+    if sessions_in_db():
+        live = Session.objects.filter(expire_date__gte=now).values('session_key')
+        condition |= ~Q(session_key__in=live)
+    return queryset.filter(session_key__isnull=False).filter(condition)
+
+
+def _delete_in_batches(queryset, batch_size, pause, report):
+    """Удаляет строки queryset пачками по первичному ключу. Возвращает число удалённых."""
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # у CartItem/CartSummary/Session нет зависимых строк, поэтому это один DELETE
+        deleted += queryset.model.objects.filter(pk__in=ids).delete()[0]
+        report.batches += 1
+        if len(ids) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def collect_garbage(batch_size=DEFAULT_BATCH_SIZE, pause=0.0):
+    """Удаляет брошенные гостевые корзины и просроченные сессии. Возвращает CleanupReport."""
+    started = time.perf_counter()
+    now = timezone.now()
+    report = CleanupReport()
+
+    report.cart_items = _delete_in_batches(
+        _abandoned(CartItem.objects.all(), 'added', now), batch_size, pause, report)
+    report.cart_summaries = _delete_in_batches(
+        _abandoned(CartSummary.objects.all(), 'updated', now), batch_size, pause, report)
+    if sessions_in_db():
+        report.sessions = _delete_in_batches(
+            Session.objects.filter(expire_date__lt=now), batch_size, pause, report)
+
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+# --------------------------
+# Планировщик внутри веб-процесса
+# --------------------------
+class CleanupScheduler:
+    def __init__(self, interval, batch_size=DEFAULT_BATCH_SIZE, pause=0.0):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='cart-cleanup', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                close_old_connections()
+                report = collect_garbage(self.batch_size, self.pause)
+            except DatabaseError:
+                logger.exception("Cart cleanup failed")
+            else:
+                logger.info("Cart cleanup freed %d rows in %.2fs", report.total, report.seconds)
+        close_old_connections()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler():
+    """Запускает планировщик один раз на процесс; None, если CART_CLEANUP_INTERVAL = 0."""
+    global _scheduler
+    interval = getattr(settings, 'CART_CLEANUP_INTERVAL', 0)
+    if not interval:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CleanupScheduler(interval).start()
+    return _scheduler
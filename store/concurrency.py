@@ -0,0 +1,88 @@
+"""
+Стенд конкурентных покупок: много покупателей одновременно оформляют
+заказ на один и тот же товар. Используется в тестах (проверка, что остаток
+не уходит в минус и последняя единица не продаётся дважды) и в бенчмарках.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+
+from .checkout import OutOfStockError, place_order
+from .models import CartItem
+
+User = get_user_model()
+
+
+@dataclass
+class CheckoutRunReport:
+    buyers: int
+    succeeded: int = 0
+    out_of_stock: int = 0
+    failed: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+    order_ids: list = field(default_factory=list)
+
+    @property
+    def throughput(self):
+        """Успешных заказов в секунду."""
+        return self.succeeded / self.elapsed if self.elapsed else 0.0
+
+
+def prepare_buyers(product, count, quantity=1, prefix='buyer'):
+    """Создаёт count пользователей, у каждого в корзине quantity единиц product."""
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}-{product.pk}-{i}') for i in range(count)
+    ])
+    if not all(u.pk for u in users):
+        users = list(User.objects.filter(username__startswith=f'{prefix}-{product.pk}-').order_by('pk'))
+    CartItem.objects.bulk_create([
+        CartItem(user=u, product=product, quantity=quantity) for u in users
+    ])
+    return users
+
+
+def run_concurrent_checkouts(users, max_attempts=50, retry_delay=0.005):
+    """
+    Запускает по потоку на покупателя; все стартуют одновременно (barrier).
+    Ошибки блокировки SQLite («database is locked») повторяются с паузой,
+    как это сделал бы клиент, остальные исходы считаются в отчёте.
+    """
+    report = CheckoutRunReport(buyers=len(users))
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(users))
+
+    def buyer(user):
+        barrier.wait()
+        outcome, retries, order_id = 'failed', 0, None
+        try:
+            for attempt in range(max_attempts):
+                try:
+                    order_id = place_order(user, user.username, 'test address', '000').pk
+                    outcome = 'succeeded'
+                    break
+                except OutOfStockError:
+                    outcome = 'out_of_stock'
+                    break
+                except OperationalError:
+                    retries += 1
+                    time.sleep(retry_delay * (attempt + 1))
+        finally:
+            connection.close()
+        with lock:
+            setattr(report, outcome, getattr(report, outcome) + 1)
+            report.retries += retries
+            if order_id:
+                report.order_ids.append(order_id)
+
+    threads = [threading.Thread(target=buyer, args=(u,)) for u in users]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report.elapsed = time.perf_counter() - started
+    return report
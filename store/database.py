@@ -0,0 +1,71 @@
+"""
+Настройка подключений SQLite.
+
+На каждое новое подключение (сигнал connection_created) выполняются PRAGMA
+из settings.SQLITE_PRAGMAS (единственное место, где они заданы):
+  synchronous=NORMAL — в режиме WAL fsync только на контрольных точках: коммит
+                       не ждёт диска, при сбое питания теряются лишь последние коммиты;
+  busy_timeout       — занятая БД ждёт до N мс вместо мгновенного «database is locked»;
+  cache_size         — кеш страниц подключения (отрицательное значение — в КиБ);
+  mmap_size          — чтение файла через отображение в память без копирования;
+  temp_store=MEMORY  — временные B-деревья сортировок и GROUP BY в памяти.
+
+Режим журнала (settings.SQLITE_JOURNAL_MODE = 'WAL': читатели не ждут писателя,
+писатель не ждёт читателей) записывается в сам файл БД и сохраняется между
+подключениями. Он включается один раз командой `manage.py enable_wal` при
+развёртывании, а не при каждом подключении: иначе любой manage.py или прогон
+тестов молча переводил бы db.sqlite3 в WAL и оставлял рядом файлы -wal/-shm.
+
+Остальное — в settings.DATABASES: OPTIONS['transaction_mode'] = 'IMMEDIATE'
+(транзакция сразу берёт блокировку записи; в режиме DEFERRED повышение блокировки
+чтения до записи при конкуренции падает сразу, не дожидаясь busy_timeout),
+CONN_MAX_AGE и CONN_HEALTH_CHECKS — подключение переживает запрос и проверяется
+перед повторным использованием.
+"""
+import re
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def get_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def apply_pragmas(connection, pragmas=None):
+    """Выполняет PRAGMA на открытом подключении SQLite."""
+    pragmas = get_pragmas() if pragmas is None else pragmas
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            # PRAGMA не принимает параметры запроса, поэтому значения проверяются
+            if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(str(value)):
+                raise ValueError(f'Bad SQLite pragma {name}={value!r}')
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def set_journal_mode(connection, mode=None):
+    """Однократно переводит файл БД в режим журнала mode; возвращает итоговый режим."""
+    mode = mode or getattr(settings, 'SQLITE_JOURNAL_MODE', 'WAL')
+    apply_pragmas(connection, {'journal_mode': mode})
+    return current_pragmas(connection, ['journal_mode'])['journal_mode']
+
+
+def current_pragmas(connection, names=None):
+    """{pragma: значение} для подключения — проверить, что настройки применились."""
+    values = {}
+    with connection.cursor() as cursor:
+        for name in names or get_pragmas():
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+    return values
+
+
+@receiver(connection_created, dispatch_uid='store.database.configure_sqlite')
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        apply_pragmas(connection)
@@ -0,0 +1,137 @@
+"""
+Чтение каталога с реплики БД.
+
+Страницы каталога помечены декоратором @replica_reads: их запросы на чтение
+моделей каталога (CATALOG_MODELS) уходят на alias settings.REPLICA_DATABASE,
+а сессии, пользователи, корзина, заказы и любая запись — на default: отставшая
+реплика не должна показывать вошедшего посетителя анонимом или старую корзину. Читающая нагрузка каталога масштабируется отдельно от оформления
+заказов (реплика — копия файла SQLite или standby Postgres).
+
+Реплика отстаёт от основной БД (`manage.py sync_replica` для локального файла,
+репликация для Postgres). Чтобы посетитель видел свои изменения (read-your-writes),
+ReplicaPinMiddleware (middleware.py) после запроса с записью ставит cookie на
+REPLICA_STICKY_SECONDS:
+пока она жива, страницы каталога для него читаются с default.
+
+Версии кеша (caching.py) увеличиваются сразу при записи, а реплика догоняет позже,
+поэтому отрендеренное по данным реплики нельзя сохранять под новой версией:
+кеши фрагментов и страниц спрашивают cacheable(versions). sync_replica отмечает
+момент копирования (mark_replica_synced), и пока отметка старше версий, прочитанное
+с реплики не кешируется. Отметка хранится в общем кеше, как и сами версии; для
+реплики Postgres её ставит то, что следит за репликацией, иначе страницы,
+прочитанные с реплики, не кешируются вовсе.
+"""
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'db_pin'
+DEFAULT_STICKY_SECONDS = 10
+SYNCED_KEY = 'store:replica:synced'
+# модели, которые @replica_reads читает с реплики (app_label.model_name)
+CATALOG_MODELS = frozenset({
+    'store.product', 'store.productprice', 'store.category', 'store.sale',
+    'store.sale_products', 'store.herobanner', 'store.review',
+})
+
+
+@dataclass
+class RoutingState:
+    pinned: bool = False   # посетитель недавно писал — читать с default
+    wrote: bool = False    # в этом запросе была запись
+    read_replica: bool = False  # в этом запросе было чтение с реплики
+
+
+_state = contextvars.ContextVar('store_db_routing', default=None)
+_replica_reads = contextvars.ContextVar('store_replica_reads', default=False)
+
+
+def replica_alias():
+    """Alias реплики или None, если она не настроена."""
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+
+
+@contextmanager
+def routing_state(pinned=False):
+    """Состояние маршрутизации одного запроса (ReplicaPinMiddleware); отдаёт RoutingState."""
+    state = RoutingState(pinned=pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def mark_replica_synced(timestamp_ms=None):
+    """Запоминает момент (мс, как версии в caching.py), по состоянию на который реплика полна."""
+    cache.set(SYNCED_KEY, timestamp_ms or int(time.time() * 1000), None)
+
+
+def cacheable(versions):
+    """
+    Можно ли сохранить в кеш результат текущего запроса под версиями versions:
+    да, если он не читал реплику или реплика синхронизирована после всех этих версий.
+    """
+    if replica_alias() is None:
+        return True
+    state = _state.get()
+    if state is not None and not state.read_replica:
+        return True
+    synced = cache.get(SYNCED_KEY)
+    return synced is not None and synced >= max(versions, default=0)
+
+
+def replica_reads(view):
+    """Чтения внутри view идут на реплику (если посетитель не закреплён за default)."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    """DATABASE_ROUTERS: чтения каталога в @replica_reads — на реплику, остальное — на default."""
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or model._meta.label_lower not in CATALOG_MODELS:
+            return None
+        state = _state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return DEFAULT_DB_ALIAS
+        alias = replica_alias()
+        if state is not None and alias is not None:
+            state.read_replica = True
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема приходит на реплику вместе с данными
+        if db == replica_alias():
+            return False
+        return None
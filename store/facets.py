@@ -0,0 +1,185 @@
+"""
+Фасеты для страницы поиска.
+
+Счётчики по категориям, ценовым диапазонам, наличию скидки и рейтингу
+считаются двумя запросами (условная агрегация + GROUP BY по категории)
+и кешируются по ключу «текст запроса + версия каталога». Версия каталога
+увеличивается сигналами (см. caching.py), так что при неизменном каталоге
+боковая панель фильтров отдаётся из кеша без обращения к БД.
+
+Ценовые диапазоны и фильтр по цене считаются по итоговой цене (ProductPrice,
+с учётом акций), а не по базовой: товар со скидкой попадает в тот диапазон,
+по цене которого его и продают.
+"""
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, F, Q
+from django.db.models.functions import Coalesce
+
+from . import caching
+
+# (ключ, нижняя граница включительно, верхняя граница не включительно), ₸
+PRICE_BUCKETS = (
+    ('0-10000', None, Decimal('10000')),
+    ('10000-50000', Decimal('10000'), Decimal('50000')),
+    ('50000-100000', Decimal('50000'), Decimal('100000')),
+    ('100000-250000', Decimal('100000'), Decimal('250000')),
+    ('250000-', Decimal('250000'), None),
+)
+
+RATING_BANDS = (4, 3, 2, 1)
+
+# итоговая цена из таблицы цен (pricing.py); базовая — если строки цены ещё нет
+EFFECTIVE_PRICE = Coalesce(F('pricing__price'), F('price'))
+
+
+def _min_rating_q(min_rating):
+    # агрегаты отзывов хранятся в Product (ratings.py):
+    # средняя >= n  <=>  сумма оценок >= n * количество отзывов, без деления в SQL
+    return Q(review_count__gt=0, rating_sum__gte=F('review_count') * min_rating)
+
+
+def filter_min_rating(queryset, min_rating):
+    return queryset.filter(_min_rating_q(min_rating))
+
+
+def _price_q(low, high):
+    q = Q()
+    if low is not None:
+        q &= Q(effective_price__gte=low)
+    if high is not None:
+        q &= Q(effective_price__lt=high)
+    return q
+
+
+def parse_price(value):
+    """Граница цены из параметра запроса; пусто или мусор — без ограничения."""
+    try:
+        price = Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+    return price if price.is_finite() else None
+
+
+def filter_price(queryset, min_price=None, max_price=None):
+    """Товары с итоговой ценой в [min_price, max_price] (границы включительно)."""
+    queryset = queryset.alias(effective_price=EFFECTIVE_PRICE)
+    if min_price is not None:
+        queryset = queryset.filter(effective_price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(effective_price__lte=max_price)
+    return queryset
+
+
+def compute_facets(queryset):
+    """Считает все фасеты для queryset без кеша."""
+    base = queryset.order_by().alias(effective_price=EFFECTIVE_PRICE)
+    aggregates = {
+        'total': Count('pk'),
+        'discounted': Count('pk', filter=Q(pricing__discount_percent__gt=0)),
+    }
+    for key, low, high in PRICE_BUCKETS:
+        aggregates[f'price:{key}'] = Count('pk', filter=_price_q(low, high))
+    for band in RATING_BANDS:
+        aggregates[f'rating:{band}'] = Count('pk', filter=_min_rating_q(band))
+    counts = base.aggregate(**aggregates)
+
+    by_category = dict(
+        queryset.order_by().values_list('category_id').annotate(n=Count('pk')).values_list('category_id', 'n')
+    )
+
+    return {
+        'total': counts['total'],
+        'discounted': counts['discounted'],
+        'price': [(key, low, high, counts[f'price:{key}']) for key, low, high in PRICE_BUCKETS],
+        'rating': [(band, counts[f'rating:{band}']) for band in RATING_BANDS],
+        'category': by_category,
+    }
+
+
+def get_facets(queryset, query=''):
+    """Фасеты для результатов текстового запроса (боковые фильтры на счётчики не влияют)."""
+    digest = hashlib.md5(query.lower().encode('utf-8')).hexdigest()
+    return caching.get_or_set(caching.CATALOG, ['facets', digest], lambda: compute_facets(queryset))
+
+
+def build_facet_links(params, facets, categories):
+    """
+    Превращает счётчики в элементы навигации: подпись, количество, ссылка
+    с текущими параметрами запроса и признак выбранного значения.
+    """
+    def link(**changes):
+        query = params.copy()
+        for name, value in changes.items():
+            query.pop(name, None)
+            if value not in (None, ''):
+                query[name] = value
+        return f'?{query.urlencode()}'
+
+    selected_category = params.get('category', '')
+    category_links = [
+        {
+            'label': c.name,
+            'count': facets['category'].get(c.pk, 0),
+            'url': link(category=None if selected_category == str(c.pk) else c.pk),
+            'selected': selected_category == str(c.pk),
+        }
+        for c in categories
+        if facets['category'].get(c.pk)
+    ]
+
+    price_links = []
+    for _key, low, high, count in facets['price']:
+        min_price, max_price = _fmt(low), _fmt_upper(high)
+        selected = params.get('min_price', '') == min_price and params.get('max_price', '') == max_price
+        price_links.append({
+            'label': _price_label(low, high),
+            'count': count,
+            'url': link(min_price=None, max_price=None) if selected else link(min_price=min_price, max_price=max_price),
+            'selected': selected,
+        })
+
+    selected_rating = params.get('min_rating', '')
+    rating_links = [
+        {
+            'label': f'{band}★ и выше',
+            'count': count,
+            'url': link(min_rating=None if selected_rating == str(band) else band),
+            'selected': selected_rating == str(band),
+        }
+        for band, count in facets['rating']
+    ]
+
+    discount_selected = params.get('has_discount') == '1'
+    discount_link = {
+        'label': 'Со скидкой',
+        'count': facets['discounted'],
+        'url': link(has_discount=None if discount_selected else '1'),
+        'selected': discount_selected,
+    }
+
+    return {
+        'total': facets['total'],
+        'category': category_links,
+        'price': price_links,
+        'rating': rating_links,
+        'discount': discount_link,
+    }
+
+
+def _fmt(value):
+    return '' if value is None else str(int(value))
+
+
+def _fmt_upper(value):
+    # фильтр max_price включает границу, а диапазон фасета — нет
+    return '' if value is None else str(value - Decimal('0.01'))
+
+
+def _price_label(low, high):
+    if low is None:
+        return f'до ₸{int(high):,}'.replace(',', ' ')
+    if high is None:
+        return f'от ₸{int(low):,}'.replace(',', ' ')
+    return f'₸{int(low):,} – ₸{int(high):,}'.replace(',', ' ')
@@ -0,0 +1,141 @@
+"""
+Быстрая сериализация списков товаров и заказов для API (api.py).
+
+DRF-сериализаторы (serializers.py) создают модель на каждую строку и проходят
+по дереву полей вложенных сериализаторов; на больших списках это основная
+часть времени ответа. Здесь строки читаются через values() и сразу собираются
+в словари того же вида: ключи в том же порядке, числа и даты в том же формате,
+поэтому JSON ответа совпадает с DRF байт в байт (проверяется в тестах и
+командой `manage.py bench_serializers`).
+
+При изменении полей в serializers.py нужно поправить и этот модуль.
+Отключается настройкой API_FAST_SERIALIZATION = False.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework import serializers
+
+from .models import OrderItem, Product
+from .pricing import CENT
+
+PRODUCT_FIELDS = ('id', 'title', 'slug', 'description', 'price', 'discounted_price', 'discount_percent',
+                  'stock', 'category', 'image')
+ORDER_FIELDS = ('id', 'full_name', 'address', 'phone', 'status', 'total', 'items', 'created')
+
+PRODUCT_VALUES = (
+    'id', 'title', 'slug', 'description', 'price', 'stock', 'image',
+    'category_id', 'category__name', 'category__slug',
+    'pricing__price', 'pricing__base_price', 'pricing__discount_percent',
+)
+ORDER_VALUES = ('pk', 'full_name', 'address', 'phone', 'status', 'total', 'created')
+
+_datetime = serializers.DateTimeField()
+
+
+def enabled():
+    return getattr(settings, 'API_FAST_SERIALIZATION', True)
+
+
+def _decimal(value):
+    # как DecimalField(decimal_places=2) с COERCE_DECIMAL_TO_STRING
+    return None if value is None else '{:f}'.format(value.quantize(CENT))
+
+
+def _prefixed(prefix, names):
+    return tuple(prefix + name for name in names)
+
+
+class FastProductSerializer:
+    """Товары в формате ProductSerializer; строки — values() с полями PRODUCT_VALUES."""
+    fields = PRODUCT_FIELDS
+
+    def __init__(self, request=None, fields=None):
+        self.request = request
+        self.selected = tuple(name for name in PRODUCT_FIELDS if fields is None or name in fields)
+        self.storage = Product._meta.get_field('image').storage
+
+    def rows(self, queryset):
+        return queryset.values('pk', *PRODUCT_VALUES)
+
+    def image_url(self, name):
+        if not name:
+            return None
+        url = self.storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def product(self, row, prefix=''):
+        """Словарь товара из строки values(); prefix — путь к товару ('product__')."""
+        get = row.__getitem__
+        if get(prefix + 'id') is None:
+            return None
+        price = get(prefix + 'price')
+        base_price = get(prefix + 'pricing__base_price')
+        category_id = get(prefix + 'category_id')
+        # та же логика, что в Product.discounted_price / discount_percent
+        values = {
+            'id': get(prefix + 'id'),
+            'title': get(prefix + 'title'),
+            'slug': get(prefix + 'slug'),
+            'description': get(prefix + 'description'),
+            'price': _decimal(price),
+            'discounted_price': _decimal(get(prefix + 'pricing__price') if base_price == price else price),
+            'discount_percent': get(prefix + 'pricing__discount_percent') if base_price is not None else 0,
+            'stock': get(prefix + 'stock'),
+            'category': None if category_id is None else {
+                'id': category_id,
+                'name': get(prefix + 'category__name'),
+                'slug': get(prefix + 'category__slug'),
+            },
+            'image': self.image_url(get(prefix + 'image')),
+        }
+        if len(self.selected) == len(PRODUCT_FIELDS):
+            return values
+        return {name: values[name] for name in self.selected}
+
+    def serialize(self, rows):
+        return [self.product(row) for row in rows]
+
+
+class FastOrderSerializer:
+    """Заказы в формате OrderSerializer: заказы и все их позиции — два запроса."""
+    fields = ORDER_FIELDS
+
+    def __init__(self, request=None, fields=None):
+        self.selected = tuple(name for name in ORDER_FIELDS if fields is None or name in fields)
+        self.products = FastProductSerializer(request)
+
+    def rows(self, queryset):
+        return queryset.prefetch_related(None).values(*ORDER_VALUES)
+
+    def items_by_order(self, order_ids):
+        items = defaultdict(list)
+        product = self.products.product
+        rows = OrderItem.objects.filter(order_id__in=order_ids).order_by('pk').values(
+            'order_id', 'price', 'quantity', *_prefixed('product__', PRODUCT_VALUES)
+        )
+        for row in rows:
+            items[row['order_id']].append({
+                'product': product(row, 'product__'),
+                'price': _decimal(row['price']),
+                'quantity': row['quantity'],
+            })
+        return items
+
+    def serialize(self, rows):
+        rows = list(rows)
+        items = self.items_by_order([row['pk'] for row in rows]) if 'items' in self.selected else {}
+        data = []
+        for row in rows:
+            values = {
+                'id': row['pk'],
+                'full_name': row['full_name'],
+                'address': row['address'],
+                'phone': row['phone'],
+                'status': row['status'],
+                'total': _decimal(row['total']),
+                'items': items.get(row['pk'], []),
+                'created': _datetime.to_representation(row['created']),
+            }
+            data.append({name: values[name] for name in self.selected})
+        return data
@@ -0,0 +1,217 @@
+"""
+Фоновая обработка загруженных изображений.
+
+add_review, profile_view и админка только сохраняют файл; построение производных
+(images.py) — самая долгая часть загрузки — выполняется вне запроса.
+После сохранения объекта с новым файлом создаётся задание ImageJob, которое
+выполняют воркеры: потоки внутри веб-процесса (IMAGE_QUEUE_WORKERS) и/или
+отдельный процесс `manage.py process_images`. Статус задания отдаёт
+`uploads/<job_id>/status/`.
+
+Неудачное задание повторяется до MAX_ATTEMPTS раз с растущей паузой; непредвиденная
+ошибка (битый файл, ошибка в коде) сразу помечает задание неудачным.
+
+Режим задаётся settings.IMAGE_PROCESSING_MODE:
+  'queue' — задание в таблице ImageJob, запрос сразу возвращается;
+  'sync'  — обработка сразу после коммита транзакции в том же процессе.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+from PIL import Image
+
+from .images import IMAGE_FIELDS, Rendition, process_instance
+from .models import ImageJob
+from .workers import LazyPool, WorkerPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5
+DEFAULT_POLL_INTERVAL = 2.0
+MAX_ATTEMPTS = 3
+RETRY_DELAY = timedelta(seconds=30)
+STALE_AFTER = timedelta(minutes=10)
+
+# ошибки, после которых задание имеет смысл повторить (файл ещё не доступен, сбой хранилища)
+PROCESSING_ERRORS = (OSError, Image.DecompressionBombError)
+
+PROFILE_BY_FIELD = {(model._meta.label_lower, field): profile for model, field, profile in IMAGE_FIELDS}
+
+
+def processing_mode():
+    return getattr(settings, 'IMAGE_PROCESSING_MODE', 'sync')
+
+
+def enqueue(instance, field_name, user_id=None):
+    """
+    Создаёт задание для поля объекта (повторная загрузка до обработки не плодит дублей).
+    Задание запоминается на объекте, чтобы ответ на загрузку не перечитывал его (latest_job).
+    """
+    lookup = {'model': instance._meta.label_lower, 'object_id': instance.pk, 'field': field_name}
+    # уникального ключа нет, поэтому get_or_create (с его savepoint-ами) не защитил бы от гонки
+    job = ImageJob.objects.filter(status='pending', **lookup).first()
+    if job is None:
+        job = ImageJob.objects.create(user_id=user_id, **lookup)
+        notify_workers()
+    if not hasattr(instance, '_image_jobs'):
+        instance._image_jobs = {}
+    instance._image_jobs[field_name] = job
+    return job
+
+
+def enqueue_many(model, field_name, object_ids):
+    """
+    Задания для множества объектов двумя запросами (массовый импорт, bulk_update без сигналов).
+    Воркеры не будятся: вызывающий — обычно команда, а не веб-процесс, и запущенный
+    в ней пул писал бы в БД параллельно с импортом; задания заберут воркеры сайта
+    или `manage.py process_images`.
+    """
+    label = model._meta.label_lower
+    object_ids = set(object_ids)
+    pending = set(ImageJob.objects.filter(
+        model=label, field=field_name, status='pending', object_id__in=object_ids,
+    ).values_list('object_id', flat=True))
+    jobs = ImageJob.objects.bulk_create([
+        ImageJob(model=label, object_id=pk, field=field_name) for pk in sorted(object_ids - pending)
+    ])
+    return len(jobs)
+
+
+def latest_job(instance, field_name):
+    """Последнее задание для поля объекта (для ответа на загрузку со ссылкой на статус)."""
+    job = getattr(instance, '_image_jobs', {}).get(field_name)
+    if job is not None:
+        return job
+    return ImageJob.objects.filter(
+        model=instance._meta.label_lower, object_id=instance.pk, field=field_name,
+    ).order_by('-pk').first()
+
+
+def run_job(job):
+    """
+    Выполняет задание; при ошибке откладывает повтор или помечает задание неудачным.
+    Ошибки БД не перехватываются: задание возвращает в очередь process_batch.
+    """
+    job.attempts += 1
+    try:
+        model = apps.get_model(job.model)
+        process_instance(model, job.object_id, job.field, PROFILE_BY_FIELD[(job.model, job.field)])
+    except DatabaseError:
+        raise
+    except PROCESSING_ERRORS as e:
+        logger.warning("Image job #%s failed (attempt %s): %s", job.pk, job.attempts, e)
+        job.error = str(e)
+        if job.attempts < MAX_ATTEMPTS:
+            job.status = 'pending'
+            job.run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        else:
+            job.status = 'failed'
+    except Exception as e:
+        logger.exception("Image job #%s failed", job.pk)
+        job.status = 'failed'
+        job.error = f'{type(e).__name__}: {e}'
+    else:
+        job.status = 'done'
+        job.error = ''
+    job.claimed_by = ''
+    job.save(update_fields=['status', 'attempts', 'run_after', 'error', 'claimed_by', 'updated'])
+    return job
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """Забирает готовые к запуску задания условным UPDATE (как claim_batch в order_queue.py)."""
+    now = timezone.now()
+    ids = list(
+        ImageJob.objects.filter(status='pending', run_after__lte=now)
+        .order_by('run_after', 'pk').values_list('pk', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    ImageJob.objects.filter(pk__in=ids, status='pending').update(
+        status='processing', claimed_by=token, updated=now
+    )
+    return list(ImageJob.objects.filter(claimed_by=token, status='processing').order_by('pk'))
+
+
+def release(jobs):
+    """Сразу возвращает в очередь ещё не выполненные задания пачки (не дожидаясь STALE_AFTER)."""
+    return ImageJob.objects.filter(
+        pk__in=[job.pk for job in jobs], status='processing',
+    ).update(status='pending', claimed_by='')
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """Выполняет пачку заданий по одному, без общей транзакции: обработка файла долгая."""
+    jobs = claim_batch(batch_size)
+    try:
+        for job in jobs:
+            run_job(job)
+    except Exception:
+        release(jobs)
+        raise
+    return len(jobs)
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Возвращает в очередь задания, застрявшие в processing (воркер упал)."""
+    return ImageJob.objects.filter(
+        status='processing', updated__lt=timezone.now() - older_than
+    ).update(status='pending', claimed_by='')
+
+
+# --------------------------
+# Пул воркеров
+# --------------------------
+class ImageWorkerPool(WorkerPool):
+    def __init__(self, workers=1, batch_size=DEFAULT_BATCH_SIZE, poll_interval=DEFAULT_POLL_INTERVAL):
+        super().__init__(process_batch, workers, batch_size, poll_interval, name='image-worker',
+                         maintenance=requeue_stale)
+
+
+_pool = LazyPool(ImageWorkerPool, 'IMAGE_QUEUE_WORKERS')
+
+
+def get_worker_pool():
+    """Пул воркеров внутри веб-процесса; None, если IMAGE_QUEUE_WORKERS = 0."""
+    return _pool.get()
+
+
+def notify_workers():
+    pool = get_worker_pool()
+    if pool:
+        transaction.on_commit(pool.wake)
+
+
+# --------------------------
+# Запуск после загрузки
+# --------------------------
+def _process_now(model, pk, field_name, profile):
+    try:
+        process_instance(model, pk, field_name, profile)
+    except PROCESSING_ERRORS:
+        logger.exception("Could not build derivatives for %s #%s", model.__name__, pk)
+
+
+def _connect(model, field_name, profile):
+    def schedule_derivatives(sender, instance, raw=False, **kwargs):
+        fieldfile = getattr(instance, field_name)
+        if raw or not fieldfile or Rendition.from_name(fieldfile.name):
+            return
+        if processing_mode() == 'queue':
+            enqueue(instance, field_name, user_id=getattr(instance, 'user_id', None))
+        else:
+            transaction.on_commit(lambda: _process_now(model, instance.pk, field_name, profile))
+
+    post_save.connect(schedule_derivatives, sender=model, weak=False,
+                      dispatch_uid=f'images:{model.__name__}.{field_name}')
+
+
+for _model, _field, _profile in IMAGE_FIELDS:
+    _connect(_model, _field, _profile)
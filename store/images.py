@@ -0,0 +1,205 @@
+"""
+Производные изображения: уменьшенные копии в AVIF/WebP и JPEG для srcset.
+
+После загрузки картинки (Product, Sale, HeroBanner, Review, UserProfile) оригинал
+переименовывается по содержимому: `<каталог>/<sha256[:16]>-<W>-<форматы>.<ext>`,
+где W — ширина самой крупной производной, а форматы — первые буквы расширений
+построенных производных (`awj` — AVIF, WebP и JPEG): воркер без AVIF не должен
+приводить к ссылкам на несуществующие файлы. Производные лежат в
+`derivatives/<sha256[:16]>/<ширина>.<avif|webp|jpg>`.
+
+Имя файла целиком описывает набор производных, поэтому тег {% picture %}
+строит srcset без запросов к БД и к хранилищу, а файлы можно отдавать с
+бессрочным кешированием: при новом содержимом меняется и имя. Одинаковые
+загрузки (один баннер, загруженный трижды) дают одни и те же файлы.
+
+Обработку запускает image_queue.py после сохранения объекта (фоновым воркером
+или сразу после коммита), для уже загруженных файлов — команда
+`manage.py build_image_derivatives`. Файлы, ещё не прошедшие обработку,
+тег отдаёт как есть.
+"""
+import hashlib
+import io
+import os
+import posixpath
+import re
+from dataclasses import dataclass
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from . import caching
+from .models import HeroBanner, Product, Review, Sale, UserProfile
+
+DERIVATIVES_DIR = 'derivatives'
+
+# ширины производных для каждого вида изображений, px
+PROFILES = {
+    'product': (240, 480, 960),
+    'sale': (480, 960, 1600),
+    'banner': (640, 1280, 1920),
+    'review': (192, 384, 768),
+    'avatar': (64, 128, 256),
+}
+
+# (модель, поле, профиль)
+IMAGE_FIELDS = (
+    (Product, 'image', 'product'),
+    (Sale, 'image', 'sale'),
+    (HeroBanner, 'image', 'banner'),
+    (Review, 'image', 'review'),
+    (UserProfile, 'avatar', 'avatar'),
+)
+
+# (расширение, формат Pillow, MIME, параметры сохранения); JPEG — запасной формат, всегда последний
+FORMATS = (
+    ('avif', 'AVIF', 'image/avif', {'quality': 55, 'speed': 6}),
+    ('webp', 'WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+HASHED_NAME = re.compile(r'(?P<digest>[0-9a-f]{16})-(?P<width>\d+)(?:-(?P<formats>[a-z]+))?\.\w+$')
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if fmt[1] == 'JPEG' or features.check(fmt[1].lower())]
+
+
+def derivative_widths(profile, max_width):
+    """Ширины производных для оригинала шириной max_width (без увеличения)."""
+    widths = [w for w in PROFILES[profile] if w < max_width]
+    return widths + [min(max_width, PROFILES[profile][-1])]
+
+
+def derivative_name(digest, width, ext):
+    return posixpath.join(DERIVATIVES_DIR, digest, f'{width}.{ext}')
+
+
+def format_codes(formats):
+    """Отметка форматов для имени оригинала: первые буквы расширений."""
+    return ''.join(ext[0] for ext, _, _, _ in formats)
+
+
+@dataclass
+class Rendition:
+    digest: str
+    max_width: int
+    codes: str = None  # None — имя без отметки форматов (обработано до её появления)
+
+    @classmethod
+    def from_name(cls, name):
+        """Разбирает имя обработанного оригинала; None — файл ещё не обработан."""
+        match = HASHED_NAME.search(name or '')
+        if not match:
+            return None
+        return cls(match['digest'], int(match['width']), match['formats'])
+
+    def formats(self):
+        """Форматы, в которых построены производные (JPEG — последним)."""
+        if self.codes is None:
+            return available_formats()
+        return [fmt for fmt in FORMATS if fmt[0][0] in self.codes]
+
+    def largest_name(self, profile, ext):
+        return derivative_name(self.digest, derivative_widths(profile, self.max_width)[-1], ext)
+
+    def srcset(self, profile, ext, storage):
+        return ', '.join(
+            f'{storage.url(derivative_name(self.digest, w, ext))} {w}w'
+            for w in derivative_widths(profile, self.max_width)
+        )
+
+
+# --------------------------
+# Обработка
+# --------------------------
+def _resized(image, width):
+    if image.width <= width:
+        return image
+    height = round(image.height * width / image.width)
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def _encode(image, pil_format, options):
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+
+def build_derivatives(content, profile, storage):
+    """
+    Сохраняет производные для байтов оригинала. Возвращает (digest, max_width, formats).
+    Уже существующие файлы не перезаписываются: имена зависят только от содержимого.
+    """
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    with Image.open(io.BytesIO(content)) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    widths = derivative_widths(profile, image.width)
+    formats = available_formats()
+    for width in widths:
+        resized = _resized(image, width)
+        for ext, pil_format, _, options in formats:
+            name = derivative_name(digest, width, ext)
+            if not storage.exists(name):
+                storage.save(name, ContentFile(_encode(resized, pil_format, options)))
+    return digest, widths[-1], formats
+
+
+def process_field(instance, field_name, profile):
+    """
+    Строит производные для поля instance и переименовывает оригинал по содержимому.
+    Поле обновляется через queryset.update(), чтобы не запускать сигналы повторно, и
+    только если в нём всё ещё старое имя: файл, загруженный заново во время обработки,
+    не затирается, а старый оригинал в этом случае не удаляется. Вместе с полем
+    обновляется updated (если есть) — по нему товарный фид видит новые ссылки.
+    Возвращает True, если файл обработан сейчас.
+    """
+    fieldfile = getattr(instance, field_name)
+    if not fieldfile or Rendition.from_name(fieldfile.name):
+        return False
+
+    storage = fieldfile.storage
+    with storage.open(fieldfile.name, 'rb') as f:
+        content = f.read()
+    digest, max_width, formats = build_derivatives(content, profile, storage)
+
+    directory, filename = posixpath.split(fieldfile.name)
+    ext = os.path.splitext(filename)[1].lower() or '.jpg'
+    hashed_name = posixpath.join(directory, f'{digest}-{max_width}-{format_codes(formats)}{ext}')
+    if not storage.exists(hashed_name):
+        hashed_name = storage.save(hashed_name, ContentFile(content))
+    old_name = fieldfile.name
+    model = type(instance)
+    changes = {field_name: hashed_name}
+    if any(f.name == 'updated' for f in model._meta.concrete_fields):
+        changes['updated'] = timezone.now()
+    if not model._default_manager.filter(pk=instance.pk, **{field_name: old_name}).update(**changes):
+        return False
+    setattr(instance, field_name, hashed_name)
+    if old_name != hashed_name and not _is_referenced(old_name):
+        storage.delete(old_name)
+    return True
+
+
+def _is_referenced(name):
+    """Файл может использоваться несколькими объектами — удаляем, только если ссылок не осталось."""
+    return any(model._default_manager.filter(**{field: name}).exists() for model, field, _ in IMAGE_FIELDS)
+
+
+def process_instance(model, pk, field_name, profile):
+    """Обрабатывает поле объекта по pk; ошибки чтения/декодирования пробрасываются вызывающему."""
+    instance = model._default_manager.filter(pk=pk).first()
+    if instance is None:
+        return False
+    processed = process_field(instance, field_name, profile)
+    if processed:
+        # закешированные фрагменты страниц ссылаются на старое имя файла
+        caching.bump_version(caching.CATALOG, caching.SALES, caching.BANNERS)
+    return processed
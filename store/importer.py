@@ -0,0 +1,270 @@
+"""
+Массовый импорт каталога из CSV / JSON Lines (`manage.py import_catalog`).
+
+Строки читаются потоком и обрабатываются пачками по chunk_size. На пачку —
+несколько запросов вместо нескольких на каждую строку:
+  * категории и товары — bulk_create(update_conflicts=True) по slug (upsert);
+  * цены (pricing.py) и поисковый индекс (search.py) обновляются для всей пачки,
+    сигналы post_save при bulk_create не срабатывают;
+  * картинки скачиваются (http/https) или копируются (локальный путь) пулом
+    потоков ограниченного размера, имена файлов записываются одним bulk_update,
+    производные строятся фоновыми заданиями (image_queue.py).
+
+Колонки: slug, title, price — обязательные; description, stock, category
+(название), category_slug, image (URL или путь к файлу) — необязательные.
+Строки с ошибками пропускаются и попадают в отчёт.
+"""
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+
+import requests
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.utils.text import slugify
+
+from . import caching, image_queue
+from .models import Category, Product
+from .pricing import CENT, refresh_prices
+from .search import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_IMAGE_WORKERS = 8
+IMAGE_TIMEOUT = 10
+MAX_REPORTED_ERRORS = 100
+
+PRODUCT_UPDATE_FIELDS = ['title', 'description', 'price', 'stock', 'category', 'updated']
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    categories: int = 0
+    images: int = 0
+    image_errors: int = 0
+    seconds: float = 0.0
+    errors: list = field(default_factory=list)   # [(номер строки, сообщение)], не больше MAX_REPORTED_ERRORS
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def add_error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+# --------------------------
+# Чтение файла
+# --------------------------
+def read_rows(path, fmt=None):
+    """Пары (номер строки, словарь) из CSV или JSONL; формат по расширению, если не задан."""
+    fmt = fmt or ('jsonl' if Path(path).suffix.lower() in ('.jsonl', '.ndjson', '.json') else 'csv')
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, RowError(f'invalid JSON: {e.msg}')
+
+
+def parse_row(row):
+    """Проверяет и приводит строку файла к полям товара; RowError — строку нужно пропустить."""
+    if isinstance(row, Exception):
+        raise row
+    values = {key: (str(value).strip() if value is not None else '') for key, value in row.items() if key}
+    for required in ('slug', 'title', 'price'):
+        if not values.get(required):
+            raise RowError(f'missing {required}')
+    # slug попадает в имя файла картинки (products/<slug>.jpg)
+    try:
+        validate_slug(values['slug'])
+    except ValidationError as e:
+        raise RowError(f"bad slug {values['slug']!r}") from e
+    try:
+        price = Decimal(values['price']).quantize(CENT)
+    except InvalidOperation as e:
+        raise RowError(f"bad price {values['price']!r}") from e
+    try:
+        stock = int(values.get('stock') or 0)
+    except ValueError as e:
+        raise RowError(f"bad stock {values['stock']!r}") from e
+    if price < 0 or stock < 0:
+        raise RowError('negative price or stock')
+    if price.adjusted() >= 8:  # Product.price: max_digits=10, decimal_places=2
+        raise RowError(f'price too large: {price}')
+
+    category = values.get('category', '')
+    return {
+        'slug': values['slug'],
+        'title': values['title'],
+        'description': values.get('description', ''),
+        'price': price,
+        'stock': stock,
+        'category': category,
+        'category_slug': values.get('category_slug') or (slugify(category, allow_unicode=True) if category else ''),
+        'image': values.get('image', ''),
+    }
+
+
+# --------------------------
+# Картинки
+# --------------------------
+def fetch_image(source, image_root=None):
+    """Байты картинки по URL или пути (относительные пути — от image_root)."""
+    if source.startswith(('http://', 'https://')):
+        response = requests.get(source, timeout=IMAGE_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    path = Path(source)
+    if not path.is_absolute() and image_root:
+        path = Path(image_root) / path
+    return path.read_bytes()
+
+
+def _store_image(slug, source, image_root, storage):
+    content = fetch_image(source, image_root)
+    if not content:
+        raise OSError('empty file')
+    ext = os.path.splitext(source.split('?', 1)[0])[1].lower() or '.jpg'
+    return storage.save(f'products/{slug}{ext}', ContentFile(content))
+
+
+# --------------------------
+# Импорт
+# --------------------------
+class CatalogImporter:
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, image_workers=DEFAULT_IMAGE_WORKERS,
+                 image_root=None, images=True, refresh_images=False):
+        self.chunk_size = chunk_size
+        self.image_workers = image_workers
+        self.image_root = image_root
+        self.images = images
+        self.refresh_images = refresh_images
+        self.category_ids = {}  # slug -> pk, накапливается между пачками
+        self.storage = Product._meta.get_field('image').storage
+        self.report = ImportReport()
+
+    def run(self, rows):
+        """rows — пары (номер строки, словарь), см. read_rows(). Возвращает ImportReport."""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.image_workers, thread_name_prefix='import-image') as executor:
+            self.executor = executor
+            rows = iter(rows)
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.import_chunk(chunk)
+        # страницы и фрагменты с каталогом, акциями и категориями устарели
+        caching.bump_version(caching.CATALOG, caching.SALES, caching.CATEGORIES)
+        self.report.seconds = time.perf_counter() - started
+        return self.report
+
+    def import_chunk(self, chunk):
+        parsed = {}
+        for line, row in chunk:
+            self.report.rows += 1
+            try:
+                values = parse_row(row)
+            except RowError as e:
+                self.report.add_error(line, str(e))
+                continue
+            parsed[values['slug']] = values  # повтор slug в пачке: побеждает последняя строка
+        if not parsed:
+            return
+
+        with transaction.atomic():
+            existing = {
+                slug: (pk, image) for slug, pk, image in
+                Product.objects.filter(slug__in=parsed).values_list('slug', 'pk', 'image')
+            }
+            self._upsert_categories(parsed.values())
+            products = [
+                Product(
+                    slug=slug, title=v['title'], description=v['description'], price=v['price'],
+                    stock=v['stock'], category_id=self.category_ids.get(v['category_slug']),
+                )
+                for slug, v in parsed.items()
+            ]
+            Product.objects.bulk_create(
+                products, update_conflicts=True, unique_fields=['slug'], update_fields=PRODUCT_UPDATE_FIELDS,
+            )
+            ids = dict(Product.objects.filter(slug__in=parsed).values_list('slug', 'pk'))
+            for product in products:
+                product.pk = ids[product.slug]
+            refresh_prices(ids.values())
+            get_search_backend().index_products(products)
+
+        self.report.created += len(parsed) - len(existing)
+        self.report.updated += len(existing)
+        if self.images:
+            self._import_images(parsed, ids, existing)
+
+    def _upsert_categories(self, rows):
+        names = {v['category_slug']: v['category'] for v in rows if v['category_slug']}
+        missing = {slug: name for slug, name in names.items() if slug not in self.category_ids}
+        if not missing:
+            return
+        Category.objects.bulk_create(
+            [Category(slug=slug, name=name) for slug, name in missing.items()],
+            update_conflicts=True, unique_fields=['slug'], update_fields=['name'],
+        )
+        self.category_ids.update(Category.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+        self.report.categories += len(missing)
+
+    def _import_images(self, parsed, ids, existing):
+        # уже загруженные картинки повторно не качаем, если не просили
+        todo = [
+            (slug, v['image']) for slug, v in parsed.items()
+            if v['image'] and (self.refresh_images or not existing.get(slug, (None, ''))[1])
+        ]
+        if not todo:
+            return
+
+        def store(item):
+            slug, source = item
+            try:
+                return slug, _store_image(slug, source, self.image_root, self.storage)
+            except (OSError, requests.RequestException, SuspiciousFileOperation) as e:
+                logger.warning("Could not import image %s for %s: %s", source, slug, e)
+                return slug, None
+
+        saved = [Product(pk=ids[slug], image=name) for slug, name in self.executor.map(store, todo) if name]
+        self.report.images += len(saved)
+        self.report.image_errors += len(todo) - len(saved)
+        if saved:
+            with transaction.atomic():
+                Product.objects.bulk_update(saved, ['image'])
+                image_queue.enqueue_many(Product, 'image', [p.pk for p in saved])
+
+
+def import_catalog(path, fmt=None, **options):
+    """Импортирует файл каталога; options — параметры CatalogImporter. Возвращает ImportReport."""
+    return CatalogImporter(**options).run(read_rows(path, fmt))
@@ -0,0 +1,79 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from store.models import CartItem, Product, Sale
+from store.pricing import refresh_prices
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the AJAX cart quantity endpoint for growing cart sizes (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,50,100,250,500',
+                            help='Comma-separated cart sizes (number of lines)')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per cart size')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*']):
+                rows = self._run(sizes, options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"{'lines':>6} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8}")
+        for size, p50, p95, queries in rows:
+            self.stdout.write(f"{size:>6} {p50:>8.2f} {p95:>8.2f} {queries:>8}")
+
+    def _run(self, sizes, requests):
+        products = Product.objects.bulk_create([
+            Product(title=f'bench {i}', slug=f'bench-cart-{i}', price=Decimal('1000.00') + i, stock=1000)
+            for i in range(max(sizes))
+        ])
+        sale = Sale.objects.create(title='bench', discount_percent=15)
+        sale.products.add(*products[::3])
+        refresh_prices([p.pk for p in products])
+
+        url = reverse('store:update_cart_quantity')
+        rows = []
+        for size in sizes:
+            user = User.objects.create_user(f'bench-cart-{size}')
+            items = CartItem.objects.bulk_create([
+                CartItem(user=user, product=p, quantity=1) for p in products[:size]
+            ])
+            client = Client()
+            client.force_login(user)
+            target = items[size // 2].pk
+            # первый запрос строит агрегат корзины, в замеры не входит
+            client.post(url, {'item_id': target, 'quantity': 2})
+
+            timings = []
+            with CaptureQueriesContext(connection) as queries:
+                for i in range(requests):
+                    started = time.perf_counter()
+                    response = client.post(url, {'item_id': target, 'quantity': 2 + i % 5})
+                    timings.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code == 200, response.content
+            timings.sort()
+            rows.append((
+                size,
+                statistics.median(timings),
+                timings[int(len(timings) * 0.95) - 1],
+                len(queries) // requests,
+            ))
+        return rows
@@ -0,0 +1,67 @@
+import tempfile
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from store.benchmark import use_database
+from store.concurrency import prepare_buyers, run_concurrent_checkouts
+from store.database import current_pragmas
+from store.models import Product
+
+
+@contextmanager
+def sqlite_profile(pragmas, options):
+    """PRAGMA и OPTIONS подключения на время блока (settings_dict общий для всех потоков)."""
+    saved = connection.settings_dict['OPTIONS']
+    connection.close()
+    connection.settings_dict['OPTIONS'] = options
+    try:
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            yield
+    finally:
+        connection.close()
+        connection.settings_dict['OPTIONS'] = saved
+
+
+class Command(BaseCommand):
+    help = ('Parallel checkouts on a fresh SQLite file with Django defaults and with the tuned '
+            'settings (WAL, IMMEDIATE transactions, busy_timeout): orders per second and lock retries')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=40, help='Concurrent buyers per round')
+        parser.add_argument('--rounds', type=int, default=3, help='Rounds per profile, the median is reported')
+
+    def handle(self, *args, **options):
+        profiles = {
+            'django defaults': ({}, {}),
+            # файл свежий, поэтому режим журнала задаётся вместе с остальными PRAGMA
+            'tuned': (
+                {'journal_mode': settings.SQLITE_JOURNAL_MODE, **settings.SQLITE_PRAGMAS},
+                settings.DATABASES['default'].get('OPTIONS', {}),
+            ),
+        }
+        self.stdout.write(
+            f"{'profile':<16} {'journal':>8} {'orders':>7} {'failed':>7} {'retries':>8} {'seconds':>8} {'orders/s':>9}"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            for n, (name, (pragmas, db_options)) in enumerate(profiles.items()):
+                with sqlite_profile(pragmas, db_options), use_database(Path(directory) / f'contention-{n}.sqlite3'):
+                    journal = current_pragmas(connection, ['journal_mode'])['journal_mode']
+                    reports = [self._round(r, options['buyers']) for r in range(options['rounds'])]
+                report = sorted(reports, key=lambda r: r.throughput)[len(reports) // 2]
+                self.stdout.write(
+                    f"{name:<16} {journal:>8} {report.succeeded:>7} {report.failed:>7} {report.retries:>8} "
+                    f"{report.elapsed:>8.2f} {report.throughput:>9.1f}"
+                )
+
+    def _round(self, n, buyers):
+        product = Product.objects.create(
+            title=f'contention {n}', slug=f'contention-{n}', price=Decimal('1000.00'), stock=buyers,
+        )
+        users = prepare_buyers(product, buyers, prefix=f'contention-{n}')
+        return run_concurrent_checkouts(users)
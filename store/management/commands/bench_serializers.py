@@ -0,0 +1,102 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from store.fast_serializers import FastOrderSerializer, FastProductSerializer
+from store.models import Category, Order, OrderItem, Product, Sale
+from store.pricing import refresh_prices
+from store.serializers import OrderSerializer, ProductSerializer
+
+User = get_user_model()
+
+ITEMS_PER_ORDER = 10
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF and values()-based serialization of product and order lists (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Products in the list; orders get the same number of item rows')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path, the best one is reported')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                results = self._run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"{'list':>10} {'rows':>7} {'drf ms':>9} {'fast ms':>9} {'speedup':>8}")
+        for name, rows, drf_ms, fast_ms in results:
+            self.stdout.write(f"{name:>10} {rows:>7} {drf_ms:>9.1f} {fast_ms:>9.1f} {drf_ms / fast_ms:>7.1f}x")
+
+    def _run(self, rows, repeat):
+        category = Category.objects.create(name='bench', slug='bench-serializers')
+        products = Product.objects.bulk_create([
+            Product(title=f'bench {i}', slug=f'bench-serializers-{i}', price=Decimal('1000.00') + i,
+                    stock=10, category=category, image=f'products/bench-{i}.jpg' if i % 2 else None)
+            for i in range(rows)
+        ])
+        sale = Sale.objects.create(title='bench', discount_percent=15)
+        sale.products.add(*products[::3])
+        refresh_prices([p.pk for p in products])
+
+        user = User.objects.create_user('bench-serializers')
+        orders = Order.objects.bulk_create([
+            Order(user=user, full_name='Bench', address='-', phone='-', total=Decimal('100.00'))
+            for _ in range(max(rows // ITEMS_PER_ORDER, 1))
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[(n * ITEMS_PER_ORDER + i) % rows], price=Decimal('10.00'))
+            for n, order in enumerate(orders) for i in range(ITEMS_PER_ORDER)
+        ])
+
+        request = RequestFactory().get('/api/v1/')
+        renderer = JSONRenderer()
+        product_qs = Product.objects.filter(category=category).with_prices().select_related('category').order_by('pk')
+        items = OrderItem.objects.select_related('product__pricing', 'product__category').order_by('pk')
+        order_qs = Order.objects.filter(user=user).prefetch_related(Prefetch('items', items)).order_by('pk')
+
+        def drf_products():
+            return renderer.render(ProductSerializer(product_qs.all(), many=True, context={'request': request}).data)
+
+        def fast_products():
+            serializer = FastProductSerializer(request)
+            return renderer.render(serializer.serialize(serializer.rows(product_qs.all())))
+
+        def drf_orders():
+            return renderer.render(OrderSerializer(order_qs.all(), many=True, context={'request': request}).data)
+
+        def fast_orders():
+            serializer = FastOrderSerializer(request)
+            return renderer.render(serializer.serialize(serializer.rows(order_qs.all())))
+
+        return [
+            ('products', rows, *self._compare(drf_products, fast_products, repeat)),
+            ('orders', len(orders) * ITEMS_PER_ORDER, *self._compare(drf_orders, fast_orders, repeat)),
+        ]
+
+    def _compare(self, drf, fast, repeat):
+        if drf() != fast():
+            raise CommandError('Fast serializer output differs from DRF output')
+        return self._best(drf, repeat), self._best(fast, repeat)
+
+    def _best(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings)
@@ -0,0 +1,130 @@
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from store import benchmark
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every store URL on synthetic catalogs, in-process and under concurrent HTTP load; '
+            'write a JSON baseline and compare it with a previous one')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated catalog sizes')
+        parser.add_argument('--requests', type=int, default=30, help='Measured requests per route')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per route')
+        parser.add_argument('--routes', default='', help='Comma-separated url names (default: all)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent visitors in the load test')
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help='Seconds of load per catalog (0 skips the load test)')
+        parser.add_argument('--db-dir', default=tempfile.gettempdir(),
+                            help='Directory for the per-size SQLite databases (reused between runs)')
+        parser.add_argument('--rebuild', action='store_true', help='Regenerate catalogs even if they exist')
+        parser.add_argument('--output', help='Write the JSON baseline to this file')
+        parser.add_argument('--compare', help='Baseline JSON to compare the results with')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent change in p95 / rps counted as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error if the comparison finds regressions')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        names = {name for name in options['routes'].split(',') if name}
+        previous = None
+        if options['compare']:
+            previous = json.loads(Path(options['compare']).read_text(encoding='utf-8'))
+
+        result = {
+            'meta': {
+                'revision': _git_revision(),
+                'created': timezone.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+            },
+            'catalogs': {},
+        }
+        # синхронный приём заказов и никаких фоновых воркеров: замеряется только сам запрос
+        with override_settings(ALLOWED_HOSTS=['*'], DEBUG=False, ORDER_INTAKE_MODE='sync',
+                               ORDER_QUEUE_WORKERS=0, IMAGE_QUEUE_WORKERS=0):
+            for size in sizes:
+                result['catalogs'][str(size)] = self._bench_catalog(size, names, options)
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['output']}"))
+        if previous:
+            self._report_changes(previous, result, options)
+
+    def _bench_catalog(self, size, names, options):
+        started = time.perf_counter()
+        with benchmark.catalog_database(size, options['db_dir'], options['rebuild']) as (catalog, built):
+            if built:
+                self.stdout.write(f'Built catalog of {size} products in {time.perf_counter() - started:.1f}s')
+            try:
+                data = {'routes': benchmark.run_routes(catalog, options['requests'], options['warmup'], names)}
+                self._print_routes(size, data['routes'])
+                if options['duration'] > 0:
+                    data['load'] = benchmark.run_load(catalog, options['concurrency'], options['duration'])
+                    self._print_load(data['load'])
+            except benchmark.BenchmarkError as e:
+                raise CommandError(str(e)) from e
+        return data
+
+    def _print_routes(self, size, routes):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\nCatalog: {size} products, in-process'))
+        self.stdout.write(f"{'route':<28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for name, stats in routes.items():
+            self.stdout.write(
+                f"{name:<28} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+                f"{stats['queries']:>8}"
+            )
+
+    def _print_load(self, load):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\nHTTP load: {load['concurrency']} visitors, {load['seconds']}s, "
+            f"{load['rps']} req/s, {load['errors']} errors"
+        ))
+        self.stdout.write(f"{'route':<28} {'reqs':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for name, stats in [('total', load), *load['routes'].items()]:
+            queries = stats.get('queries')
+            self.stdout.write(
+                f"{name:<28} {stats['requests']:>6} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                f"{stats['p99_ms']:>8.2f} {'' if queries is None else queries:>8}"
+            )
+
+    def _report_changes(self, previous, result, options):
+        changes = benchmark.compare(previous, result, options['threshold'] / 100)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\nCompared with {options['compare']} ({previous['meta'].get('revision') or 'unknown revision'})"
+        ))
+        self.stdout.write(f"{'catalog':>8} {'section':<7} {'route':<28} {'metric':<8} {'old':>10} {'new':>10} {'change':>8}")
+        regressions = 0
+        for change in changes:
+            line = (f"{change.catalog:>8} {change.section:<7} {change.route:<28} {change.metric:<8} "
+                    f"{change.old:>10} {change.new:>10} {(change.ratio - 1) * 100:>+7.1f}%")
+            if change.regression:
+                regressions += 1
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{regressions} regressions against {options["compare"]}')
+        self.stdout.write(f'{regressions} regressions')
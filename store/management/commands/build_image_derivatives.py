@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.image_queue import PROCESSING_ERRORS
+from store.images import IMAGE_FIELDS, process_instance
+
+
+class Command(BaseCommand):
+    help = 'Build AVIF/WebP/JPEG derivatives for already uploaded images and rename originals by content hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', default=[],
+                            help='Only process these models (e.g. --model Product --model HeroBanner)')
+
+    def handle(self, *args, **options):
+        models = {name.lower() for name in options['model']}
+        started = time.perf_counter()
+        total = 0
+        for model, field, profile in IMAGE_FIELDS:
+            if models and model.__name__.lower() not in models:
+                continue
+            ids = list(model._default_manager.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                       .values_list('pk', flat=True))
+            processed = 0
+            for pk in ids:
+                try:
+                    processed += process_instance(model, pk, field, profile)
+                except PROCESSING_ERRORS as e:
+                    self.stderr.write(f'{model.__name__} #{pk}: {e}')
+            total += processed
+            self.stdout.write(f'{model.__name__}.{field}: {processed} processed')
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {total} images in {time.perf_counter() - started:.1f}s'
+        ))
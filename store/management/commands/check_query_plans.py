@@ -0,0 +1,41 @@
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from store import benchmark, query_plans
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN QUERY PLAN for indexed hot paths and for the queries of every store page; '
+            'fails if any of them falls back to a full table scan')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000, help='Synthetic catalog size (see bench_store)')
+        parser.add_argument('--db-dir', default=tempfile.gettempdir(),
+                            help='Directory for the benchmark SQLite databases (shared with bench_store)')
+        parser.add_argument('--routes', default='', help='Comma-separated url names (default: all)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN checks are written for SQLite')
+        names = {name for name in options['routes'].split(',') if name}
+        verbose = options['verbosity'] > 1
+
+        with override_settings(ALLOWED_HOSTS=['*'], ORDER_INTAKE_MODE='sync',
+                               ORDER_QUEUE_WORKERS=0, IMAGE_QUEUE_WORKERS=0), \
+                benchmark.catalog_database(options['size'], options['db_dir']) as (catalog, _):
+            checks = query_plans.check_hot_paths(catalog) + query_plans.check_routes(catalog, names)
+
+        failed = [check for check in checks if check.problems]
+        for check in checks:
+            if check.problems or verbose:
+                style = self.style.ERROR if check.problems else self.style.SUCCESS
+                self.stdout.write(style(f"{check.source}: {'; '.join(check.problems) or 'ok'}"))
+                self.stdout.write(f'  {check.sql[:300]}')
+                for detail in check.plan:
+                    self.stdout.write(f'    {detail}')
+        if failed:
+            raise CommandError(f'{len(failed)} of {len(checks)} queries fall back to a full scan')
+        self.stdout.write(self.style.SUCCESS(f'{len(checks)} query plans checked, no full scans on hot paths'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from store.cleanup import DEFAULT_BATCH_SIZE, collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned guest carts and expired sessions in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches to let other writers in')
+
+    def handle(self, *args, **options):
+        report = collect_garbage(options['batch_size'], options['pause'])
+        self.stdout.write(
+            f'Cart items: {report.cart_items}, cart summaries: {report.cart_summaries}, '
+            f'sessions: {report.sessions}'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Freed {report.total} rows in {report.batches} batches, {report.seconds:.2f}s'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from store.database import set_journal_mode
+
+
+class Command(BaseCommand):
+    help = 'Switch the SQLite database file to settings.SQLITE_JOURNAL_MODE (WAL); persistent, run once per deployment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"{options['database']} is not an SQLite database")
+        mode = set_journal_mode(connection)
+        self.stdout.write(self.style.SUCCESS(f'journal_mode = {mode}'))
@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.feeds import FORMATS, feed_rows, get_chunk_size, render_feed
+
+
+class Command(BaseCommand):
+    help = 'Stream the product feed (CSV / JSON Lines / XML) to a file or stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+        parser.add_argument('--base-url', default='', help='Prefix for product and image URLs, e.g. https://shop.kz')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help=f'Rows fetched from the database at a time (default {get_chunk_size()})')
+
+    def handle(self, *args, **options):
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        started = time.perf_counter()
+        rows = counted(feed_rows(options['base_url'], options['chunk_size']))
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in render_feed(options['format'], rows):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(f"Exported {exported} products in {elapsed:.1f}s ({exported / max(elapsed, 1e-6):.0f} rows/s)")
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.importer import DEFAULT_CHUNK_SIZE, DEFAULT_IMAGE_WORKERS, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Upsert products and categories from a CSV or JSON Lines file in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (header row) or JSON Lines file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: guessed from the extension')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--image-workers', type=int, default=DEFAULT_IMAGE_WORKERS,
+                            help='Parallel image downloads / copies')
+        parser.add_argument('--image-root', help='Base directory for relative image paths')
+        parser.add_argument('--no-images', action='store_true', help='Ignore the image column')
+        parser.add_argument('--refresh-images', action='store_true',
+                            help='Fetch images even for products that already have one')
+
+    def handle(self, *args, **options):
+        try:
+            report = import_catalog(
+                options['path'],
+                options['format'],
+                chunk_size=options['chunk_size'],
+                image_workers=options['image_workers'],
+                image_root=options['image_root'],
+                images=not options['no_images'],
+                refresh_images=options['refresh_images'],
+            )
+        except OSError as e:
+            raise CommandError(e) from e
+
+        for line, message in report.errors:
+            self.stderr.write(f'line {line}: {message}')
+        self.stdout.write(
+            f'Rows: {report.rows}, created: {report.created}, updated: {report.updated}, '
+            f'skipped: {report.skipped}, categories: {report.categories}, '
+            f'images: {report.images} ({report.image_errors} failed)'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported in {report.seconds:.1f}s, {report.rows_per_second:.0f} rows/s'
+        ))
+        if report.images:
+            self.stdout.write('Image derivatives are queued; run `manage.py process_images` if no workers are running.')
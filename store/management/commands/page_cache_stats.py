@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.middleware import page_cache_stats, reset_page_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show full-page cache hit/miss/bypass counters (per process with LocMem, global with a shared cache)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing')
+
+    def handle(self, *args, **options):
+        stats = page_cache_stats()
+        self.stdout.write(
+            f"hits: {stats['hit']}, misses: {stats['miss']}, bypassed: {stats['bypass']}, "
+            f"hit rate: {stats['hit_rate']:.1%}"
+        )
+        if options['reset']:
+            reset_page_cache_stats()
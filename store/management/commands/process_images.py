@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.image_queue import (
+    DEFAULT_BATCH_SIZE, DEFAULT_POLL_INTERVAL, ImageWorkerPool, process_batch, requeue_stale,
+)
+
+
+class Command(BaseCommand):
+    help = 'Build image derivatives for queued uploads (IMAGE_PROCESSING_MODE = "queue")'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL)
+        parser.add_argument('--once', action='store_true', help='Run all due jobs and exit')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale jobs'))
+
+        if options['once']:
+            total = 0
+            while processed := process_batch(options['batch_size']):
+                total += processed
+            self.stdout.write(self.style.SUCCESS(f'Processed {total} image jobs'))
+            return
+
+        pool = ImageWorkerPool(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        ).start()
+        self.stdout.write(f"Processing images with {options['workers']} workers, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            pool.stop()
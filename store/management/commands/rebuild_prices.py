@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.caching import CATALOG, bump_version
+from store.pricing import refresh_prices
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized product price table (best sale and effective price)'
+
+    def handle(self, *args, **options):
+        count = refresh_prices()
+        bump_version(CATALOG)
+        self.stdout.write(self.style.SUCCESS(f'Refreshed prices for {count} products'))
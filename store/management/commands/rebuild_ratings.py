@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.caching import CATALOG, bump_version
+from store.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recount review aggregates (count, rating sum, histogram) stored on products'
+
+    def handle(self, *args, **options):
+        count = rebuild_ratings()
+        bump_version(CATALOG)
+        self.stdout.write(self.style.SUCCESS(f'Recounted ratings for {count} products'))
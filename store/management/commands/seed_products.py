@@ -1,10 +1,8 @@
-import os
 from django.core.management.base import BaseCommand
-from store.models import Product, Category
-from django.core.files.base import ContentFile
-import requests
 from django.conf import settings
 
+from store.importer import CatalogImporter
+
 PRODUCTS = [
     {
         "title": "Беспроводные наушники X100",
@@ -48,24 +46,22 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR('MEDIA_ROOT is not set in settings.'))
             return
 
-        for p in PRODUCTS:
-            cat, _ = Category.objects.get_or_create(name=p['category'], slug=p['category'].lower())
-            prod, created = Product.objects.get_or_create(slug=p['slug'], defaults={
+        # тот же путь, что и у import_catalog: upsert пачкой, картинки скачиваются параллельно
+        rows = [
+            (n, {
+                'slug': p['slug'],
                 'title': p['title'],
                 'description': p['description'],
                 'price': p['price'],
                 'stock': 50,
-                'category': cat,
+                'category': p['category'],
+                'category_slug': p['category'].lower(),
+                'image': p['image_url'],
             })
-            # fetch image
-            try:
-                r = requests.get(p['image_url'], timeout=10)
-                if r.status_code == 200:
-                    filename = f"{p['slug']}.jpg"
-                    prod.image.save(filename, ContentFile(r.content), save=True)
-                    self.stdout.write(self.style.SUCCESS(f"Saved image for {p['title']}"))
-            except Exception as e:
-                self.stdout.write(self.style.WARNING(f"Couldn't download image for {p['title']}: {e}"))
-            prod.save()
+            for n, p in enumerate(PRODUCTS, 1)
+        ]
+        report = CatalogImporter().run(rows)
+        if report.image_errors:
+            self.stdout.write(self.style.WARNING(f"Couldn't download {report.image_errors} images"))
 
-        self.stdout.write(self.style.SUCCESS('Seeded products'))
+        self.stdout.write(self.style.SUCCESS(f'Seeded {report.created + report.updated} products'))
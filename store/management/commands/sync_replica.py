@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from store.db_routing import mark_replica_synced
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database into the read replica file (online backup, '
+            'safe while the shop is running); Postgres replicas are fed by streaming replication')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', default='replica', help='Replica alias from settings.DATABASES')
+
+    def handle(self, *args, **options):
+        alias = options['alias']
+        if alias not in connections.settings:
+            raise CommandError(f'Database alias {alias!r} is not configured')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('sync_replica copies SQLite files only')
+        source, target = str(primary.settings_dict['NAME']), str(replica.settings_dict['NAME'])
+        if source == target:
+            raise CommandError(f'Replica {alias!r} points at the primary file {source}')
+
+        # открытые подключения реплики читали бы старый файл до CONN_MAX_AGE
+        replica.close()
+        # всё, что закоммичено до начала копирования, окажется в реплике
+        started = int(time.time() * 1000)
+        src, dst = sqlite3.connect(source), sqlite3.connect(target)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        mark_replica_synced(started)
+        self.stdout.write(self.style.SUCCESS(f'{source} -> {target}'))
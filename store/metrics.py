@@ -0,0 +1,259 @@
+"""
+Метрики запросов: число SQL-запросов, повторяющиеся запросы (N+1), время в БД,
+время рендеринга шаблонов и полное время ответа — по каждой странице.
+
+Собирает MetricsMiddleware (middleware.py): результат лежит в request.metrics,
+уходит в заголовок Server-Timing (видно во вкладке Network браузера) и
+накапливается в памяти процесса по имени URL — см. `metrics/` (views.metrics_view).
+
+QUERY_BUDGETS — допустимое число запросов для каждого URL из store/urls.py,
+SCENARIO_BUDGETS — для более дорогих путей тех же URL (гость, перенос корзины
+при входе); сценарий запроса отмечает mark_scenario(). Превышение и повторы
+одного запроса больше DUPLICATE_QUERY_THRESHOLD раз (repeated_queries) пишутся в лог, тесты
+проверяют бюджеты для всех URL и сценариев (QueryBudgetTests).
+
+Время шаблонов считает бэкенд TimedTemplates (settings.TEMPLATES).
+
+Запросы, выполненные при отдаче StreamingHttpResponse (товарный фид),
+происходят после middleware и не учитываются.
+"""
+import contextvars
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template as DjangoTemplate
+
+# url name -> максимум SQL-запросов на запрос (пользователь вошёл, данные как в тестах)
+QUERY_BUDGETS = {
+    'store:index': 6,
+    'store:catalog_page': 4,
+    'store:product_detail': 6,
+    'store:add_review': 9,          # с фото: задание ImageJob
+    'store:add_to_cart': 8,
+    'store:cart': 7,                # с пересчётом CartSummary (в кеше его нет)
+    'store:update_cart': 6,
+    'store:update_cart_quantity': 7,
+    'store:checkout': 34,           # UPDATE остатка на каждую из 8 строк корзины; заявка — в своей транзакции
+    'store:payment_success': 5,
+    'store:order_status': 6,        # готовая заявка: редирект и запись сессии
+    'store:orders': 5,
+    'store:about': 3,
+    'store:contact': 4,
+    'store:login': 9,
+    'store:register': 6,
+    'store:logout': 4,
+    'store:sale_list': 4,
+    'store:sale_detail': 5,
+    'store:search_products': 7,
+    'store:catalog_feed': 3,
+    'store:profile': 5,
+    'store:image_job_status': 4,
+    'store:metrics': 2,             # сессия и пользователь: доступ только для staff
+}
+GUEST = 'guest'              # посетитель не вошёл (отмечает MetricsMiddleware)
+CART_MERGE = 'cart-merge'    # вход с переносом гостевой корзины (cart.merge_guest_cart)
+# (url name, сценарий) -> бюджет; без записи действует QUERY_BUDGETS
+SCENARIO_BUDGETS = {
+    # GUEST_CART_BACKEND = 'db': первая строка создаёт сессию (проверка ключа, INSERT, UPDATE)
+    ('store:add_to_cart', GUEST): 13,
+    ('store:cart', GUEST): 5,
+    ('store:update_cart_quantity', GUEST): 5,
+    # смена ключа сессии, last_login, перенос строк (6 запросов), запись сессии
+    ('store:login', CART_MERGE): 20,
+}
+DUPLICATE_QUERY_THRESHOLD = 5
+# url name -> начала запросов, которые повторяются по одному на строку намеренно
+PER_ROW_QUERIES = {
+    # checkout.reserve_stock: условный UPDATE остатка на каждую позицию корзины
+    'store:checkout': ('UPDATE "store_product" SET "stock" = ',),
+}
+LATENCY_SAMPLES = 500
+
+WHITESPACE = re.compile(r'\s+')
+PLACEHOLDER_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+_current = contextvars.ContextVar('store_request_metrics', default=None)
+
+
+def fingerprint(sql):
+    """Запрос без параметров; IN (%s, %s, ...) любой длины сводится к IN (...)."""
+    return PLACEHOLDER_LIST.sub('(...)', WHITESPACE.sub(' ', sql).strip())
+
+
+@dataclass
+class RequestMetrics:
+    view: str = ''
+    scenario: str = ''
+    queries: int = 0
+    db_ms: float = 0.0
+    template_ms: float = 0.0
+    total_ms: float = 0.0
+    fingerprints: dict = field(default_factory=dict)  # fingerprint -> число выполнений
+
+    @property
+    def duplicates(self):
+        """{fingerprint: n} для запросов, выполненных больше одного раза."""
+        return {sql: n for sql, n in self.fingerprints.items() if n > 1}
+
+    def server_timing(self):
+        duplicates = sum(n - 1 for n in self.fingerprints.values() if n > 1)
+        return (
+            f'db;dur={self.db_ms:.1f};desc="{self.queries} queries, {duplicates} duplicates", '
+            f'tpl;dur={self.template_ms:.1f};desc="templates", '
+            f'total;dur={self.total_ms:.1f}'
+        )
+
+    # execute_wrapper для всех подключений
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            self.queries += 1
+            key = fingerprint(sql)
+            self.fingerprints[key] = self.fingerprints.get(key, 0) + 1
+
+
+@contextmanager
+def collect(view=''):
+    """Считает запросы и время шаблонов внутри блока; отдаёт RequestMetrics."""
+    metrics = RequestMetrics(view=view)
+    token = _current.set(metrics)
+    started = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            yield metrics
+    finally:
+        metrics.total_ms = (time.perf_counter() - started) * 1000
+        _current.reset(token)
+
+
+def mark_scenario(scenario):
+    """Отмечает сценарий текущего запроса (ключ SCENARIO_BUDGETS); вне запроса ничего не делает."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.scenario = scenario
+
+
+# --------------------------
+# Время шаблонов
+# --------------------------
+class TimedTemplate(DjangoTemplate):
+    """
+    Шаблон верхнего уровня (render(), TemplateResponse) с замером времени.
+    {% include %} рендерится внутри него и отдельно не считается. Ленивые QuerySet-ы,
+    которые читаются в шаблоне, попадают и во время шаблона, и во время БД.
+    """
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_ms += (time.perf_counter() - started) * 1000
+
+
+class TimedTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, отдающий TimedTemplate (settings.TEMPLATES)."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+# --------------------------
+# Накопленные метрики процесса
+# --------------------------
+@dataclass
+class ViewStats:
+    requests: int = 0
+    queries: int = 0
+    max_queries: int = 0
+    db_ms: float = 0.0
+    template_ms: float = 0.0
+    over_budget: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+    duplicates: dict = field(default_factory=dict)  # fingerprint -> в скольких запросах повторялся
+
+    def add(self, metrics):
+        self.requests += 1
+        self.queries += metrics.queries
+        self.max_queries = max(self.max_queries, metrics.queries)
+        self.db_ms += metrics.db_ms
+        self.template_ms += metrics.template_ms
+        self.latencies.append(metrics.total_ms)
+        for sql in metrics.duplicates:
+            self.duplicates[sql] = self.duplicates.get(sql, 0) + 1
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            'requests': self.requests,
+            'avg_queries': round(self.queries / self.requests, 2),
+            'max_queries': self.max_queries,
+            'avg_db_ms': round(self.db_ms / self.requests, 2),
+            'avg_template_ms': round(self.template_ms / self.requests, 2),
+            'p50_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(latencies[max(int(len(latencies) * 0.95) - 1, 0)], 2),
+            'over_budget': self.over_budget,
+            'duplicate_queries': [
+                {'sql': sql[:300], 'requests': n}
+                for sql, n in sorted(self.duplicates.items(), key=lambda item: -item[1])[:10]
+            ],
+        }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def query_budget(metrics):
+    """Бюджет запроса: для его сценария, иначе для URL; None, если бюджета нет."""
+    return SCENARIO_BUDGETS.get((metrics.view, metrics.scenario), QUERY_BUDGETS.get(metrics.view))
+
+
+def repeated_queries(metrics):
+    """{fingerprint: n} для повторов сверх DUPLICATE_QUERY_THRESHOLD, кроме PER_ROW_QUERIES."""
+    per_row = PER_ROW_QUERIES.get(metrics.view, ())
+    return {
+        sql: n for sql, n in metrics.duplicates.items()
+        if n > DUPLICATE_QUERY_THRESHOLD and not sql.startswith(per_row)
+    }
+
+
+def over_budget(metrics):
+    budget = query_budget(metrics)
+    return budget is not None and metrics.queries > budget
+
+
+def record(metrics):
+    with _stats_lock:
+        stats = _stats.setdefault(metrics.view, ViewStats())
+        stats.add(metrics)
+        if over_budget(metrics):
+            stats.over_budget += 1
+
+
+def snapshot():
+    """{url name: сводка} по всем страницам, запрошенным в этом процессе."""
+    with _stats_lock:
+        return {view: stats.as_dict() for view, stats in sorted(_stats.items())}
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,272 @@
+"""
+Middleware магазина.
+
+CartMiddleware    — запись гостевых корзин в ответ и запуск сборщика брошенных корзин.
+PageCacheMiddleware — кеш целых страниц для анонимных посетителей с ETag/Last-Modified.
+MetricsMiddleware — число SQL-запросов и время ответа, заголовок Server-Timing (metrics.py).
+ReplicaPinMiddleware — чтение своих записей при чтении каталога с реплики (db_routing.py).
+"""
+import hashlib
+import logging
+import re
+import time
+from email.utils import formatdate
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseNotModified
+from django.middleware.csrf import get_token
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, parse_http_date_safe
+
+from . import caching, db_routing, metrics
+from .cart import CACHE_COOKIE_NAME, COOKIE_NAME, persist_carts
+from .cleanup import start_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class CartMiddleware:
+    """
+    Записывает изменённые гостевые корзины (cookie / кеш) в ответ.
+    При старте процесса запускает сборщик брошенных корзин (CART_CLEANUP_INTERVAL).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        start_scheduler()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return persist_carts(request, response)
+
+
+# --------------------------
+# Кеш страниц
+# --------------------------
+# страница -> группы данных (caching.py), от которых зависит её содержимое;
+# категории выводятся в шапке поиска на всех страницах
+PAGE_CACHE_VIEWS = {
+    'store:index': (caching.CATALOG, caching.BANNERS),
+    'store:catalog_page': (caching.CATALOG,),
+    'store:product_detail': (caching.CATALOG,),
+    'store:sale_list': (caching.SALES,),
+    'store:sale_detail': (caching.SALES,),
+    'store:about': (),
+}
+PAGES = 'pages'  # общая группа: bump_version('pages') сбрасывает все страницы
+CACHED_HEADERS = ('Content-Type', 'X-Next-Page')
+CSRF_PLACEHOLDER = '__store_csrf_token__'
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]+(")')
+STATS_KEYS = {kind: f'{caching.KEY_PREFIX}:pagecache:{kind}' for kind in ('hit', 'miss', 'bypass')}
+
+
+def count(kind):
+    key = STATS_KEYS[kind]
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def page_cache_stats():
+    """{'hit': n, 'miss': n, 'bypass': n, 'hit_rate': доля попаданий среди кешируемых запросов}."""
+    values = cache.get_many(STATS_KEYS.values())
+    stats = {kind: values.get(key, 0) for kind, key in STATS_KEYS.items()}
+    served = stats['hit'] + stats['miss']
+    stats['hit_rate'] = round(stats['hit'] / served, 4) if served else 0.0
+    return stats
+
+
+def reset_page_cache_stats():
+    cache.delete_many(STATS_KEYS.values())
+
+
+class PageCacheMiddleware:
+    """
+    Отдаёт анонимным посетителям готовые страницы из кеша, не вызывая view.
+
+    Кешируются GET/HEAD страниц из PAGE_CACHE_VIEWS. Запрос идёт мимо кеша, если
+    пользователь вошёл, у него есть гостевая корзина, непрочитанные сообщения или
+    любые данные в сессии. Ключ включает версии групп данных страницы, поэтому
+    изменение Product/Sale/HeroBanner сразу делает старые записи недоступными.
+
+    ETag — sha256 от сохранённого тела, Last-Modified — момент последнего изменения
+    групп данных (версии в caching.py — метки времени). If-None-Match / If-Modified-Since
+    получают 304 без рендеринга. Страница, прочитанная с ещё не догнавшей реплики,
+    не сохраняется (db_routing.cacheable). CSRF-токен в сохранённом теле заменён заглушкой
+    и подставляется заново для каждого запроса.
+
+    Счётчики попаданий: page_cache_stats(), `manage.py page_cache_stats`,
+    заголовок X-Page-Cache: HIT / MISS / BYPASS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        namespaces = self._namespaces(request)
+        if namespaces is None:
+            return self.get_response(request)
+        if not self._is_anonymous(request):
+            count('bypass')
+            response = self.get_response(request)
+            response['X-Page-Cache'] = 'BYPASS'
+            return response
+
+        versions = [caching.get_version(ns) for ns in (PAGES, caching.CATEGORIES, *namespaces)]
+        key = '{}:page:{}:{}'.format(
+            caching.KEY_PREFIX,
+            '.'.join(str(v) for v in versions),
+            hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest(),
+        )
+        entry = cache.get(key)
+        if entry is None:
+            response = self.get_response(request)
+            if not self._is_storable(request, response) or not db_routing.cacheable(versions):
+                count('bypass')
+                response['X-Page-Cache'] = 'BYPASS'
+                return response
+            body = CSRF_INPUT.sub(rb'\g<1>' + CSRF_PLACEHOLDER.encode() + rb'\g<2>', response.content)
+            entry = {
+                'body': body,
+                'headers': {h: response[h] for h in CACHED_HEADERS if h in response},
+                'etag': '"%s"' % hashlib.sha256(body).hexdigest()[:32],
+                'last_modified': max(versions) // 1000,
+            }
+            cache.set(key, entry, getattr(settings, 'PAGE_CACHE_TIMEOUT', caching.DEFAULT_TIMEOUT))
+            count('miss')
+            status = 'MISS'
+        else:
+            count('hit')
+            status = 'HIT'
+
+        if self._not_modified(request, entry):
+            response = HttpResponseNotModified()
+        else:
+            body = entry['body']
+            if CSRF_PLACEHOLDER.encode() in body:
+                body = body.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+            response = HttpResponse(body)
+            for header, value in entry['headers'].items():
+                response[header] = value
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = formatdate(entry['last_modified'], usegmt=True)
+        response['X-Page-Cache'] = status
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    @staticmethod
+    def _namespaces(request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return PAGE_CACHE_VIEWS.get(match.view_name)
+
+    @staticmethod
+    def _is_anonymous(request):
+        if request.user.is_authenticated:
+            return False
+        if COOKIE_NAME in request.COOKIES or CACHE_COOKIE_NAME in request.COOKIES:
+            return False
+        if 'messages' in request.COOKIES:
+            return False
+        # последний заказ гостя, гостевая корзина в БД, сообщения в сессии...
+        return not request.session.keys()
+
+    @staticmethod
+    def _is_storable(request, response):
+        if response.status_code != 200 or response.streaming:
+            return False
+        if response.has_header('Cache-Control') and 'private' in response['Cache-Control']:
+            return False
+        # view что-то записал пользователю (сессию, корзину) — страница не общая
+        return not request.session.modified and not any(
+            name != settings.CSRF_COOKIE_NAME for name in response.cookies
+        )
+
+    @staticmethod
+    def _not_modified(request, entry):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or entry['etag'] in etags
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            since = parse_http_date_safe(if_modified_since)
+            return since is not None and entry['last_modified'] <= since
+        return False
+
+
+# --------------------------
+# Метрики запросов
+# --------------------------
+class MetricsMiddleware:
+    """
+    Считает SQL-запросы, время БД, шаблонов и всего ответа (metrics.py).
+    Стоит первым в MIDDLEWARE, чтобы учитывать и остальные middleware.
+    Отключается настройкой REQUEST_METRICS = False.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with metrics.collect() as request.metrics:
+            response = self.get_response(request)
+        current = request.metrics
+        match = request.resolver_match
+        current.view = match.view_name if match else ''
+        user = getattr(request, 'user', None)
+        if not current.scenario and user is not None and not user.is_authenticated:
+            current.scenario = metrics.GUEST
+
+        response['Server-Timing'] = current.server_timing()
+        if current.view:
+            metrics.record(current)
+            if metrics.over_budget(current):
+                logger.warning("%s made %d queries (budget %d)",
+                               current.view, current.queries, metrics.query_budget(current))
+            for sql, count in metrics.repeated_queries(current).items():
+                logger.warning("%s repeated a query %d times: %s", current.view, count, sql[:200])
+        return response
+
+
+# --------------------------
+# Реплика БД
+# --------------------------
+class ReplicaPinMiddleware:
+    """
+    Закрепляет за default посетителя, который только что писал (read-your-writes):
+    cookie на REPLICA_STICKY_SECONDS, пока она жива — каталог читается не с реплики.
+    Стоит до SessionMiddleware, чтобы учитывать и запись сессии. Подделанная cookie
+    может только перевести чтения на default, поэтому она не подписывается.
+    """
+
+    def __init__(self, get_response):
+        if db_routing.replica_alias() is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(db_routing.PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        with db_routing.routing_state(pinned=pinned_until > time.time()) as state:
+            response = self.get_response(request)
+
+        if state.wrote:
+            seconds = db_routing.sticky_seconds()
+            response.set_cookie(db_routing.PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:33
+
+import django.db.models.deletion
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def fill_product_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Sale = apps.get_model('store', 'Sale')
+    ProductPrice = apps.get_model('store', 'ProductPrice')
+
+    best = Sale.objects.filter(
+        products=models.OuterRef('pk'), discount_percent__gt=0
+    ).order_by('-discount_percent', 'pk')
+    rows = []
+    for pk, price, sale_id, discount in Product.objects.annotate(
+        best_sale_id=models.Subquery(best.values('pk')[:1]),
+        best_discount=models.Subquery(best.values('discount_percent')[:1]),
+    ).values_list('pk', 'price', 'best_sale_id', 'best_discount'):
+        effective = price
+        if discount:
+            effective = (price - price * Decimal(discount) / Decimal('100')).quantize(
+                Decimal('0.01'), rounding=ROUND_HALF_UP
+            )
+        rows.append(ProductPrice(
+            product_id=pk, sale_id=sale_id, base_price=price,
+            discount_percent=discount or 0, price=effective,
+        ))
+    ProductPrice.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_review_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('discount_percent', models.PositiveIntegerField(default=0)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pricing', to='store.product')),
+                ('sale', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='store.sale')),
+            ],
+        ),
+        migrations.RunPython(fill_product_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+from store.stemmer import normalize_text
+
+# имя таблицы зафиксировано на момент миграции
+FTS_TABLE = 'store_product_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_FTS5'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(title, description, tokenize = 'unicode61 remove_diacritics 0')"
+        )
+        Product = apps.get_model('store', 'Product')
+        rows = [
+            (pk, normalize_text(title), normalize_text(description))
+            for pk, title, description in Product.objects.values_list('pk', 'title', 'description')
+        ]
+        cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (%s, %s, %s)', rows)
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_productprice'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:48
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+
+    reviews = Review.objects.filter(product=models.OuterRef('pk')).order_by().values('product')
+
+    def aggregate(expression):
+        value = reviews.annotate(value=expression).values('value')[:1]
+        return Coalesce(models.Subquery(value, output_field=models.IntegerField()), models.Value(0))
+
+    updates = {
+        'review_count': aggregate(models.Count('pk')),
+        'rating_sum': aggregate(models.Sum('rating')),
+    }
+    for stars in range(1, 6):
+        updates[f'rating_{stars}'] = aggregate(models.Count('pk', filter=models.Q(rating=stars)))
+    Product.objects.update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_cartsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(default=5, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(condition=models.Q(('session_key__isnull', False)), fields=['session_key'], name='store_cartitem_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='herobanner',
+            index=models.Index(condition=models.Q(('active', True)), fields=['order'], name='store_herobanner_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='store_produ_price_2d55a6_idx'),
+        ),
+    ]
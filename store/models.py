@@ -1,6 +1,8 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -22,6 +24,22 @@ class Category(models.Model):
 # --------------------------
 # Товары
 # --------------------------
+class ProductQuerySet(models.QuerySet):
+    def with_prices(self):
+        """Подтягивает материализованную цену одним JOIN вместо запросов на каждый товар."""
+        return self.select_related('pricing')
+
+    def with_best_sale(self):
+        """Аннотирует лучшую акцию товара (максимальная скидка) прямо в SQL."""
+        best = Sale.objects.filter(
+            products=models.OuterRef('pk'), discount_percent__gt=0
+        ).order_by('-discount_percent', 'pk')
+        return self.annotate(
+            best_sale_id=models.Subquery(best.values('pk')[:1]),
+            best_discount=models.Subquery(best.values('discount_percent')[:1]),
+        )
+
+
 class Product(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
@@ -33,24 +51,100 @@ class Product(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    # агрегаты отзывов, меняются только UPDATE-ами из ratings.py
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    RATING_FIELDS = ('review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['price'])]  # диапазоны цены в поиске и фасетах
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # агрегаты отзывов меняются F()-дельтами (ratings.py): сохранение товара, прочитанного
+        # раньше (админка, импорт, любое представление), не должно затирать их старыми значениями;
+        # записываются, только если явно указаны в update_fields
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.RATING_FIELDS and f.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def average_rating(self):
+        """Средняя оценка (0, если отзывов нет)."""
+        return self.rating_sum / self.review_count if self.review_count else 0
+
+    @property
+    def rating_stars(self):
+        """Средняя оценка, округлённая до целых звёзд."""
+        return int(self.average_rating + 0.5)
+
+    @property
+    def rating_histogram(self):
+        """[(оценка, количество, процент)] от 5 до 1."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}')
+            percent = round(count * 100 / self.review_count) if self.review_count else 0
+            histogram.append((stars, count, percent))
+        return histogram
+
+    def _get_pricing(self):
+        try:
+            return self.pricing
+        except ProductPrice.DoesNotExist:
+            return None
+
     @property
     def active_sale(self):
-        """Возвращает активную акцию, если товар участвует в ней."""
-        return self.sales.first() if self.sales.exists() else None
+        """Возвращает лучшую активную акцию, если товар участвует в ней."""
+        pricing = self._get_pricing()
+        return pricing.sale if pricing and pricing.sale_id else None
+
+    @property
+    def discount_percent(self):
+        """Процент скидки по лучшей акции (0, если акций нет)."""
+        pricing = self._get_pricing()
+        return pricing.discount_percent if pricing else 0
 
     @property
     def discounted_price(self):
         """Цена со скидкой, если есть активная акция."""
-        sale = self.active_sale
-        if sale and sale.discount_percent > 0:
-            discount = (self.price * sale.discount_percent) / 100
-            return self.price - discount
+        pricing = self._get_pricing()
+        if pricing and pricing.base_price == self.price:
+            return pricing.price
         return self.price
 
 
+# --------------------------
+# Материализованные цены товаров
+# --------------------------
+class ProductPrice(models.Model):
+    """Лучшая акция и итоговая цена товара, пересчитываются при изменении Product/Sale."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='pricing')
+    sale = models.ForeignKey('Sale', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    base_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_percent = models.PositiveIntegerField(default=0)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.price} (-{self.discount_percent}%)"
+
+
 # --------------------------
 # Элементы корзины
 # --------------------------
@@ -63,14 +157,40 @@ class CartItem(models.Model):
 
     class Meta:
         unique_together = ('user', 'product', 'session_key')
+        # строки пользователя находит unique_together (user первым); гостевые — частичный индекс
+        indexes = [
+            models.Index(fields=['session_key'], condition=models.Q(session_key__isnull=False),
+                         name='store_cartitem_session_idx'),
+        ]
 
     def subtotal(self):
-        return self.product.price * self.quantity
+        return self.product.discounted_price * self.quantity
 
     def __str__(self):
         return f"{self.product.title} x {self.quantity}"
 
 
+# --------------------------
+# Итоги корзины
+# --------------------------
+class CartSummary(models.Model):
+    """Агрегат корзины (количество, суммы), обновляется инкрементально при изменении строк."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='cart_summary')
+    session_key = models.CharField(max_length=40, unique=True, null=True, blank=True)
+    item_count = models.PositiveIntegerField(default=0)
+    total_quantity = models.PositiveIntegerField(default=0)
+    original_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    @property
+    def discount_total(self):
+        return self.original_total - self.total
+
+    def __str__(self):
+        return f"Cart {self.user_id or self.session_key}: {self.total}"
+
+
 # --------------------------
 # Заказы
 # --------------------------
@@ -94,6 +214,66 @@ class Order(models.Model):
         return f"Order #{self.id} ({self.status})"
 
 
+# --------------------------
+# Очередь оформления заказов
+# --------------------------
+class OrderCommand(models.Model):
+    """Принятая, но ещё не материализованная заявка на заказ (см. order_queue.py)."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_commands')
+    idempotency_key = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    claimed_by = models.CharField(max_length=64, blank=True)
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='command')
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'idempotency_key')
+
+    def __str__(self):
+        return f"OrderCommand #{self.pk} ({self.status})"
+
+
+# --------------------------
+# Фоновая обработка загрузок
+# --------------------------
+class ImageJob(models.Model):
+    """Задание на построение производных загруженного изображения (см. image_queue.py)."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    model = models.CharField(max_length=100)             # app_label.model_name
+    object_id = models.PositiveBigIntegerField()
+    field = models.CharField(max_length=50)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='image_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"ImageJob #{self.pk} {self.model}:{self.object_id}.{self.field} ({self.status})"
+
+
 # --------------------------
 # Товары в заказе
 # --------------------------
@@ -106,7 +286,8 @@ class OrderItem(models.Model):
     discount_percent = models.PositiveIntegerField(default=0)
 
     def subtotal(self):
-        return (self.product.discounted_price if hasattr(self.product, 'discounted_price') else self.product.price) * self.quantity
+        # цена зафиксирована в момент заказа, товар не перечитываем
+        return self.price * self.quantity
 
 
     def __str__(self):
@@ -153,13 +334,16 @@ class HeroBanner(models.Model):
 
     class Meta:
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['order'], condition=models.Q(active=True), name='store_herobanner_active_idx'),
+        ]
 
     def __str__(self):
         return f"Баннер {self.pk} (порядок {self.order})"
 class Review(models.Model):
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    rating = models.PositiveSmallIntegerField(default=5)
+    rating = models.PositiveSmallIntegerField(default=5, validators=[MinValueValidator(1), MaxValueValidator(5)])
     text = models.TextField(blank=True)
     image = models.ImageField(upload_to='review_images/', blank=True, null=True)  # <-- добавлено
     created_at = models.DateTimeField(auto_now_add=True)
@@ -198,5 +382,8 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    # вход обновляет только last_login — профиль сохранять незачем
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
     instance.profile.save()
@@ -0,0 +1,188 @@
+"""
+Очередь оформления заказов.
+
+CheckoutView не пишет заказ сам, а регистрирует заявку OrderCommand с ключом
+идемпотентности (скрытое поле формы корзины). Повторная отправка той же формы
+находит существующую заявку, поэтому двойной клик больше не создаёт два заказа.
+Ключ новый при каждой загрузке формы, поэтому строки корзины, уже отправленные
+ожидающей заявкой, тоже считаются отправленными: повторное оформление той же
+корзины из перезагруженной формы возвращает ту же заявку.
+
+Режим задаётся settings.ORDER_INTAKE_MODE:
+  'sync'  — заявка обрабатывается сразу в запросе (поведение по умолчанию);
+  'queue' — запрос сразу возвращается, а заказы материализуют воркеры пачками:
+            потоки внутри веб-процесса (ORDER_QUEUE_WORKERS) и/или
+            отдельный процесс `manage.py process_orders`.
+Таблица OrderCommand в той же SQLite служит локальной заменой брокера сообщений.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .checkout import CheckoutError, EmptyCartError, place_order_from_snapshot, snapshot_cart
+from .models import OrderCommand
+from .workers import LazyPool, WorkerPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_POLL_INTERVAL = 1.0
+STALE_AFTER = timedelta(minutes=5)
+
+
+def intake_mode():
+    return getattr(settings, 'ORDER_INTAKE_MODE', 'sync')
+
+
+def submit_order(user, idempotency_key, full_name, address, phone):
+    """
+    Регистрирует заявку со снимком корзины. Возвращает (command, created);
+    при повторе ключа или уже отправленной корзине возвращается существующая
+    заявка и created=False.
+    """
+    existing = OrderCommand.objects.filter(user=user, idempotency_key=idempotency_key).first()
+    if existing:
+        return existing, False
+
+    # транзакция IMMEDIATE: параллельная отправка ждёт и видит созданную здесь заявку
+    with transaction.atomic():
+        lines, cart_item_ids = snapshot_cart(user)
+        if not lines:
+            raise EmptyCartError()
+        submitted = _active_command_for(user, cart_item_ids)
+        if submitted:
+            return submitted, False
+
+        return OrderCommand.objects.get_or_create(
+            user=user,
+            idempotency_key=idempotency_key,
+            defaults={'payload': {
+                'full_name': full_name,
+                'address': address,
+                'phone': phone,
+                'lines': lines,
+                'cart_item_ids': cart_item_ids,
+            }},
+        )
+
+
+def _active_command_for(user, cart_item_ids):
+    """Ожидающая заявка, в снимок которой уже попали строки корзины cart_item_ids."""
+    cart_item_ids = set(cart_item_ids)
+    for command in OrderCommand.objects.filter(user=user, status__in=('pending', 'processing')):
+        if cart_item_ids & set(command.payload.get('cart_item_ids', ())):
+            return command
+    return None
+
+
+def _apply(command):
+    """
+    Материализует одну заявку; ошибка оформления откатывает только её savepoint.
+    Непредвиденная ошибка (например, битый payload) тоже помечает заявку неудачной,
+    чтобы не сорвать остальную пачку; ошибки БД пробрасываются.
+    """
+    payload = command.payload
+    try:
+        with transaction.atomic():
+            order = place_order_from_snapshot(
+                command.user, payload['full_name'], payload['address'], payload['phone'],
+                payload['lines'], payload['cart_item_ids'],
+            )
+    except CheckoutError as e:
+        command.status = 'failed'
+        command.error = str(e)
+    except DatabaseError:
+        raise
+    except Exception as e:
+        logger.exception("Order command #%s failed", command.pk)
+        command.status = 'failed'
+        command.error = f'{type(e).__name__}: {e}'
+    else:
+        command.status = 'done'
+        command.order = order
+    command.save(update_fields=['status', 'error', 'order', 'updated'])
+    return command
+
+
+def process_command(command):
+    """Синхронная обработка заявки внутри запроса."""
+    with transaction.atomic():
+        return _apply(command)
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Забирает до batch_size ожидающих заявок. Условный UPDATE по status='pending'
+    гарантирует, что два воркера не получат одну и ту же заявку.
+    """
+    ids = list(
+        OrderCommand.objects.filter(status='pending').order_by('pk').values_list('pk', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    OrderCommand.objects.filter(pk__in=ids, status='pending').update(
+        status='processing', claimed_by=token, updated=timezone.now()
+    )
+    return list(
+        OrderCommand.objects.filter(claimed_by=token, status='processing').select_related('user').order_by('pk')
+    )
+
+
+def release(commands):
+    """Сразу возвращает заявки пачки в очередь (не дожидаясь STALE_AFTER)."""
+    return OrderCommand.objects.filter(
+        pk__in=[command.pk for command in commands], status='processing',
+    ).update(status='pending', claimed_by='')
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Обрабатывает пачку заявок одной транзакцией (один COMMIT на пачку). Возвращает их число.
+    Если транзакция сорвалась, заявки пачки сразу возвращаются в очередь.
+    """
+    commands = claim_batch(batch_size)
+    if commands:
+        try:
+            with transaction.atomic():
+                for command in commands:
+                    _apply(command)
+        except Exception:
+            release(commands)
+            raise
+    return len(commands)
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Возвращает в очередь заявки, застрявшие в processing (воркер упал посреди пачки)."""
+    return OrderCommand.objects.filter(
+        status='processing', updated__lt=timezone.now() - older_than
+    ).update(status='pending', claimed_by='')
+
+
+# --------------------------
+# Пул воркеров
+# --------------------------
+class OrderWorkerPool(WorkerPool):
+    def __init__(self, workers=1, batch_size=DEFAULT_BATCH_SIZE, poll_interval=DEFAULT_POLL_INTERVAL):
+        super().__init__(process_batch, workers, batch_size, poll_interval, name='order-worker',
+                         maintenance=requeue_stale)
+
+
+_pool = LazyPool(OrderWorkerPool, 'ORDER_QUEUE_WORKERS')
+
+
+def get_worker_pool():
+    """Пул воркеров внутри веб-процесса; None, если ORDER_QUEUE_WORKERS = 0."""
+    return _pool.get()
+
+
+def notify_workers():
+    """Будит воркеров после коммита транзакции, в которой создана заявка."""
+    pool = get_worker_pool()
+    if pool:
+        transaction.on_commit(pool.wake)
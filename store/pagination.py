@@ -0,0 +1,74 @@
+"""
+Keyset (cursor) пагинация каталога и истории заказов.
+
+Вместо OFFSET страница выбирается условием pk > cursor, поэтому стоимость
+запроса не зависит от номера страницы и размера каталога.
+"""
+from dataclasses import dataclass
+
+from django.conf import settings
+
+DEFAULT_PAGE_SIZE = 24
+
+
+def get_page_size():
+    return getattr(settings, 'CATALOG_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def parse_cursor(value):
+    """Курсор — pk последнего показанного товара; мусор трактуем как первую страницу."""
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    cursor: int | None
+    next_cursor: int | None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_queryset(queryset, cursor=None, descending=False):
+    """
+    queryset, упорядоченный по pk и начинающийся после cursor (без LIMIT).
+    descending=True — от новых к старым (условие pk < cursor).
+    """
+    if descending:
+        queryset = queryset.order_by('-pk')
+        if cursor is not None:
+            queryset = queryset.filter(pk__lt=cursor)
+    else:
+        queryset = queryset.order_by('pk')
+        if cursor is not None:
+            queryset = queryset.filter(pk__gt=cursor)
+    return queryset
+
+
+def keyset_paginate(queryset, cursor=None, page_size=None, descending=False):
+    """
+    Возвращает страницу queryset, упорядоченного по pk, начиная после cursor
+    (keyset_queryset). Выбирает page_size + 1 строк одним запросом, чтобы узнать,
+    есть ли продолжение.
+    """
+    page_size = page_size or get_page_size()
+    rows = list(keyset_queryset(queryset, cursor, descending)[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        # queryset.values() должен включать 'pk'
+        next_cursor = last['pk'] if isinstance(last, dict) else last.pk
+    return KeysetPage(object_list=rows, cursor=cursor, next_cursor=next_cursor)
@@ -0,0 +1,116 @@
+"""
+Движок цен.
+
+Лучшая акция и итоговая цена товара считаются пачкой одним SQL-запросом
+(ProductQuerySet.with_best_sale) и сохраняются в таблицу ProductPrice.
+Таблица пересчитывается сигналами при изменении Product, Sale и Sale.products,
+поэтому страницы читают цены одним JOIN (Product.objects.with_prices()).
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import Signal, receiver
+
+from .models import Product, ProductPrice, Sale
+
+CENT = Decimal('0.01')
+REFRESH_BATCH_SIZE = 500
+
+# отправляется после пересчёта цен; product_ids=None — пересчитан весь каталог
+prices_changed = Signal()
+
+
+def apply_discount(price, discount_percent):
+    """Цена после скидки, округлённая до копеек."""
+    if not discount_percent:
+        return price
+    discount = price * Decimal(discount_percent) / Decimal('100')
+    return (price - discount).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _chunks(ids, size):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _refresh_rows(queryset):
+    rows = [
+        ProductPrice(
+            product_id=pk,
+            sale_id=sale_id,
+            base_price=price,
+            discount_percent=discount or 0,
+            price=apply_discount(price, discount),
+        )
+        for pk, price, sale_id, discount in queryset.with_best_sale().values_list(
+            'pk', 'price', 'best_sale_id', 'best_discount'
+        )
+    ]
+    ProductPrice.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['sale', 'base_price', 'discount_percent', 'price', 'updated'],
+    )
+    return len(rows)
+
+
+def refresh_prices(product_ids=None):
+    """
+    Пересчитывает таблицу цен для указанных товаров (или для всего каталога).
+    Возвращает количество обновлённых строк.
+    """
+    if product_ids is None:
+        all_ids = Product.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=REFRESH_BATCH_SIZE)
+        count = sum(_refresh_rows(Product.objects.filter(pk__in=chunk))
+                    for chunk in _chunks(all_ids, REFRESH_BATCH_SIZE))
+    else:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return 0
+        count = sum(_refresh_rows(Product.objects.filter(pk__in=chunk))
+                    for chunk in _chunks(product_ids, REFRESH_BATCH_SIZE))
+    prices_changed.send(sender=ProductPrice, product_ids=product_ids)
+    return count
+
+
+# --------------------------
+# Синхронизация с Product / Sale
+# --------------------------
+@receiver(post_save, sender=Product)
+def refresh_product_price(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_prices([instance.pk])
+
+
+@receiver(post_save, sender=Sale)
+def refresh_sale_prices(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_prices(instance.products.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Sale)
+def remember_sale_products(sender, instance, **kwargs):
+    instance._affected_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Sale)
+def refresh_deleted_sale_prices(sender, instance, **kwargs):
+    refresh_prices(getattr(instance, '_affected_product_ids', []))
+
+
+@receiver(m2m_changed, sender=Sale.products.through)
+def refresh_sale_products_prices(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # product.sales.add(...) / remove / clear — меняется только этот товар
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_prices([instance.pk])
+        return
+
+    if action == 'pre_clear':
+        instance._affected_product_ids = list(instance.products.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        refresh_prices(pk_set or [])
+    elif action == 'post_clear':
+        refresh_prices(getattr(instance, '_affected_product_ids', []))
@@ -0,0 +1,141 @@
+"""
+Проверка планов запросов SQLite (EXPLAIN QUERY PLAN): `manage.py check_query_plans`.
+
+Проверяются два набора запросов:
+  * HOT_PATHS — выборки горячих страниц (те же QuerySet, что строят view) и
+    индексы под них (миграция 0019): в плане не должно быть ни прохода по всей
+    таблице, ни сортировки во временном B-дереве. Страницы заказов и отзывов
+    идут по keyset от новых к старым (-pk); их обслуживает индекс внешнего ключа,
+    в SQLite он включает rowid, то есть (user_id, id) и (product_id, id);
+  * запросы всех страниц из benchmark.ROUTES, перехваченные execute_wrapper:
+    в них не должно быть прохода по всей таблице, кроме ALLOWED_SCANS и SMALL_TABLES.
+
+Без ANALYZE (sqlite_stat1) планировщик выбирает индексы по схеме, а не по данным,
+поэтому результат не зависит от размера каталога.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from .benchmark import ROUTES
+from .models import CartItem, HeroBanner, Order, Product
+from .pagination import keyset_queryset
+from .views import ORDERS_PAGE_SIZE, REVIEWS_PAGE_SIZE, order_history, product_reviews
+
+# выборки, для которых нужен индекс: название -> (catalog -> QuerySet)
+HOT_PATHS = {
+    'cart lines of a user': lambda c: CartItem.objects.filter(user=c.buyers[0]),
+    'cart lines of a guest session': lambda c: CartItem.objects.filter(session_key='bench-session'),
+    'orders of a user, newest first': lambda c: keyset_queryset(
+        order_history(Order.objects.filter(user=c.buyers[0])), descending=True)[:ORDERS_PAGE_SIZE + 1],
+    'reviews of a product, newest first': lambda c: keyset_queryset(
+        product_reviews(c.product_ids[0]), descending=True)[:REVIEWS_PAGE_SIZE + 1],
+    'active banners in order': lambda c: HeroBanner.objects.filter(active=True).order_by('order'),
+    'products in a price range': lambda c: Product.objects.filter(price__gte=1000, price__lte=5000),
+}
+
+# справочники на десятки строк: прочитать целиком дешевле, чем держать индекс
+SMALL_TABLES = {'store_category', 'store_sale', 'store_herobanner'}
+
+# (url name, таблица) -> почему полный проход здесь нормален
+ALLOWED_SCANS = {
+    ('store:index', 'store_product'): 'первая keyset-страница: обход по rowid с LIMIT',
+    ('store:catalog_page', 'store_product'): 'первая keyset-страница: обход по rowid с LIMIT',
+    ('store:catalog_feed', 'store_product'): 'фид выгружает весь каталог',
+    ('store:register', 'auth_user'): 'UserCreationForm сверяет имя без учёта регистра (LIKE), регистрация редка',
+}
+
+SCAN = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+# "store_product" U0, "store_product" AS "T3" — псевдонимы таблиц в SQL Django
+ALIAS = re.compile(r'"(\w+)"\s+(?:AS\s+)?"?([A-Z]\d+)"?(?=[\s,)]|$)')
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+@dataclass
+class PlanCheck:
+    source: str             # название HOT_PATHS или url name
+    sql: str
+    plan: list              # строки detail из EXPLAIN QUERY PLAN
+    problems: list = field(default_factory=list)
+
+
+def explain(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[3] for row in cursor.fetchall()]
+
+
+def partial_indexes():
+    """Имена частичных индексов (CREATE INDEX ... WHERE): их обход читает только подходящие строки."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def full_scans(sql, plan, partial=()):
+    """Таблицы, которые план читает целиком (псевдонимы заменены именами таблиц)."""
+    aliases = dict((alias, table) for table, alias in ALIAS.findall(sql))
+    tables = []
+    for detail in plan:
+        match = SCAN.match(detail)
+        if match and 'VIRTUAL TABLE' not in detail and match.group(2) not in partial:
+            name = aliases.get(match.group(1), match.group(1))
+            if not name.startswith('sqlite_'):
+                tables.append(name)
+    return tables
+
+
+def check_hot_paths(catalog):
+    partial = partial_indexes()
+    checks = []
+    for name, build in HOT_PATHS.items():
+        queryset = build(catalog)
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        check = PlanCheck(name, sql, explain(sql, params))
+        check.problems = [f'full scan of {table}' for table in full_scans(sql, check.plan, partial)]
+        if TEMP_SORT in check.plan:
+            check.problems.append('sorted in a temp b-tree')
+        checks.append(check)
+    return checks
+
+
+def _route_queries(catalog, route):
+    captured = []
+
+    def capture(execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(EXPLAINED):
+            captured.append((sql, params))
+        return execute(sql, params, many, context)
+
+    client = Client()
+    if route.user is not None:
+        client.force_login(catalog.buyers[route.user])
+    if route.prepare:
+        route.prepare(catalog, client, 0)
+    with connection.execute_wrapper(capture):
+        response = getattr(client, route.method)(reverse(f'store:{route.name}', args=route.args(catalog)),
+                                                 route.data(catalog, 0))
+        if response.streaming:
+            b''.join(response.streaming_content)
+    return captured
+
+
+def check_routes(catalog, names=None):
+    partial = partial_indexes()
+    checks = []
+    for route in ROUTES:
+        if names and route.name not in names:
+            continue
+        view = f'store:{route.name}'
+        for sql, params in _route_queries(catalog, route):
+            check = PlanCheck(view, sql, explain(sql, params))
+            check.problems = [
+                f'full scan of {table}' for table in full_scans(sql, check.plan, partial)
+                if table not in SMALL_TABLES and (view, table) not in ALLOWED_SCANS
+            ]
+            checks.append(check)
+    return checks
@@ -0,0 +1,76 @@
+"""
+Агрегаты отзывов товара.
+
+Product хранит количество отзывов, сумму оценок и гистограмму (rating_1..rating_5),
+поэтому средняя оценка и звёзды в каталоге не требуют запросов к Review.
+Агрегаты меняются на дельту одним UPDATE ... SET x = x + 1 в сигналах Review
+и выполняются в той же транзакции, что и запись отзыва: add_review и админка
+сохраняют отзыв внутри transaction.atomic(), удаление (в том числе каскадное)
+Django всегда выполняет в транзакции.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Product, Review
+
+STARS = range(1, 6)
+
+
+def _apply_delta(product_id, rating, sign):
+    updates = {
+        'review_count': F('review_count') + sign,
+        'rating_sum': F('rating_sum') + sign * rating,
+    }
+    if rating in STARS:
+        updates[f'rating_{rating}'] = F(f'rating_{rating}') + sign
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def _aggregate(reviews, expression):
+    value = reviews.values('product').annotate(value=expression).values('value')[:1]
+    return Coalesce(Subquery(value, output_field=IntegerField()), Value(0))
+
+
+def rebuild_ratings(product_ids=None):
+    """Пересчитывает агрегаты по таблице Review одним UPDATE. Возвращает число товаров."""
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by()
+    updates = {
+        'review_count': _aggregate(reviews, Count('pk')),
+        'rating_sum': _aggregate(reviews, Sum('rating')),
+    }
+    for stars in STARS:
+        updates[f'rating_{stars}'] = _aggregate(reviews, Count('pk', filter=Q(rating=stars)))
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=list(product_ids))
+    return products.update(**updates)
+
+
+# --------------------------
+# Синхронизация с Review
+# --------------------------
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._previous_rating = Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def count_saved_review(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        _apply_delta(instance.product_id, instance.rating, 1)
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if previous and previous != (instance.product_id, instance.rating):
+        _apply_delta(previous[0], previous[1], -1)
+        _apply_delta(instance.product_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def count_deleted_review(sender, instance, **kwargs):
+    _apply_delta(instance.product_id, instance.rating, -1)
@@ -0,0 +1,166 @@
+"""
+Полнотекстовый поиск товаров.
+
+На SQLite используется виртуальная таблица FTS5 (store_product_fts), в которую
+кладётся уже нормализованный текст: слова в нижнем регистре, прогнанные через
+русский стеммер (Snowball, stemmer.py). На PostgreSQL — to_tsvector/to_tsquery с конфигурацией
+'russian'. Для остальных СУБД и SQLite без FTS5 остаётся поиск через icontains.
+
+Индекс синхронизируется сигналами Product и командой rebuild_search_index.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product
+from .stemmer import WORD_RE, normalize_text, tokenize
+
+FTS_TABLE = 'store_product_fts'
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# беглая гласная: «кроссовки» -> «кроссовк», но «кроссовок» остаётся «кроссовок»;
+# обе основы ищутся по общему началу без последнего слога («кроссов»*)
+FLEETING_VOWEL_STEM = re.compile(
+    r'^(.{3,}[аеиоуыэюя][бвгджзклмнпрстфхцчшщ])[ое]?[бвгджзклмнпрстфхцчшщ]$'
+)
+
+
+def prefix_term(stem):
+    """Основа слова запроса для префиксного поиска FTS5."""
+    match = FLEETING_VOWEL_STEM.match(stem)
+    return match[1] if match else stem
+
+
+# --------------------------
+# Бэкенды поиска
+# --------------------------
+class LikeSearchBackend:
+    """Запасной вариант: LIKE по названию и описанию, без ранжирования."""
+
+    def search(self, queryset, query):
+        return queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class SQLiteFTSBackend:
+    def __init__(self, using):
+        self.using = using
+
+    @staticmethod
+    def build_match(query):
+        """Каждое слово — префиксный терм по основе: "наушник"* "беспровод"*."""
+        terms = ['"{}"*'.format(prefix_term(token).replace('"', '""')) for token in tokenize(query)]
+        return ' '.join(terms)
+
+    def search(self, queryset, query):
+        match = self.build_match(query)
+        if not match:
+            return queryset.none()
+        pk = f'"{Product._meta.db_table}"."{Product._meta.pk.column}"'
+        # индекс присоединяется к товарам один раз: MATCH отбирает строки FTS5,
+        # bm25() считается для них в том же запросе, а не подзапросом на каждую строку
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {pk}', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'bm25({FTS_TABLE}, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT})'},
+        ).order_by('search_rank', 'pk')
+
+    def index_products(self, products):
+        rows = [(p.pk, normalize_text(p.title), normalize_text(p.description)) for p in products]
+        if not rows:
+            return
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (%s, %s, %s)', rows
+            )
+
+    def remove_products(self, product_ids):
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self, chunk_size=1000):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        count = 0
+        batch = []
+        for product in Product.objects.using(self.using).only('pk', 'title', 'description').iterator(chunk_size):
+            batch.append(product)
+            if len(batch) >= chunk_size:
+                self.index_products(batch)
+                count += len(batch)
+                batch = []
+        self.index_products(batch)
+        return count + len(batch)
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    """tsvector/tsquery с русской морфологией; индекс не нужен, вектор строится в запросе."""
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        words = [word.replace("'", '') for word in WORD_RE.findall(query)]
+        if not words:
+            return queryset.none()
+        vector = (SearchVector('title', weight='A', config='russian')
+                  + SearchVector('description', weight='B', config='russian'))
+        tsquery = SearchQuery(' & '.join(f"'{word}':*" for word in words), search_type='raw', config='russian')
+        return queryset.annotate(
+            search_vector=vector,
+            search_rank=SearchRank(vector, tsquery),
+        ).filter(search_vector=tsquery).order_by('-search_rank', 'pk')
+
+
+_fts_available = {}
+
+
+def fts_available(using='default'):
+    if using not in _fts_available:
+        connection = connections[using]
+        _fts_available[using] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_available[using]
+
+
+def get_search_backend(using='default'):
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if vendor == 'sqlite' and fts_available(using):
+        return SQLiteFTSBackend(using)
+    return LikeSearchBackend()
+
+
+def search_products(queryset, query):
+    """Фильтрует queryset по поисковому запросу и сортирует по релевантности."""
+    return get_search_backend(queryset.db).search(queryset, query)
+
+
+# --------------------------
+# Синхронизация индекса с Product
+# --------------------------
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, using='default', **kwargs):
+    if not raw:
+        get_search_backend(using).index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using='default', **kwargs):
+    get_search_backend(using).remove_products([instance.pk])
@@ -1,22 +1,45 @@
 from rest_framework import serializers
-from .models import Product, Category, CartItem, Order, OrderItem
+from .models import Product, Category, CartItem, Order, OrderItem, Sale
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Оставляет в ответе только перечисленные поля: Serializer(..., fields=['id', 'title'])."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
+    # цена из ProductPrice: queryset должен быть with_prices()
+    discounted_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    discount_percent = serializers.IntegerField(read_only=True)
     class Meta:
         model = Product
-        fields = ['id', 'title', 'slug', 'description', 'price', 'stock', 'category', 'image']
+        fields = ['id', 'title', 'slug', 'description', 'price', 'discounted_price', 'discount_percent',
+                  'stock', 'category', 'image']
+
+
+class SaleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # queryset должен подтягивать products через prefetch_related
+    products = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    class Meta:
+        model = Sale
+        fields = ['id', 'title', 'description', 'discount_percent', 'image', 'products']
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'quantity', 'subtotal']
@@ -29,8 +52,8 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['product', 'price', 'quantity']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     class Meta:
         model = Order
-        fields = ['id', 'full_name', 'address', 'phone', 'status', 'total', 'items', 'created']
\ No newline at end of file
+        fields = ['id', 'full_name', 'address', 'phone', 'status', 'total', 'items', 'created']
@@ -0,0 +1,75 @@
+"""
+Нормализация текста для поискового индекса: слова в нижнем регистре, прогнанные
+через русский стеммер (Snowball).
+
+Модуль не зависит от моделей, поэтому его использует и миграция 0014,
+заполняющая индекс FTS5.
+"""
+import re
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-яё]')
+
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DER = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+
+
+def stem_russian(word):
+    """Возвращает основу русского слова; остальные слова только приводит к нижнему регистру."""
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+
+    match = _RV.match(word)
+    if not match:
+        return word
+    start, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub('', rv, count=1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, count=1)
+        stripped = _ADJECTIVE.sub('', rv, count=1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, count=1)
+        else:
+            stripped = _VERB.sub('', rv, count=1)
+            rv = _NOUN.sub('', rv, count=1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    rv = re.sub(r'и$', '', rv, count=1)
+    if _DERIVATIONAL.match(rv):
+        rv = _DER.sub('', rv, count=1)
+
+    stripped = re.sub(r'ь$', '', rv, count=1)
+    if stripped == rv:
+        rv = _SUPERLATIVE.sub('', rv, count=1)
+        rv = re.sub(r'нн$', 'н', rv, count=1)
+    else:
+        rv = stripped
+
+    return start + rv
+
+
+def tokenize(text):
+    return [stem_russian(word) for word in WORD_RE.findall(text or '')]
+
+
+def normalize_text(text):
+    """Текст в том виде, в котором он хранится в индексе FTS5."""
+    return ' '.join(tokenize(text))
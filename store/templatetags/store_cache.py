@@ -0,0 +1,54 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from ..caching import DEFAULT_TIMEOUT, fragment_key, get_version
+from ..db_routing import cacheable
+
+register = template.Library()
+
+
+class CacheFragmentNode(template.Node):
+    def __init__(self, nodelist, name, namespaces, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.namespaces = namespaces
+        self.vary_on = vary_on
+
+    def render(self, context):
+        namespaces = [ns.strip() for ns in self.namespaces.resolve(context).split(',') if ns.strip()]
+        key = fragment_key(
+            self.name.resolve(context), namespaces, [var.resolve(context) for var in self.vary_on]
+        )
+        content = cache.get(key)
+        if content is None:
+            content = self.nodelist.render(context)
+            # отрендеренное по отстающей реплике не сохраняется под новой версией
+            if cacheable([get_version(ns) for ns in namespaces]):
+                cache.set(key, content, getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+        return content
+
+
+@register.tag
+def cachefragment(parser, token):
+    """
+    Кеширует фрагмент шаблона до изменения перечисленных групп данных (caching.py):
+
+        {% cachefragment 'index:catalog' 'catalog' page_cursor %}...{% endcachefragment %}
+
+    Аргументы: имя фрагмента, группы через запятую ('catalog,sales'), затем значения,
+    от которых зависит содержимое. Внутри не должно быть данных пользователя и CSRF-токенов.
+    Данные для фрагмента лучше передавать ленивыми (QuerySet, SimpleLazyObject), чтобы при
+    попадании в кеш запросы к БД не выполнялись.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a name and namespaces")
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    return CacheFragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
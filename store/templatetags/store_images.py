@@ -0,0 +1,51 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from ..images import PROFILES, Rendition
+
+register = template.Library()
+
+# подсказки браузеру о ширине картинки на странице для каждого профиля
+DEFAULT_SIZES = {
+    'product': '(min-width: 1024px) 33vw, (min-width: 640px) 50vw, 100vw',
+    'sale': '(min-width: 1024px) 33vw, 100vw',
+    'banner': '100vw',
+    'review': '192px',
+    'avatar': '40px',
+}
+
+
+@register.simple_tag
+def picture(image, profile, sizes=None, loading='lazy', **attrs):
+    """
+    <picture> с AVIF/WebP и JPEG в srcset для обработанного изображения (см. images.py);
+    выводятся только форматы, отмеченные в имени файла как построенные:
+        {% picture product.image 'product' alt=product.title class="w-full h-48 object-cover" %}
+    Необработанный файл выводится обычным <img>.
+    """
+    if not image:
+        return ''
+    if profile not in PROFILES:
+        raise template.TemplateSyntaxError(f"Unknown image profile: {profile!r}")
+
+    attrs['loading'] = loading
+    rendition = Rendition.from_name(image.name)
+    if rendition is None:
+        return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+
+    sizes = sizes or DEFAULT_SIZES[profile]
+    *modern, (fallback_ext, _, _, _) = rendition.formats()
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((mime, rendition.srcset(profile, ext, image.storage), sizes) for ext, _, mime, _ in modern),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        sources,
+        image.storage.url(rendition.largest_name(profile, fallback_ext)),
+        rendition.srcset(profile, fallback_ext, image.storage),
+        sizes,
+        flatatt(attrs),
+    )
+
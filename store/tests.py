@@ -1,3 +1,1227 @@
-from django.test import TestCase
+import io
+import json
+import re
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, connections
+from django.template import Context, Template
+from django.test import Client, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from . import benchmark, facets, images, metrics, query_plans, search, urls as store_urls
+from .cart import merge_session_cart
+from .checkout import OutOfStockError, place_order
+from .cleanup import collect_garbage
+from .concurrency import prepare_buyers, run_concurrent_checkouts
+from .database import apply_pragmas, current_pragmas, set_journal_mode
+from .db_routing import PIN_COOKIE, mark_replica_synced
+from .image_queue import MAX_ATTEMPTS, process_batch as process_batch_images
+from .images import Rendition, process_instance
+from .importer import import_catalog
+from .middleware import page_cache_stats
+from .models import (
+    CartItem, CartSummary, Category, ImageJob, Order, OrderCommand, OrderItem, Product, ProductPrice, Review, Sale,
+)
+from .order_queue import OrderWorkerPool, process_batch
+from .workers import LazyPool, WorkerPool
+from .ratings import rebuild_ratings
+
+User = get_user_model()
+
+
+def make_product(slug='p', price='1000.00', stock=10, **kwargs):
+    return Product.objects.create(title=slug, slug=slug, price=Decimal(price), stock=stock, **kwargs)
+
+
+# --------------------------
+# Цены
+# --------------------------
+class ProductPriceTests(TestCase):
+    def setUp(self):
+        self.phone = make_product('phone', price='1000.00')
+        self.case = make_product('case', price='200.00')
+
+    def _price(self, product):
+        return ProductPrice.objects.values_list('price', 'discount_percent').get(product=product)
+
+    def test_price_table_follows_product_sale_and_membership_changes(self):
+        self.assertEqual(self._price(self.phone), (Decimal('1000.00'), 0))
+
+        sale = Sale.objects.create(title='sale', discount_percent=25)
+        sale.products.add(self.phone, self.case)
+        self.assertEqual(self._price(self.phone), (Decimal('750.00'), 25))
+        self.assertEqual(self._price(self.case), (Decimal('150.00'), 25))
+
+        better = Sale.objects.create(title='better', discount_percent=40)
+        self.case.sales.add(better)  # обратная сторона m2m
+        self.assertEqual(self._price(self.case), (Decimal('120.00'), 40))
+
+        self.phone.price = Decimal('2000.00')
+        self.phone.save()
+        self.assertEqual(self._price(self.phone), (Decimal('1500.00'), 25))
+
+        sale.products.remove(self.phone)
+        self.assertEqual(self._price(self.phone), (Decimal('2000.00'), 0))
+
+        better.delete()  # акция закончилась
+        self.assertEqual(self._price(self.case), (Decimal('150.00'), 25))
+        sale.discount_percent = 0
+        sale.save()
+        self.assertEqual(self._price(self.case), (Decimal('200.00'), 0))
+
+        sale.products.add(self.phone)
+        sale.products.clear()
+        self.assertEqual(self._price(self.phone), (Decimal('2000.00'), 0))
+
+    def test_listing_reads_prices_without_per_row_queries(self):
+        sale = Sale.objects.create(title='sale', discount_percent=10)
+        sale.products.add(*[make_product(f'p{i}', price='100.00') for i in range(20)])
+
+        with self.assertNumQueries(1):
+            prices = [(p.discounted_price, p.discount_percent) for p in Product.objects.with_prices()]
+
+        self.assertEqual(len(prices), 22)
+        self.assertEqual(prices.count((Decimal('90.00'), 10)), 20)
+
+
+# --------------------------
+# Каталог
+# --------------------------
+@override_settings(CATALOG_PAGE_SIZE=5)
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # одинаковые цены: порядок страниц задаёт только pk
+        self.products = [make_product(f'p{i}', price='100.00') for i in range(23)]
+
+    def test_cursor_walks_catalog_once_in_stable_order(self):
+        url, seen = reverse('store:catalog_page'), []
+        while url:
+            response = self.client.get(url)
+            seen.extend(p.pk for p in response.context['products'])
+            url = response.get('X-Next-Page')
+        self.assertEqual(seen, [p.pk for p in self.products])
+
+        response = self.client.get(reverse('store:index'), {'after': self.products[9].pk})
+        self.assertEqual([p.pk for p in response.context['products']], [p.pk for p in self.products[10:15]])
+        self.assertEqual(response.context['cursor'], self.products[9].pk)
+
+    def test_deep_page_costs_the_same_as_first(self):
+        url = reverse('store:catalog_page')
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        # товары с ценами и категориями одним запросом; OFFSET нет — глубина страницы не важна
+        self.assertEqual(len(first), 1)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'after': self.products[19].pk})
+        self.assertEqual(len(response.context['products']), 3)
+        self.assertNotIn('X-Next-Page', response)
+        self.assertFalse(any('OFFSET' in q['sql'] for q in first))
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        phones = Category.objects.create(name='Телефоны', slug='phones')
+        self.cheap = make_product('cheap', price='5000.00', category=phones)
+        self.mid = make_product('mid', price='20000.00', category=phones)
+        self.premium = make_product('premium', price='60000.00')
+        sale = Sale.objects.create(title='sale', discount_percent=50)
+        sale.products.add(self.premium)  # 30 000 ₸ по акции
+        Review.objects.create(product=self.mid, user=User.objects.create_user('buyer'), rating=5)
+
+    def test_counts_use_effective_price(self):
+        counts = facets.compute_facets(Product.objects.all())
+
+        self.assertEqual((counts['total'], counts['discounted']), (3, 1))
+        self.assertEqual([n for _, _, _, n in counts['price']], [1, 2, 0, 0, 0])
+        self.assertEqual(dict(counts['rating'])[4], 1)
+        self.assertEqual(counts['category'], {self.cheap.category_id: 2, None: 1})
+
+    def test_price_bucket_link_finds_sale_product(self):
+        response = self.client.get(reverse('store:search_products'), {'min_price': '10000.00', 'max_price': '49999.99'})
+        self.assertEqual({p.slug for p in response.context['products']}, {'mid', 'premium'})
+        price_links = {f['label']: f['count'] for f in response.context['facets']['price']}
+        self.assertEqual(sum(price_links.values()), 3)
+
+        response = self.client.get(reverse('store:search_products'), {'min_price': 'abc'})
+        self.assertEqual(len(response.context['products']), 3)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.shoes = make_product('shoes', description='Пара лёгких кроссовок')
+        self.sneakers = Product.objects.create(
+            title='Кроссовки беговые', slug='sneakers', price=Decimal('100.00'), description='Для бега',
+        )
+        self.phones = make_product('phones', description='Беспроводные наушники')
+
+    def _search(self, query):
+        return [p.slug for p in search.search_products(Product.objects.all(), query)]
+
+    def test_stemmed_prefix_match_ranked_by_title_first(self):
+        self.assertTrue(search.fts_available())
+        self.assertEqual(search.normalize_text('Кроссовки кроссовок'), 'кроссовк кроссовок')
+        # беглая гласная
+        self.assertEqual((search.prefix_term('кроссовк'), search.prefix_term('кроссовок')), ('кроссов', 'кроссов'))
+        # совпадение в названии весомее описания
+        self.assertEqual(self._search('кроссовки'), ['sneakers', 'shoes'])
+        self.assertEqual(self._search('кроссовок'), ['sneakers', 'shoes'])
+        self.assertEqual(self._search('беспроводн наушн'), ['phones'])
+        self.assertEqual(self._search('науш'), ['phones'])
+        self.assertEqual(self._search('телевизор'), [])
+
+    def test_rank_is_computed_in_one_join(self):
+        with CaptureQueriesContext(connection) as queries:
+            self._search('кроссовка')
+        sql = queries[0]['sql']
+        self.assertEqual((len(queries), sql.count('bm25('), sql.count('SELECT')), (1, 1, 1))
+
+
+# --------------------------
+# Корзина
+# --------------------------
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.client.force_login(self.user)
+        self.phone = make_product('phone', price='1000.00')
+        self.case = make_product('case', price='200.00')
+
+    def test_summary_follows_quantity_updates_and_price_changes(self):
+        self.client.post(reverse('store:add_to_cart', args=[self.phone.pk]), {'quantity': 2})
+        self.client.post(reverse('store:add_to_cart', args=[self.case.pk]), {'quantity': 1})
+        item = CartItem.objects.get(product=self.phone)
+
+        response = self.client.post(reverse('store:update_cart_quantity'), {'item_id': item.pk, 'quantity': 3})
+
+        self.assertEqual(response.json()['cart_total'], '₸3 200')
+        summary = CartSummary.objects.get(user=self.user)
+        self.assertEqual((summary.item_count, summary.total_quantity), (2, 4))
+
+        sale = Sale.objects.create(title='sale', discount_percent=50)
+        sale.products.add(self.phone)
+        self.assertFalse(CartSummary.objects.filter(user=self.user).exists())
+        response = self.client.post(reverse('store:update_cart_quantity'), {'item_id': item.pk, 'quantity': 3})
+        self.assertEqual(response.json()['cart_total'], '₸1 700')
+
+    def test_foreign_cart_lines_are_not_editable(self):
+        other = User.objects.create_user('other')
+        item = CartItem.objects.create(user=other, product=self.phone, quantity=1)
+
+        response = self.client.post(reverse('store:update_cart_quantity'), {'item_id': item.pk, 'quantity': 5})
+
+        self.assertEqual(response.status_code, 404)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 1)
+
+
+@override_settings(GUEST_CART_BACKEND='cookie')
+class GuestCartTests(TestCase):
+    def setUp(self):
+        self.phone = make_product('phone', price='1000.00')
+
+    def test_guest_cart_does_not_write_to_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('store:add_to_cart', args=[self.phone.pk]), {'quantity': 2})
+            response = self.client.get(reverse('store:cart'))
+            self.client.post(reverse('store:update_cart_quantity'), {'item_id': self.phone.pk, 'quantity': 3})
+
+        writes = [q['sql'] for q in queries if not q['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.assertEqual(response.context['total'], Decimal('2000.00'))
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_guest_cart_moves_to_user_on_login(self):
+        user = User.objects.create_user('buyer', password='pass')
+        CartItem.objects.create(user=user, product=self.phone, quantity=1)
+        self.client.post(reverse('store:add_to_cart', args=[self.phone.pk]), {'quantity': 2})
+
+        self.client.post(reverse('store:login'), {'username': 'buyer', 'password': 'pass'})
+
+        self.assertEqual(CartItem.objects.get(user=user).quantity, 3)
+        self.assertEqual(self.client.cookies['cart'].value, '')
+
+    def test_oversized_cookie_cart_moves_to_cache(self):
+        laptop = make_product('laptop', price='5000.00')
+        self.client.post(reverse('store:add_to_cart', args=[self.phone.pk]), {'quantity': 1})
+        self.assertTrue(self.client.cookies['cart'].value)
+
+        with mock.patch('store.cart.COOKIE_MAX_BYTES', 200):
+            self.client.post(reverse('store:add_to_cart', args=[laptop.pk]), {'quantity': 2})
+        self.assertEqual(self.client.cookies['cart'].value, '')
+        self.assertTrue(self.client.cookies['cart_id'].value)
+
+        response = self.client.get(reverse('store:cart'))
+        self.assertEqual(response.context['total'], Decimal('11000.00'))
+        self.assertFalse(CartItem.objects.exists())
+
+
+@override_settings(GUEST_CART_BACKEND='db')
+class SessionCartMergeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+
+    def _guest_cart(self, products, quantity=1):
+        self.client.post(reverse('store:add_to_cart', args=[products[0].pk]), {'quantity': quantity})
+        session_key = self.client.session.session_key
+        CartItem.objects.bulk_create([
+            CartItem(session_key=session_key, product=p, quantity=quantity) for p in products[1:]
+        ])
+        return session_key
+
+    def test_large_guest_cart_merged_with_constant_queries(self):
+        products = Product.objects.bulk_create([
+            Product(title=f'p{i}', slug=f'p{i}', price=Decimal('10.00'), stock=10) for i in range(500)
+        ])
+        CartItem.objects.bulk_create([CartItem(user=self.user, product=p, quantity=1) for p in products[:200]])
+        session_key = self._guest_cart(products, quantity=2)
+
+        # UPDATE, DELETE, UPDATE, DELETE, UPDATE, DELETE итогов + SAVEPOINT/RELEASE
+        with self.assertNumQueries(8):
+            moved = merge_session_cart(session_key, self.user)
+
+        self.assertEqual(moved, 300)
+        self.assertFalse(CartItem.objects.filter(session_key=session_key).exists())
+        quantities = dict(CartItem.objects.filter(user=self.user).values_list('product_id', 'quantity'))
+        self.assertEqual(len(quantities), 500)
+        self.assertEqual(quantities[products[0].pk], 3)
+        self.assertEqual(quantities[products[499].pk], 2)
+
+    def test_duplicate_session_rows_merge_into_one_line(self):
+        phone, laptop = make_product('phone'), make_product('laptop')
+        CartItem.objects.create(user=self.user, product=laptop, quantity=1)
+        session_key = self._guest_cart([phone, phone, laptop, laptop], quantity=2)
+
+        self.assertEqual(merge_session_cart(session_key, self.user), 1)
+
+        quantities = sorted(CartItem.objects.filter(user=self.user).values_list('product__title', 'quantity'))
+        self.assertEqual(quantities, [('laptop', 5), ('phone', 4)])
+
+    def test_session_cart_moves_to_user_on_login(self):
+        phone = make_product('phone', price='1000.00')
+        CartItem.objects.create(user=self.user, product=phone, quantity=1)
+        session_key = self._guest_cart([phone], quantity=2)
+
+        self.client.post(reverse('store:login'), {'username': 'buyer', 'password': 'pass'})
+
+        self.assertNotEqual(self.client.session.session_key, session_key)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+        self.assertFalse(CartItem.objects.filter(session_key=session_key).exists())
+
+
+class CartCleanupTests(TestCase):
+    def test_abandoned_guest_carts_and_expired_sessions_removed_in_batches(self):
+        phone = make_product('phone')
+        user = User.objects.create_user('buyer')
+        now = timezone.now()
+        Session.objects.bulk_create([
+            Session(session_key='live', session_data='', expire_date=now + timedelta(days=1)),
+            Session(session_key='dead', session_data='', expire_date=now - timedelta(days=1)),
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(session_key='live', product=phone),
+            CartItem(session_key='dead', product=phone),
+            CartItem(session_key='gone', product=phone),
+            CartItem(user=user, product=phone),
+        ])
+        CartSummary.objects.create(session_key='gone')
+
+        report = collect_garbage(batch_size=1)
+
+        self.assertEqual((report.cart_items, report.cart_summaries, report.sessions), (2, 1, 1))
+        self.assertEqual(report.batches, 4)
+        self.assertEqual(
+            set(CartItem.objects.values_list('session_key', flat=True)), {'live', None})
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+
+@modify_settings(MIDDLEWARE={'remove': 'store.middleware.PageCacheMiddleware'})
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sale = Sale.objects.create(title='Осенняя распродажа', discount_percent=10)
+        self.sale.products.add(make_product('phone'))
+
+    def test_anonymous_pages_served_from_fragments(self):
+        pages = [
+            (reverse('store:index'), 0),
+            (reverse('store:sale_list'), 0),
+            # сама акция читается всегда (404 для несуществующей), товары — из кеша
+            (reverse('store:sale_detail', args=[self.sale.pk]), 1),
+        ]
+        for url, queries in pages:
+            self.client.get(url)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_sale_change_invalidates_fragments(self):
+        self.client.get(reverse('store:sale_list'))
+        self.sale.title = 'Зимняя распродажа'
+        self.sale.save()
+
+        response = self.client.get(reverse('store:sale_list'))
+
+        self.assertContains(response, 'Зимняя распродажа')
+        self.assertNotContains(response, 'Осенняя распродажа')
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phone = make_product('phone')
+        self.url = reverse('store:product_detail', args=[self.phone.pk])
+
+    def test_anonymous_page_cached_with_etag_and_304(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual((first['X-Page-Cache'], second['X-Page-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('Last-Modified', second)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(page_cache_stats()['hit'], 2)
+
+    def test_cached_page_gets_fresh_csrf_token(self):
+        self.client.get(self.url)
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(self.url)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode())[1]
+
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        post = client.post(reverse('store:add_to_cart', args=[self.phone.pk]),
+                           {'quantity': 1, 'csrfmiddlewaretoken': token})
+        self.assertEqual(post.status_code, 302)
+
+    def test_product_change_and_cart_bypass(self):
+        etag = self.client.get(self.url)['ETag']
+        self.phone.title = 'new phone'
+        self.phone.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'new phone')
+
+        self.client.post(reverse('store:add_to_cart', args=[self.phone.pk]), {'quantity': 1})
+        self.assertEqual(self.client.get(self.url)['X-Page-Cache'], 'BYPASS')
+
+
+# --------------------------
+# Оформление заказа
+# --------------------------
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.phone = make_product('phone', price='1000.00', stock=5)
+        self.case = make_product('case', price='200.00', stock=1)
+        sale = Sale.objects.create(title='sale', discount_percent=10)
+        sale.products.add(self.phone)
+
+    def test_order_created_with_discount_and_stock_reserved(self):
+        CartItem.objects.create(user=self.user, product=self.phone, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.case, quantity=1)
+
+        # корзина, резервирование каждой позиции, заказ, позиции, очистка корзины и её итогов + SAVEPOINT/RELEASE
+        with self.assertNumQueries(9):
+            order = place_order(self.user, 'Иван', 'Адрес', '123')
+
+        self.assertEqual(order.total, Decimal('1800.00') + Decimal('200.00'))
+        items = {it.product_id: it for it in order.items.all()}
+        self.assertEqual(items[self.phone.pk].price, Decimal('900.00'))
+        self.assertEqual(items[self.phone.pk].discount_percent, 10)
+        self.assertEqual(items[self.case.pk].discount_percent, 0)
+        self.phone.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual((self.phone.stock, self.case.stock), (3, 0))
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_oversell_rolls_back_everything(self):
+        CartItem.objects.create(user=self.user, product=self.phone, quantity=1)
+        CartItem.objects.create(user=self.user, product=self.case, quantity=2)
+
+        with self.assertRaises(OutOfStockError) as ctx:
+            place_order(self.user, 'Иван', 'Адрес', '123')
+
+        self.assertEqual(ctx.exception.products, [self.case])
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_short_line_found_by_rowcount_not_timestamp(self):
+        now = timezone.now()
+        # остаток case уже менялся в ту же микросекунду, но сейчас его не хватает
+        Product.objects.filter(pk=self.case.pk).update(updated=now)
+        CartItem.objects.create(user=self.user, product=self.phone, quantity=1)
+        CartItem.objects.create(user=self.user, product=self.case, quantity=2)
+
+        with mock.patch('store.checkout.timezone.now', return_value=now):
+            with self.assertRaises(OutOfStockError) as ctx:
+                place_order(self.user, 'Иван', 'Адрес', '123')
+
+        self.assertEqual(ctx.exception.products, [self.case])
+        self.assertEqual(Product.objects.get(pk=self.phone.pk).stock, 5)
+
+    def test_checkout_view_reports_oversell(self):
+        CartItem.objects.create(user=self.user, product=self.case, quantity=3)
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('store:checkout'), {
+            'full_name': 'Иван', 'address': 'Адрес', 'phone': '123',
+        }, follow=True)
+
+        self.assertRedirects(response, reverse('store:cart'))
+        self.assertContains(response, 'Недостаточно товара на складе: case.')
+
+
+# --------------------------
+# Рейтинги
+# --------------------------
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.phone = make_product('phone')
+
+    def _aggregates(self):
+        return Product.objects.values_list(*Product.RATING_FIELDS).get(pk=self.phone.pk)
+
+    def test_aggregates_follow_review_changes(self):
+        five = Review.objects.create(product=self.phone, user=self.user, rating=5)
+        three = Review.objects.create(product=self.phone, user=self.user, rating=3)
+        self.assertEqual(self._aggregates(), (2, 8, 0, 0, 1, 0, 1))
+
+        three.rating = 4
+        three.save()
+        five.delete()
+        self.assertEqual(self._aggregates(), (1, 4, 0, 0, 0, 1, 0))
+
+        Product.objects.filter(pk=self.phone.pk).update(review_count=0, rating_sum=0, rating_4=0)
+        rebuild_ratings()
+        self.assertEqual(self._aggregates(), (1, 4, 0, 0, 0, 1, 0))
+
+    def test_stale_product_save_keeps_aggregates(self):
+        stale = Product.objects.get(pk=self.phone.pk)  # например, форма админки, открытая до отзыва
+        Review.objects.create(product=self.phone, user=self.user, rating=4)
+        stale.title = 'new phone'
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual((stale.title, stale.review_count, stale.average_rating), ('new phone', 1, 4))
+
+        stale.save(update_fields=['review_count'])  # явно указанные поля записываются
+        self.assertEqual(self._aggregates()[0], 1)
+
+    def test_detail_page_reviews_without_per_review_queries(self):
+        users = [User.objects.create_user(f'u{i}') for i in range(15)]
+        Review.objects.bulk_create([Review(product=self.phone, user=u, rating=4) for u in users])
+        rebuild_ratings([self.phone.pk])
+
+        # товар, страница отзывов с авторами
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('store:product_detail', args=[self.phone.pk]))
+
+        self.assertEqual(len(response.context['reviews']), 10)
+        self.assertTrue(response.context['reviews'].has_next)
+        self.assertEqual(response.context['avg_rating'], 4)
+
+
+# --------------------------
+# Изображения
+# --------------------------
+class ImageTestMixin:
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root, **self.settings_overrides)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _upload(self, width=1200, height=800):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (width, height), (200, 30, 30)).save(buffer, format='JPEG')
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageDerivativeTests(ImageTestMixin, TestCase):
+    settings_overrides = {'IMAGE_PROCESSING_MODE': 'sync'}
+
+    def test_upload_builds_hashed_derivatives_and_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = make_product('phone', image=self._upload())
+        product.refresh_from_db()
+
+        rendition = Rendition.from_name(product.image.name)
+        self.assertIsNotNone(rendition)
+        self.assertEqual(rendition.max_width, 960)
+        storage = product.image.storage
+        self.assertTrue(storage.exists(f'derivatives/{rendition.digest}/240.webp'))
+        self.assertTrue(storage.exists(f'derivatives/{rendition.digest}/960.jpg'))
+
+        html = Template("{% load store_images %}{% picture product.image 'product' alt='x' %}").render(
+            Context({'product': product}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f'/media/derivatives/{rendition.digest}/480.jpg 480w', html)
+
+    def test_srcset_lists_only_formats_built_for_the_image(self):
+        jpeg_only = [fmt for fmt in images.FORMATS if fmt[0] == 'jpg']
+        with mock.patch('store.images.available_formats', return_value=jpeg_only), \
+                self.captureOnCommitCallbacks(execute=True):
+            product = make_product('phone', image=self._upload())
+        product.refresh_from_db()
+
+        html = Template("{% load store_images %}{% picture product.image 'product' %}").render(
+            Context({'product': product}))
+        self.assertNotIn('<source', html)
+        self.assertIn('480.jpg 480w', html)
+
+    def test_reupload_during_processing_is_kept(self):
+        with override_settings(IMAGE_PROCESSING_MODE='queue', IMAGE_QUEUE_WORKERS=0):
+            product = make_product('phone', image=self._upload())
+        old_name, updated = product.image.name, product.updated
+        Product.objects.filter(pk=product.pk).update(image='products/new.jpg')  # новая загрузка
+
+        self.assertFalse(images.process_field(product, 'image', 'product'))
+        self.assertEqual(Product.objects.get(pk=product.pk).image.name, 'products/new.jpg')
+        self.assertTrue(product.image.storage.exists(old_name))
+
+        Product.objects.filter(pk=product.pk).update(image=old_name)
+        product.refresh_from_db()
+        self.assertTrue(images.process_field(product, 'image', 'product'))
+        product.refresh_from_db()
+        self.assertIsNotNone(Rendition.from_name(product.image.name))
+        self.assertGreater(product.updated, updated)  # фид отдаёт новые ссылки, а не 304
+
+    def test_small_image_is_not_upscaled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = make_product('case', image=self._upload(300, 300))
+        product.refresh_from_db()
+        self.assertEqual(Rendition.from_name(product.image.name).max_width, 300)
+
+
+class ImageQueueTests(ImageTestMixin, TestCase):
+    settings_overrides = {'IMAGE_PROCESSING_MODE': 'queue', 'IMAGE_QUEUE_WORKERS': 0}
+
+    def test_review_upload_returns_job_and_worker_processes_it(self):
+        user = User.objects.create_user('buyer', password='pass')
+        phone = make_product('phone')
+        self.client.force_login(user)
+
+        response = self.client.post(
+            reverse('store:add_review', args=[phone.pk]),
+            {'rating': 5, 'text': 'ok', 'image': self._upload()},
+            HTTP_ACCEPT='application/json',
+        )
+
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['job']['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'pending')
+
+        self.assertEqual(process_batch_images(), 1)
+        data = self.client.get(status_url).json()
+        self.assertEqual(data['status'], 'done')
+        self.assertIsNotNone(Rendition.from_name(data['url']))
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        product = make_product('phone', image=self._upload())
+        product.image.storage.delete(product.image.name)
+        job = ImageJob.objects.get()
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            ImageJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            with self.assertLogs('store.image_queue', 'WARNING'):
+                process_batch_images()
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+        self.assertEqual(job.status, 'failed')
+
+    def test_unexpected_error_fails_only_that_job(self):
+        broken = make_product('phone', image=self._upload())
+        make_product('case', image=self._upload())
+
+        def process_or_fail(model, pk, *args):
+            if pk == broken.pk:
+                raise ValueError('cannot identify image')
+            return process_instance(model, pk, *args)
+
+        with mock.patch('store.image_queue.process_instance', process_or_fail), \
+                self.assertLogs('store.image_queue', 'ERROR'):
+            self.assertEqual(process_batch_images(), 2)
+
+        statuses = dict(ImageJob.objects.values_list('object_id', 'status'))
+        self.assertEqual(statuses.pop(broken.pk), 'failed')
+        self.assertEqual(list(statuses.values()), ['done'])
+
+
+class WorkerPoolTests(TestCase):
+    def test_worker_survives_errors_and_dead_threads_are_restarted(self):
+        calls = []
+        second = threading.Event()
+
+        def process_batch(batch_size):
+            calls.append(batch_size)
+            if len(calls) == 1:
+                raise RuntimeError('boom')
+            if len(calls) == 2:
+                second.set()
+                raise SystemExit  # поток завершается, как при необработанной ошибке
+            second.set()
+            return 0
+
+        pools = LazyPool(lambda workers: WorkerPool(process_batch, workers, poll_interval=0.01), 'POOL_WORKERS')
+        with override_settings(POOL_WORKERS=1), self.assertLogs('store.workers', 'WARNING') as logs:
+            pool = pools.get()
+            self.addCleanup(pool.stop, 1)
+            self.assertTrue(second.wait(2))
+            pool._threads[0].join(2)
+            second.clear()
+            self.assertIs(pools.get(), pool)
+            self.assertTrue(second.wait(2))
+
+        self.assertIn('RuntimeError: boom', logs.output[0])
+        self.assertIn('restarting', logs.output[-1])
+
+
+class CatalogImportTests(ImageTestMixin, TestCase):
+    settings_overrides = {'IMAGE_QUEUE_WORKERS': 0}
+
+    def test_upserts_in_chunks_and_queues_images(self):
+        source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        with open(f'{source_dir}/phone.jpg', 'wb') as f:
+            f.write(self._upload().read())
+        make_product('case', price='100.00')
+        path = f'{source_dir}/catalog.csv'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(
+                'slug,title,price,stock,category,image\n'
+                'phone,Смартфон Galaxy,1500.00,3,Телефоны,phone.jpg\n'
+                'case,Чехол,250,7,Аксессуары,\n'
+                'broken,Без цены,,1,,\n'
+                'cable,Кабель,50,0,Аксессуары,missing.jpg\n'
+                '../../escape,Чужой путь,10,1,,phone.jpg\n'
+            )
+
+        with self.assertLogs('store.importer', 'WARNING'):
+            report = import_catalog(path, chunk_size=2, image_workers=2, image_root=source_dir)
+
+        self.assertEqual((report.rows, report.created, report.updated, report.skipped), (5, 2, 1, 2))
+        self.assertEqual(report.errors, [(4, 'missing price'), (6, "bad slug '../../escape'")])
+        self.assertEqual((report.images, report.image_errors), (1, 1))
+        case = Product.objects.get(slug='case')
+        self.assertEqual((case.price, case.stock, case.category.name), (Decimal('250.00'), 7, 'Аксессуары'))
+        self.assertEqual(case.pricing.price, Decimal('250.00'))
+        phone = Product.objects.get(slug='phone')
+        self.assertEqual(ImageJob.objects.get().object_id, phone.pk)
+        self.assertIn(phone, search.search_products(Product.objects.all(), 'смартфоны'))
+
+        with self.assertLogs('store.importer', 'WARNING'):
+            report = import_catalog(path, image_root=source_dir)
+        self.assertEqual((report.created, report.updated, report.images), (0, 3, 0))
+        self.assertEqual(Category.objects.count(), 2)
+
+
+class OrderHistoryTests(TestCase):
+    def test_history_page_uses_fixed_number_of_queries(self):
+        user = User.objects.create_user('buyer', password='pass')
+        products = [make_product(f'p{i}') for i in range(3)]
+        orders = Order.objects.bulk_create([
+            Order(user=user, full_name='Иван', address='Адрес', phone='123') for _ in range(25)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, price=Decimal('10.00'), quantity=2)
+            for order in orders for product in products
+        ])
+        self.client.force_login(user)
+
+        # сессия, пользователь, страница заказов, позиции с товарами, профиль в шапке
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('store:orders'))
+
+        page = response.context['page']
+        self.assertEqual([o.pk for o in page], [o.pk for o in reversed(orders)][:10])
+        self.assertEqual((page.object_list[0].line_count, page.object_list[0].quantity_total), (3, 6))
+        self.assertTrue(page.has_next)
+
+
+# --------------------------
+# API
+# --------------------------
+class ApiTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Телефоны', slug='phones')
+        self.products = [make_product(f'p{i}', category=category) for i in range(5)]
+        sale = Sale.objects.create(title='sale', discount_percent=10)
+        sale.products.add(*self.products[:2])
+
+    def test_product_list_is_one_query_with_cursor_and_sparse_fields(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/products/', {'limit': 3, 'fields': 'id,discounted_price,category'})
+
+        data = response.json()
+        self.assertEqual([p['id'] for p in data['results']], [p.pk for p in self.products[:3]])
+        self.assertEqual(data['results'][0], {
+            'id': self.products[0].pk, 'discounted_price': '900.00',
+            'category': {'id': self.products[0].category_id, 'name': 'Телефоны', 'slug': 'phones'},
+        })
+        rest = self.client.get(data['next']).json()
+        self.assertEqual([p['id'] for p in rest['results']], [p.pk for p in self.products[3:]])
+        self.assertIsNone(rest['next'])
+
+    def test_batch_fetch_and_bad_params(self):
+        ids = f'{self.products[4].pk},{self.products[1].pk},999'
+        response = self.client.get('/api/v1/products/', {'ids': ids})
+        self.assertEqual([p['id'] for p in response.json()['results']], [self.products[1].pk, self.products[4].pk])
+
+        self.assertEqual(self.client.get('/api/v1/products/', {'fields': 'id,secret'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/products/', {'ids': 'a,b'}).status_code, 400)
+
+    def test_orders_are_private_and_fixed_query_count(self):
+        self.assertEqual(self.client.get('/api/v1/orders/').status_code, 401)
+
+        user = User.objects.create_user('buyer', password='pass')
+        for _ in range(3):
+            order = Order.objects.create(user=user, full_name='Иван', address='Адрес', phone='123')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, price=product.price) for product in self.products
+            ])
+        self.client.force_login(user)
+
+        # сессия, пользователь, заказы, позиции с товарами
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/v1/orders/')
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len(results[0]['items']), 5)
+
+    def test_fast_serialization_matches_drf_output(self):
+        Product.objects.filter(pk=self.products[0].pk).update(image='products/p0.jpg')
+        user = User.objects.create_user('buyer', password='pass')
+        order = Order.objects.create(user=user, full_name='Иван', address='Адрес', phone='123')
+        OrderItem.objects.create(order=order, product=self.products[0], price=Decimal('900.00'), quantity=2)
+        OrderItem.objects.create(order=order, product=None, price=Decimal('5.50'))
+        self.client.force_login(user)
+
+        for url, params in [
+            ('/api/v1/products/', {}),
+            ('/api/v1/products/', {'fields': 'image,id,discount_percent', 'limit': 2}),
+            ('/api/v1/products/', {'ids': f'{self.products[1].pk},{self.products[3].pk}'}),
+            ('/api/v1/orders/', {}),
+        ]:
+            fast = self.client.get(url, params).content
+            with override_settings(API_FAST_SERIALIZATION=False):
+                drf = self.client.get(url, params).content
+            self.assertEqual(fast, drf)
+
+
+class CatalogFeedTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Телефоны', slug='phones')
+        self.phone = make_product('phone', price='1000.00', category=category)
+        self.case = make_product('case', price='200.00')
+        Sale.objects.create(title='sale', discount_percent=25).products.add(self.phone)
+
+    def test_feed_streams_sql_prices_and_honours_conditional_requests(self):
+        url = reverse('store:catalog_feed', args=['csv'])
+        response = self.client.get(url)
+
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[1], f'{self.phone.pk},phone,http://testserver/product/{self.phone.pk}/,'
+                                   '1000.00,750.00,25,10,Телефоны,')
+        self.assertEqual(len(lines), 3)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        Product.objects.filter(pk=self.case.pk).update(stock=0, updated=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_jsonl_and_xml_formats(self):
+        jsonl = b''.join(self.client.get(reverse('store:catalog_feed', args=['jsonl'])).streaming_content)
+        self.assertEqual(json.loads(jsonl.splitlines()[0])['discounted_price'], '750.00')
+
+        xml = b''.join(self.client.get(reverse('store:catalog_feed', args=['xml'])).streaming_content).decode()
+        self.assertIn(f'<offer id="{self.case.pk}"><title>case</title>', xml)
+        self.assertTrue(xml.endswith('</catalog>\n'))
+        self.assertEqual(self.client.get(reverse('store:catalog_feed', args=['pdf'])).status_code, 404)
+
+
+# --------------------------
+# Метрики и бюджеты запросов
+# --------------------------
+@override_settings(IMAGE_PROCESSING_MODE='queue', IMAGE_QUEUE_WORKERS=0)
+class QueryBudgetTests(TestCase):
+    """Каждый URL из store/urls.py и каждый сценарий укладываются в свой бюджет (metrics.py)."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user('buyer', password='pass', is_staff=True)
+        category = Category.objects.create(name='Телефоны', slug='phones')
+        products = [make_product(f'p{i}', category=category) for i in range(12)]
+        self.product = products[0]
+        self.sale = Sale.objects.create(title='sale', discount_percent=10)
+        self.sale.products.add(*products[:6])
+        for i in range(len(products)):
+            Review.objects.create(product=self.product, user=User.objects.create_user(f'r{i}'), rating=4)
+        self.item = CartItem.objects.create(user=self.user, product=products[1], quantity=1)
+        for product in products[2:8]:
+            CartItem.objects.create(user=self.user, product=product, quantity=2)
+        self.job = ImageJob.objects.create(model='store.review', object_id=1, field='image', user=self.user)
+        for _ in range(3):
+            order = Order.objects.create(user=self.user, full_name='Иван', address='Адрес', phone='123')
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=p, price=p.price) for p in products[:4]])
+        # готовая заявка: редирект на страницу заказа и запись сессии
+        self.command = OrderCommand.objects.create(user=self.user, idempotency_key='old', status='done', order=order)
+        self.products = products
+
+    def _photo(self):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (40, 40)).save(buffer, format='JPEG')
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def _assert_within_budget(self, name, response, scenario=None):
+        measured = response.wsgi_request.metrics
+        with self.subTest(name, scenario=scenario):
+            self.assertLess(response.status_code, 400)
+            self.assertIn('db;dur=', response['Server-Timing'])
+            if scenario is not None:
+                self.assertEqual(measured.scenario, scenario)
+            self.assertLessEqual(measured.queries, metrics.query_budget(measured), measured.fingerprints)
+            self.assertEqual(metrics.repeated_queries(measured), {})
+
+    def _requests(self):
+        checkout = {'full_name': 'Иван', 'address': 'Адрес', 'phone': '123', 'idempotency_key': 'k'}
+        # (url name, args, method, data, нужен вход)
+        return [
+            ('index', [], 'get', {}, True),
+            ('catalog_page', [], 'get', {}, True),
+            ('product_detail', [self.product.pk], 'get', {}, True),
+            ('add_review', [self.product.pk], 'post', {'rating': 5, 'text': 'ok', 'image': self._photo()}, True),
+            ('add_to_cart', [self.product.pk], 'post', {'quantity': 1}, True),
+            ('cart', [], 'get', {}, True),
+            ('update_cart', [self.item.pk], 'post', {'quantity': 3}, True),
+            ('update_cart_quantity', [], 'post', {'item_id': self.item.pk, 'quantity': 2}, True),
+            ('order_status', [self.command.pk], 'get', {}, True),
+            ('orders', [], 'get', {}, True),
+            ('about', [], 'get', {}, True),
+            ('contact', [], 'get', {}, True),
+            ('sale_list', [], 'get', {}, True),
+            ('sale_detail', [self.sale.pk], 'get', {}, True),
+            ('search_products', [], 'get', {'q': 'p1', 'has_discount': '1'}, True),
+            ('catalog_feed', ['csv'], 'get', {}, True),
+            ('profile', [], 'get', {}, True),
+            ('image_job_status', [self.job.pk], 'get', {}, True),
+            ('metrics', [], 'get', {}, True),
+            ('checkout', [], 'post', checkout, True),
+            ('payment_success', [], 'get', {}, True),
+            ('logout', [], 'get', {}, True),
+            ('login', [], 'post', {'username': 'buyer', 'password': 'pass'}, False),
+            ('register', [], 'post', {'username': 'new', 'email': 'new@example.com', 'password1': 'Str0ng-pass!', 'password2': 'Str0ng-pass!'},
+             False),
+        ]
+
+    def test_every_url_stays_within_query_budget(self):
+        requests = self._requests()
+        self.assertEqual(
+            {f'store:{name}' for name, *_ in requests},
+            {f'store:{pattern.name}' for pattern in store_urls.urlpatterns},
+        )
+        for name, args, method, data, login in requests:
+            if login:
+                self.client.force_login(self.user)
+            else:
+                self.client.logout()
+            response = getattr(self.client, method)(reverse(f'store:{name}', args=args), data)
+            self._assert_within_budget(name, response)
+
+    def test_guest_carts_and_merge_on_login_stay_within_budget(self):
+        product = self.products[9]
+        for backend in ('db', 'cookie', 'cache'):
+            self.client.logout()
+            with self.settings(GUEST_CART_BACKEND=backend):
+                for _ in range(2):
+                    response = self.client.post(reverse('store:add_to_cart', args=[product.pk]), {'quantity': 1})
+                    self._assert_within_budget(f'{backend}:add_to_cart', response, metrics.GUEST)
+                response = self.client.get(reverse('store:cart'))
+                self._assert_within_budget(f'{backend}:cart', response, metrics.GUEST)
+                # строка гостевой корзины в БД — CartItem, в cookie и кеше — id товара
+                line = CartItem.objects.filter(product=product, user=None).first()
+                response = self.client.post(reverse('store:update_cart_quantity'),
+                                            {'item_id': line.pk if line else product.pk, 'quantity': 3})
+                self._assert_within_budget(f'{backend}:update_cart_quantity', response, metrics.GUEST)
+
+                response = self.client.post(reverse('store:login'), {'username': 'buyer', 'password': 'pass'})
+                self._assert_within_budget(f'{backend}:login', response, metrics.CART_MERGE)
+            self.assertEqual(CartItem.objects.get(user=self.user, product=product).quantity, 3)
+            CartItem.objects.filter(product=product).delete()
+
+    def test_duplicate_queries_are_fingerprinted(self):
+        with metrics.collect('test') as measured:
+            for product in Product.objects.all():
+                Review.objects.filter(product=product).count()
+        self.assertEqual(measured.queries, 13)
+        self.assertEqual(list(measured.duplicates.values()), [12])
+
+        metrics.reset()
+        self.client.force_login(self.user)
+        self.client.get(reverse('store:orders'))
+        summary = self.client.get(reverse('store:metrics')).json()
+        self.assertEqual(summary['views']['store:orders']['requests'], 1)
+
+        # 127.0.0.1 из INTERNAL_IPS без DEBUG (например, за обратным прокси) доступа не даёт
+        self.client.force_login(User.objects.create_user('visitor'))
+        self.assertEqual(self.client.get(reverse('store:metrics')).status_code, 404)
+
+
+class BenchmarkTests(TestCase):
+    def test_routes_benchmark_covers_every_url_and_compares_baselines(self):
+        catalog = benchmark.build_catalog(50)
+        self.assertEqual(catalog.size, 50)
+
+        routes = benchmark.run_routes(catalog, requests=1, warmup=0)
+
+        self.assertEqual(set(routes), {f'store:{pattern.name}' for pattern in store_urls.urlpatterns})
+        self.assertEqual(routes['store:checkout']['requests'], 1)
+        old = {'catalogs': {'50': {'routes': routes}}}
+        slower = {name: dict(stats, p95_ms=stats['p95_ms'] * 2) for name, stats in routes.items()}
+        slower['store:cart']['queries'] += 1
+        changes = benchmark.compare(old, {'catalogs': {'50': {'routes': slower}}})
+        regressions = {(c.route, c.metric) for c in changes if c.regression}
+        self.assertIn(('store:cart', 'queries'), regressions)
+        self.assertNotIn(('store:index', 'queries'), regressions)
+        self.assertIn(('store:index', 'p95_ms'), regressions)
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_paths_use_indexes_and_unindexed_filters_are_reported(self):
+        catalog = benchmark.build_catalog(20)
+
+        problems = {check.source: check.problems for check in query_plans.check_hot_paths(catalog)}
+
+        self.assertEqual(problems, {name: [] for name in query_plans.HOT_PATHS})
+        sql, params = Product.objects.filter(description='x').query.sql_with_params()
+        self.assertEqual(query_plans.full_scans(sql, query_plans.explain(sql, params)), ['store_product'])
+
+
+class OrderIntakeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.product = make_product('phone', stock=5)
+        CartItem.objects.create(user=self.user, product=self.product, quantity=1)
+        self.client.force_login(self.user)
+        self.form = {'full_name': 'Иван', 'address': 'Адрес', 'phone': '123', 'idempotency_key': 'k1'}
+
+    def test_double_submit_creates_one_order(self):
+        first = self.client.post(reverse('store:checkout'), self.form)
+        second = self.client.post(reverse('store:checkout'), self.form)
+
+        self.assertRedirects(first, reverse('store:payment_success'))
+        self.assertRedirects(second, reverse('store:payment_success'))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderCommand.objects.get().status, 'done')
+
+    @override_settings(ORDER_INTAKE_MODE='queue', ORDER_QUEUE_WORKERS=0)
+    def test_queued_order_is_materialized_by_worker(self):
+        response = self.client.post(reverse('store:checkout'), self.form)
+        command = OrderCommand.objects.get()
+
+        self.assertRedirects(response, reverse('store:order_status', args=[command.pk]))
+        self.assertFalse(Order.objects.exists())
+
+        self.assertEqual(process_batch(), 1)
+        command.refresh_from_db()
+        self.assertEqual(command.status, 'done')
+        self.assertEqual(command.order.items.get().product, self.product)
+        self.assertRedirects(
+            self.client.get(reverse('store:order_status', args=[command.pk])),
+            reverse('store:payment_success'),
+        )
+
+    @override_settings(ORDER_INTAKE_MODE='queue', ORDER_QUEUE_WORKERS=0)
+    def test_resubmit_from_reloaded_form_returns_queued_command(self):
+        first = self.client.post(reverse('store:checkout'), self.form)
+        second = self.client.post(reverse('store:checkout'), {**self.form, 'idempotency_key': 'k2'})
+
+        command = OrderCommand.objects.get()
+        self.assertRedirects(second, reverse('store:order_status', args=[command.pk]), fetch_redirect_response=False)
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(process_batch(), 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+        # после оформления та же корзина пуста, новая — оформляется заново
+        self.assertRedirects(self.client.post(reverse('store:checkout'), {**self.form, 'idempotency_key': 'k3'}),
+                             reverse('store:cart'), fetch_redirect_response=False)
+        CartItem.objects.create(user=self.user, product=self.product, quantity=1)
+        self.client.post(reverse('store:checkout'), {**self.form, 'idempotency_key': 'k4'})
+        self.assertEqual(OrderCommand.objects.count(), 2)
+
+    @override_settings(ORDER_INTAKE_MODE='queue', ORDER_QUEUE_WORKERS=0)
+    def test_failed_batch_is_released_and_stale_commands_requeued(self):
+        self.client.post(reverse('store:checkout'), self.form)
+        command = OrderCommand.objects.get()
+
+        with mock.patch('store.order_queue.place_order_from_snapshot', side_effect=OperationalError('locked')), \
+                self.assertRaises(OperationalError):
+            process_batch()
+        command.refresh_from_db()
+        self.assertEqual((command.status, command.claimed_by), ('pending', ''))
+
+        OrderCommand.objects.filter(pk=command.pk).update(
+            status='processing', claimed_by='dead', updated=timezone.now() - timedelta(hours=1))
+        pool = OrderWorkerPool()
+        pool._maintain()
+        self.assertEqual(OrderCommand.objects.get().status, 'pending')
+        OrderCommand.objects.filter(pk=command.pk).update(
+            status='processing', updated=timezone.now() - timedelta(hours=1))
+        pool._maintain()  # не чаще раза в maintenance_interval
+        self.assertEqual(OrderCommand.objects.get().status, 'processing')
+
+    @override_settings(ORDER_INTAKE_MODE='queue', ORDER_QUEUE_WORKERS=0)
+    def test_broken_command_does_not_fail_the_batch(self):
+        self.client.post(reverse('store:checkout'), self.form)
+        broken = OrderCommand.objects.create(user=self.user, idempotency_key='k2', payload={'lines': []})
+
+        with self.assertLogs('store.order_queue', 'ERROR'):
+            self.assertEqual(process_batch(), 2)
+
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, 'failed')
+        self.assertIn('KeyError', broken.error)
+        self.assertEqual(OrderCommand.objects.get(idempotency_key='k1').status, 'done')
+
+
+class DatabaseSetupTests(TestCase):
+    def test_sqlite_pragmas_applied_on_connect(self):
+        values = current_pragmas(connection, ['synchronous', 'busy_timeout', 'cache_size', 'temp_store'])
+
+        self.assertEqual(values, {'synchronous': 1, 'busy_timeout': 5000, 'cache_size': -20000, 'temp_store': 2})
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+        with self.assertRaises(ValueError):
+            apply_pragmas(connection, {'journal_mode': 'WAL; DROP TABLE store_product'})
+
+    def test_journal_mode_is_not_switched_on_connect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # отдельное подключение к новому файлу: connection_created срабатывает как обычно
+            other = connections['default'].__class__({**connection.settings_dict, 'NAME': f'{directory}/journal.sqlite3'})
+            try:
+                self.assertEqual(current_pragmas(other, ['journal_mode', 'busy_timeout']),
+                                 {'journal_mode': 'delete', 'busy_timeout': 5000})
+                self.assertEqual(set_journal_mode(other), 'wal')
+            finally:
+                other.close()
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_last_unit_is_sold_once(self):
+        product = make_product('last', stock=1)
+        users = prepare_buyers(product, 12)
+
+        report = run_concurrent_checkouts(users)
+
+        self.assertEqual(report.succeeded, 1)
+        self.assertEqual(report.out_of_stock, 11)
+        self.assertEqual(report.failed, 0)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_many_buyers_never_oversell(self):
+        product = make_product('hot', stock=7)
+        users = prepare_buyers(product, 30, quantity=2)
+
+        report = run_concurrent_checkouts(users)
+
+        self.assertEqual(report.succeeded, 3)
+        self.assertEqual(report.out_of_stock, 27)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 1)
+        self.assertEqual(Order.objects.count(), 3)
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+
+    def _queries(self, url, client):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(primary), len(replica)
+
+    def test_catalog_reads_go_to_replica_until_visitor_writes(self):
+        product = make_product('replicated')
+        url = reverse('store:product_detail', args=[product.pk])
+        client = Client()
+        client.force_login(User.objects.create_user('reader', password='pw'))
+
+        primary, replica = self._queries(url, client)
+        self.assertGreater(replica, 0)
+        self.assertNotIn(PIN_COOKIE, client.cookies)
+
+        client.post(reverse('store:add_to_cart', args=[product.pk]), {'quantity': 1})
+        self.assertIn(PIN_COOKIE, client.cookies)
+        self.assertEqual(CartItem.objects.count(), 1)
+
+        primary, replica = self._queries(url, client)
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+    def test_session_and_user_are_read_from_primary_inside_replica_reads(self):
+        make_product('replicated')
+        client = Client()
+        client.force_login(User.objects.create_user('reader', password='pw'))
+        url = reverse('store:search_products') + '?q=replicated'
+
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = client.get(url)
+
+        self.assertTrue(response.context['user'].is_authenticated)
+        replica_sql = ' '.join(q['sql'] for q in replica.captured_queries)
+        self.assertIn('store_product', replica_sql)
+        self.assertNotIn('django_session', replica_sql)
+        self.assertNotIn('FROM "auth_user"', replica_sql)
+        primary_sql = ' '.join(q['sql'] for q in primary.captured_queries)
+        self.assertIn('django_session', primary_sql)
+        self.assertIn('FROM "auth_user"', primary_sql)
+
+    def test_other_views_read_from_primary(self):
+        primary, replica = self._queries(reverse('store:cart'), Client())
+        self.assertEqual(replica, 0)
+
+    def test_pages_read_from_stale_replica_are_not_cached(self):
+        mark_replica_synced()
+        product = make_product('replicated')  # версия каталога новее отметки синхронизации
+        url = reverse('store:index')
+
+        for _ in range(2):
+            primary, replica = self._queries(url, Client())
+            self.assertGreater(replica, 0)  # ни страница, ни фрагменты не сохранены
+        self.assertEqual(Client().get(url)['X-Page-Cache'], 'BYPASS')
+
+        mark_replica_synced()
+        self.assertEqual(Client().get(url)['X-Page-Cache'], 'MISS')
+        response = Client().get(url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertContains(response, product.title)
+        self.assertEqual(self._queries(url + '?x=1', Client()), (0, 0))
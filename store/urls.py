@@ -6,6 +6,7 @@ app_name = 'store'
 urlpatterns = [
     # главная
     path('', views.index, name='index'),
+    path('catalog/', views.catalog_page, name='catalog_page'),
 
     # товары
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
@@ -18,6 +19,7 @@ urlpatterns = [
     path('cart/update-quantity/', views.update_cart_quantity, name='update_cart_quantity'),
     path('checkout/', views.CheckoutView.as_view(), name='checkout'),
     path('payment/success/', views.payment_success, name='payment_success'),
+    path('checkout/status/<int:command_id>/', views.order_status, name='order_status'),
     path('orders/', views.orders, name='orders'),
 
     # страницы
@@ -36,6 +38,13 @@ urlpatterns = [
     # поиск
     path('search/', views.search_products, name='search_products'),
 
+    # товарный фид для маркетплейсов
+    path('feeds/catalog.<str:fmt>', views.catalog_feed, name='catalog_feed'),
+
+    # метрики запросов (store/metrics.py)
+    path('metrics/', views.metrics_view, name='metrics'),
+
     #профиль
     path('profile/', views.profile_view, name='profile'),
+    path('uploads/<int:job_id>/status/', views.image_job_status, name='image_job_status'),
 ]
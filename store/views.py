@@ -1,107 +1,138 @@
+import uuid
+
+from django.apps import apps
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from django.contrib.auth import get_user_model, authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.utils import timezone
 from django.contrib import messages
-from django.db.models import Q, Avg
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
-from decimal import Decimal
+from django.views.decorators.http import require_safe
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
 
 from .models import (
-    Product, CartItem, Order, OrderItem,
-    ContactMessage, HeroBanner, Sale, Category, Review, UserProfile
+    Product, Order, OrderItem,
+    ContactMessage, HeroBanner, Sale, Review, UserProfile, OrderCommand, ImageJob
 )
+from .cart import LineNotFound, format_tenge, get_cart
+from .checkout import CheckoutError
 from .forms import ContactForm, RegisterForm, ReviewForm, UserProfileForm
+from .middleware import page_cache_stats
+from .pagination import keyset_paginate, parse_cursor
+from . import facets, feeds, image_queue, metrics, order_queue, search
+from .caching import get_categories
+from .db_routing import replica_reads
 
 
 User = get_user_model()
 
 
-# --- вспомогательная функция для сессии ---
-def _get_session_key(request):
-    """Возвращает session_key, создаёт если нет."""
-    if not request.session.session_key:
-        request.session.create()
-    return request.session.session_key
+# --- Главная страница ---
+def _catalog_page(request):
+    cursor = parse_cursor(request.GET.get('after'))
+    return keyset_paginate(Product.objects.with_prices().select_related('category'), cursor)
 
 
-# --- Главная страница ---
+@replica_reads
 def index(request):
-    products = Product.objects.all()
-    banners = HeroBanner.objects.filter(active=True).order_by('order')
-    categories = Category.objects.all()
+    # баннеры и страница каталога ленивые: при попадании во фрагментный кеш запросов нет
+    page = SimpleLazyObject(lambda: _catalog_page(request))
+    banners = HeroBanner.objects.filter(active=True).select_related('sale').order_by('order')
+    categories = get_categories()
     return render(request, 'index.html', {
-        'products': products,
+        'products': page,
+        'page': page,
+        'cursor': parse_cursor(request.GET.get('after')),
         'banners': banners,
         'categories': categories,
     })
 
 
+# --- Фрагмент каталога для бесконечной прокрутки ---
+@replica_reads
+def catalog_page(request):
+    page = _catalog_page(request)
+    response = render(request, 'catalog_page.html', {'products': page, 'page': page})
+    if page.has_next:
+        response['X-Next-Page'] = f"{reverse('store:catalog_page')}?after={page.next_cursor}"
+    return response
+
+
 # --- Детали товара ---
+REVIEWS_PAGE_SIZE = 10
+
+
+def product_reviews(product_id):
+    """Отзывы товара вместе с авторами (страница отзывов; тот же запрос проверяет check_query_plans)."""
+    return Review.objects.filter(product_id=product_id).select_related('user')
+
+
+@replica_reads
 def product_detail(request, product_id):
     product = get_object_or_404(Product, pk=product_id)
-    avg_rating = product.reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    # средняя оценка и гистограмма хранятся в самом товаре, отзывы — одной страницей вместе с авторами
+    reviews = keyset_paginate(
+        product_reviews(product.pk),
+        parse_cursor(request.GET.get('reviews_after')),
+        REVIEWS_PAGE_SIZE,
+        descending=True,
+    )
     form = ReviewForm()
     return render(request, 'product_detail.html', {
         'product': product,
         'form': form,
-        'avg_rating': avg_rating,
+        'avg_rating': product.average_rating,
+        'reviews': reviews,
     })
 
 
 # --- Добавление товара в корзину ---
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    product = get_object_or_404(Product.objects.with_prices(), id=product_id)
     quantity = int(request.POST.get('quantity', 1)) if request.method == "POST" else 1
 
-    if request.user.is_authenticated:
-        filter_args = {'user': request.user, 'product': product}
-    else:
-        session_key = _get_session_key(request)
-        filter_args = {'session_key': session_key, 'product': product}
-
-    cart_item, created = CartItem.objects.get_or_create(defaults={'quantity': quantity}, **filter_args)
-    if not created:
-        cart_item.quantity += quantity
-        cart_item.save()
-
+    get_cart(request).add(product, quantity)
     return redirect('store:cart')
 
 
 # --- Просмотр корзины ---
 class CartView(View):
     def get(self, request):
-        if request.user.is_authenticated:
-            items = CartItem.objects.filter(user=request.user)
-        else:
-            session_key = _get_session_key(request)
-            items = CartItem.objects.filter(session_key=session_key)
-
-        total = sum(
-            (getattr(it.product, 'discounted_price', it.product.price)) * it.quantity
-            for it in items
-        )
-        return render(request, 'cart.html', {'items': items, 'total': total})
+        cart = get_cart(request)
+        return render(request, 'cart.html', {
+            'items': cart.items(),
+            'total': cart.summary().total,
+            'checkout_key': uuid.uuid4().hex,
+        })
 
 
 # --- Обновление или удаление позиции в корзине ---
 class UpdateCartItemView(View):
     def post(self, request, pk):
-        item = get_object_or_404(CartItem, pk=pk)
+        cart = get_cart(request)
+        try:
+            item = cart.get_item(pk)
+        except LineNotFound as e:
+            raise Http404 from e
         action = request.POST.get('action')
 
         if action == 'remove' or request.POST.get('quantity') == '0':
-            item.delete()
+            cart.remove(item)
         else:
             try:
                 qty = int(request.POST.get('quantity', 1))
             except ValueError:
                 qty = 1
-            item.quantity = max(qty, 1)
-            item.save()
+            cart.set_quantity(item, max(qty, 1))
 
         return redirect('store:cart')
 
@@ -111,12 +142,6 @@ class CheckoutView(LoginRequiredMixin, View):
     login_url = '/login/'
 
     def post(self, request):
-        user = request.user
-        items = CartItem.objects.filter(user=user)
-        if not items.exists():
-            messages.error(request, "Ваша корзина пуста.")
-            return redirect('store:cart')
-
         full_name = request.POST.get('full_name', '').strip()
         address = request.POST.get('address', '').strip()
         phone = request.POST.get('phone', '').strip()
@@ -125,45 +150,41 @@ class CheckoutView(LoginRequiredMixin, View):
             messages.error(request, "Заполните все поля.")
             return redirect('store:cart')
 
-        order = Order.objects.create(
-            user=user,
-            full_name=full_name,
-            address=address,
-            phone=phone,
-            created=timezone.now(),
-            status='processing',
-            total=Decimal('0.00')
-        )
-
-        total = Decimal('0.00')
-        for it in items:
-            product = it.product
-            sale = getattr(product, 'active_sale', None)
+        idempotency_key = request.POST.get('idempotency_key') or uuid.uuid4().hex
+        try:
+            command, created = order_queue.submit_order(request.user, idempotency_key, full_name, address, phone)
+        except CheckoutError as e:
+            messages.error(request, str(e))
+            return redirect('store:cart')
 
-            if sale and sale.discount_percent > 0:
-                discount_percent = Decimal(sale.discount_percent)
-                price = product.price * (Decimal('1.0') - discount_percent / Decimal('100'))
+        if created:
+            if order_queue.intake_mode() == 'queue':
+                order_queue.notify_workers()
             else:
-                price = product.price
-                discount_percent = Decimal('0')
-
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                price=price,
-                quantity=it.quantity,
-                original_price=product.price,
-                discount_percent=discount_percent
-            )
-            total += price * it.quantity
-
-        order.total = total
-        order.save()
-        items.delete()
-
-        request.session['last_order_id'] = order.id
+                order_queue.process_command(command)
+        return _order_command_response(request, command)
+
+
+def _order_command_response(request, command):
+    if command.status == 'done':
+        request.session['last_order_id'] = command.order_id
         messages.success(request, "Заказ оформлен!")
         return redirect('store:payment_success')
+    if command.status == 'failed':
+        messages.error(request, command.error)
+        return redirect('store:cart')
+    return redirect('store:order_status', command_id=command.pk)
+
+
+# --- Статус заказа, принятого в очередь ---
+@login_required
+def order_status(request, command_id):
+    command = get_object_or_404(OrderCommand, pk=command_id, user=request.user)
+    if request.headers.get('Accept') == 'application/json':
+        return JsonResponse({'status': command.status, 'order_id': command.order_id, 'error': command.error})
+    if command.status in ('pending', 'processing'):
+        return render(request, 'order_pending.html', {'command': command})
+    return _order_command_response(request, command)
 
 
 # --- Страница успеха оплаты ---
@@ -181,13 +202,36 @@ def payment_success(request):
 
 
 # --- История заказов ---
+ORDERS_PAGE_SIZE = 10
+
+
+def order_history(queryset):
+    """
+    Заказы с агрегатами по позициям и prefetch позиций вместе с товарами.
+    Агрегаты — коррелированные подзапросы, а не GROUP BY: тогда порядок -pk берётся
+    из индекса внешнего ключа user_id и LIMIT страницы обрывает обход без сортировки.
+    """
+    lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    return queryset.annotate(
+        line_count=Coalesce(Subquery(lines.annotate(n=Count('pk')).values('n')), 0),
+        quantity_total=Subquery(lines.annotate(total=Sum('quantity')).values('total')),
+    ).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('pk'))
+    )
+
+
 def orders(request):
+    """
+    История заказов за постоянное число запросов: страница заказов с агрегатами
+    по позициям и один prefetch позиций вместе с товарами (keyset, от новых к старым).
+    """
     if request.user.is_authenticated:
-        qs = Order.objects.filter(user=request.user).order_by('-created')
+        qs = Order.objects.filter(user=request.user)
     else:
         last_order_id = request.session.get('last_order_id')
         qs = Order.objects.filter(pk=last_order_id) if last_order_id else Order.objects.none()
-    return render(request, 'orders.html', {'orders': qs})
+    page = keyset_paginate(order_history(qs), parse_cursor(request.GET.get('after')), ORDERS_PAGE_SIZE, descending=True)
+    return render(request, 'orders.html', {'orders': page, 'page': page})
 
 
 # --- Статические страницы ---
@@ -244,46 +288,81 @@ def register_view(request):
 
 
 # --- Акции ---
+@replica_reads
 def sale_list(request):
     return render(request, 'sale_list.html', {'sales': Sale.objects.all()})
 
 
+@replica_reads
 def sale_detail(request, sale_id):
     sale = get_object_or_404(Sale, id=sale_id)
     return render(request, 'sale_detail.html', {
         'sale': sale,
-        'products': sale.products.all()
+        'products': sale.products.with_prices()  # ленивый, читается только при промахе кеша
     })
 
 
+# --- Товарный фид ---
+@require_safe
+def catalog_feed(request, fmt):
+    if fmt not in feeds.FORMATS:
+        raise Http404
+    etag, last_modified = feeds.feed_state(fmt)
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is None:
+        rows = feeds.feed_rows(base_url=request.build_absolute_uri('/'))
+        response = StreamingHttpResponse(feeds.render_feed(fmt, rows), content_type=feeds.FORMATS[fmt][0])
+        response['Content-Disposition'] = f'inline; filename="catalog.{fmt}"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+# --- Метрики ---
+def metrics_view(request):
+    """
+    Сводка metrics.py и кеша страниц по этому процессу; только для staff.
+    Адрес из INTERNAL_IPS учитывается лишь при DEBUG: за локальным обратным прокси
+    все запросы приходят с 127.0.0.1.
+    """
+    internal = settings.DEBUG and request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+    if not internal and not request.user.is_staff:
+        raise Http404
+    return JsonResponse({'views': metrics.snapshot(), 'page_cache': page_cache_stats()})
+
+
 # --- Поиск товаров ---
+@replica_reads
 def search_products(request):
     query = request.GET.get('q', '').strip()
     category_id = request.GET.get('category', '')
     min_price = request.GET.get('min_price', '')
     max_price = request.GET.get('max_price', '')
     has_discount = request.GET.get('has_discount', '')
+    min_rating = request.GET.get('min_rating', '')
 
-    products = Product.objects.all()
+    products = Product.objects.with_prices()
 
     if query:
-        products = products.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        products = search.search_products(products, query)
+    categories = get_categories()
+    facet_counts = facets.get_facets(products, query)
+
     if category_id.isdigit():
         products = products.filter(category_id=int(category_id))
-    try:
-        if min_price:
-            products = products.filter(price__gte=float(min_price))
-        if max_price:
-            products = products.filter(price__lte=float(max_price))
-    except ValueError:
-        pass
+    products = facets.filter_price(products, facets.parse_price(min_price), facets.parse_price(max_price))
     if has_discount == '1':
-        products = products.filter(sales__discount_percent__gt=0).distinct()
+        products = products.filter(pricing__discount_percent__gt=0)
+    if min_rating.isdigit():
+        products = facets.filter_min_rating(products, int(min_rating))
 
+    products = list(products)
     return render(request, 'search_results.html', {
         'products': products,
+        'result_count': len(products),
+        'facets': facets.build_facet_links(request.GET, facet_counts, categories),
         'query': query,
-        'categories': Category.objects.all(),
+        'categories': categories,
         'selected_category': int(category_id) if category_id.isdigit() else None,
         'min_price': min_price,
         'max_price': max_price,
@@ -291,6 +370,39 @@ def search_products(request):
     })
 
 
+# --- Загрузка изображений ---
+def _wants_json(request):
+    return request.headers.get('Accept') == 'application/json'
+
+
+def _image_job_payload(job):
+    return {
+        'job_id': job.pk,
+        'status': job.status,
+        'attempts': job.attempts,
+        'error': job.error,
+        'status_url': reverse('store:image_job_status', args=[job.pk]),
+    }
+
+
+def _upload_response(instance, field_name):
+    """Ответ AJAX-загрузке: файл сохранён, производные строит фоновый воркер."""
+    job = image_queue.latest_job(instance, field_name)
+    data = {'success': True, 'job': _image_job_payload(job) if job else None}
+    return JsonResponse(data, status=202 if job and job.status in ('pending', 'processing') else 200)
+
+
+@login_required
+def image_job_status(request, job_id):
+    job = get_object_or_404(ImageJob, pk=job_id, user=request.user)
+    data = _image_job_payload(job)
+    if job.status == 'done':
+        instance = apps.get_model(job.model)._default_manager.filter(pk=job.object_id).first()
+        fieldfile = getattr(instance, job.field, None) if instance else None
+        data['url'] = fieldfile.url if fieldfile else None
+    return JsonResponse(data)
+
+
 # --- Отзывы ---
 @login_required
 def add_review(request, product_id):
@@ -301,7 +413,10 @@ def add_review(request, product_id):
             review = form.save(commit=False)
             review.user = request.user
             review.product = product
-            review.save()
+            with transaction.atomic():
+                review.save()
+            if _wants_json(request):
+                return _upload_response(review, 'image')
             messages.success(request, "Отзыв добавлен!")
             return redirect('store:product_detail', product_id=product.id)
         else:
@@ -323,38 +438,25 @@ def update_cart_quantity(request):
         if quantity < 1:
             return JsonResponse({"success": False, "error": "Количество должно быть ≥ 1"}, status=400)
 
-        item = CartItem.objects.select_related("product").get(pk=item_id)
+        cart = get_cart(request)
+        item = cart.set_quantity(cart.get_item(item_id), quantity)
         product = item.product
-        item.quantity = quantity
-        item.save()
 
-        original_price = float(product.price)
-        discounted_price = float(product.discounted_price)
+        original_price = product.price
+        discounted_price = product.discounted_price
         has_discount = discounted_price < original_price
-        item_total = discounted_price * quantity
-
-        if request.user.is_authenticated:
-            items = CartItem.objects.filter(user=request.user).select_related("product")
-        else:
-            session_key = _get_session_key(request)
-            items = CartItem.objects.filter(session_key=session_key).select_related("product")
-
-        cart_total = sum(float(it.product.discounted_price) * it.quantity for it in items)
-
-        def fmt(v):
-            return f"₸{v:,.0f}".replace(",", " ")
 
         return JsonResponse({
             "success": True,
             "has_discount": has_discount,
-            "original_total": fmt(original_price * quantity) if has_discount else None,
-            "discounted_total": fmt(item_total),
-            "cart_total": fmt(cart_total),
+            "original_total": format_tenge(original_price * quantity) if has_discount else None,
+            "discounted_total": format_tenge(discounted_price * quantity),
+            "cart_total": format_tenge(cart.summary().total),
         })
 
     except (ValueError, TypeError):
         return JsonResponse({"success": False, "error": "Некорректные данные"}, status=400)
-    except CartItem.DoesNotExist:
+    except LineNotFound:
         return JsonResponse({"success": False, "error": "Товар не найден"}, status=404)
 
 @login_required
@@ -365,6 +467,8 @@ def profile_view(request):
         form = UserProfileForm(request.POST, request.FILES, instance=profile)  # <--- добавлено request.FILES
         if form.is_valid():
             form.save()
+            if _wants_json(request):
+                return _upload_response(profile, 'avatar')
             messages.success(request, 'Профиль успешно обновлён.')
             return redirect('store:profile')
     else:
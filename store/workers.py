@@ -0,0 +1,121 @@
+"""
+Пул фоновых потоков для очередей на таблицах БД (заказы, обработка загрузок).
+
+Каждый поток в цикле вызывает process_batch(batch_size); если работы не было,
+засыпает на poll_interval или до вызова wake(). Исключение в пачке только
+логируется: поток не должен умирать из-за одного задания.
+
+Простаивающий поток не чаще раза в maintenance_interval секунд вызывает
+maintenance() — обычно requeue_stale очереди, чтобы застрявшие в processing
+записи возвращались в работу и без отдельного процесса-воркера.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    def __init__(self, process_batch, workers=1, batch_size=50, poll_interval=1.0, name='worker',
+                 maintenance=None, maintenance_interval=60.0):
+        self.process_batch = process_batch
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.name = name
+        self.maintenance = maintenance
+        self.maintenance_interval = maintenance_interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._maintenance_lock = threading.Lock()
+        self._maintenance_due = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            self._threads.append(self._spawn(i))
+        return self
+
+    def _spawn(self, index):
+        thread = threading.Thread(target=self._run, name=f'{self.name}-{index}', daemon=True)
+        thread.start()
+        return thread
+
+    def ensure_running(self):
+        """Перезапускает потоки, завершившиеся не по stop(). Возвращает число перезапущенных."""
+        if self._stopped.is_set():
+            return 0
+        restarted = 0
+        for i, thread in enumerate(self._threads):
+            if not thread.is_alive():
+                logger.warning("%s died, restarting", thread.name)
+                self._threads[i] = self._spawn(i)
+                restarted += 1
+        return restarted
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _maintain(self):
+        """Запускает maintenance(), если подошёл срок; одновременно — только в одном потоке."""
+        if self.maintenance is None or not self._maintenance_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if now < self._maintenance_due:
+                return
+            self._maintenance_due = now + self.maintenance_interval
+            self.maintenance()
+        except Exception:
+            logger.exception("%s maintenance failed", self.name)
+        finally:
+            self._maintenance_lock.release()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            processed = 0
+            try:
+                close_old_connections()
+                processed = self.process_batch(self.batch_size)
+            except Exception:
+                logger.exception("%s failed to process a batch", self.name)
+            if not processed:
+                self._maintain()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        close_old_connections()
+
+
+class LazyPool:
+    """
+    Пул внутри веб-процесса, создаётся при первом обращении; None, если потоков 0.
+    Умершие потоки пула перезапускаются при следующем обращении.
+    """
+
+    def __init__(self, factory, workers_setting):
+        self.factory = factory
+        self.workers_setting = workers_setting
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        workers = getattr(settings, self.workers_setting, 0)
+        if not workers:
+            return None
+        with self._lock:
+            if self._pool is None:
+                self._pool = self.factory(workers).start()
+            else:
+                self._pool.ensure_running()
+        return self._pool